@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+#
+# fixtures.py -- databases and transactions for running the tests
+#
+# createTemplate loads tournament.sql once into a template database, and
+# cloneDatabase copies it with CREATE DATABASE ... TEMPLATE, which copies the
+# files rather than replaying the schema, so each parallel test worker can
+# have a database of its own in well under a second. rolledBack points the
+# API at a single connection whose transaction is rolled back at the end of
+# the block, so a test leaves nothing behind and needs no cleanup.
+
+import os
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+import tournament
+
+
+# The database that CREATE DATABASE and DROP DATABASE are run from.
+MAINTENANCE_DSN = os.environ.get("TOURNAMENT_MAINTENANCE_DSN",
+                                 "dbname=postgres")
+TEMPLATE = "tournament_template"
+
+
+def _maintenance(dsn, statements):
+    """Run statements outside a transaction, as database DDL requires."""
+    conn = psycopg2.connect(dsn)
+    try:
+        conn.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            for statement in statements:
+                cur.execute(statement)
+    finally:
+        conn.close()
+
+
+def databaseDsn(name, dsn=MAINTENANCE_DSN):
+    """Returns dsn with its database replaced by name."""
+    return psycopg2.extensions.make_dsn(dsn, dbname=name)
+
+
+def createTemplate(name=TEMPLATE, dsn=MAINTENANCE_DSN):
+    """Create a database holding an empty schema to clone others from.
+
+    Returns:
+      The connection string of the template.
+    """
+    dropDatabase(name, dsn)
+    _maintenance(dsn, ['CREATE DATABASE "%s"' % (name,)])
+    tournament.initSchema(databaseDsn(name, dsn))
+    return databaseDsn(name, dsn)
+
+
+def cloneDatabase(name, template=TEMPLATE, dsn=MAINTENANCE_DSN):
+    """Create a new database as a copy of a template, replacing any database
+       of the same name.
+
+    Returns:
+      The connection string of the new database.
+    """
+    dropDatabase(name, dsn)
+    _maintenance(dsn, ['CREATE DATABASE "%s" TEMPLATE "%s"' % (name,
+                                                                template)])
+    return databaseDsn(name, dsn)
+
+
+def dropDatabase(name, dsn=MAINTENANCE_DSN):
+    """Drop a database if it exists."""
+    _maintenance(dsn, ['DROP DATABASE IF EXISTS "%s"' % (name,)])
+
+
+class RollbackSession(tournament.TournamentSession):
+    """A session that runs every API call on one connection, in a single
+    transaction that is never committed.
+
+    Each call is wrapped in a savepoint, so a call that raises only undoes
+    its own work as it would with a pooled session. Calls from several
+    threads take turns on the connection. Everything written is rolled back
+    when the session is closed.
+    """
+
+    def __init__(self, dsn=tournament.DEFAULT_DSN, **connect_kwargs):
+        tournament.TournamentSession.__init__(self, dsn, 1, 1,
+                                              **connect_kwargs)
+        self._conn = None
+        self._call_lock = threading.RLock()
+
+    @contextmanager
+    def connection(self):
+        with self._call_lock:
+            if self._conn is None:
+                self._conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+            with self._conn.cursor() as cur:
+                cur.execute("SAVEPOINT api_call")
+            try:
+                yield self._conn
+            except Exception:
+                if not self._conn.closed:
+                    with self._conn.cursor() as cur:
+                        cur.execute("ROLLBACK TO SAVEPOINT api_call")
+                        cur.execute("RELEASE SAVEPOINT api_call")
+                raise
+            with self._conn.cursor() as cur:
+                cur.execute("RELEASE SAVEPOINT api_call")
+
+    def statement(self):
+        """Single statements run in the session's transaction like any other
+           call, as autocommit would commit them."""
+        return self.cursor()
+
+    def close(self):
+        """Roll back everything written and close the connection."""
+        with self._call_lock:
+            if self._conn is not None:
+                if not self._conn.closed:
+                    self._conn.rollback()
+                    self._conn.close()
+                self._conn = None
+        tournament._forgetPrepared()
+
+
+@contextmanager
+def rolledBack(dsn=None):
+    """Point the API at a RollbackSession for the duration of the block.
+
+    Everything the block writes is rolled back when it exits and the
+    previous session is restored. Notifications are never delivered, as
+    the transaction is never committed.
+    """
+    previous = tournament.getSession()
+    session = RollbackSession(dsn or previous.dsn)
+    tournament.setSession(session, close=False)
+    try:
+        yield session
+    finally:
+        tournament.setSession(previous, close=False)
+        session.close()
+        tournament.getCache().clear()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+#
+# instrumentation.py -- opt-in timing of the tournament API
+#
+# When enabled, every call to a tournament.py API function produces one
+# record with the time spent waiting for a connection, executing statements
+# and fetching rows, the rows returned and the text of each statement. The
+# records are passed to any number of sinks. Statements slower than the
+# threshold are run again under EXPLAIN (ANALYZE, BUFFERS) inside a savepoint
+# that is rolled back, so the plan is captured without repeating any writes.
+
+import json
+import logging
+import threading
+import time
+from functools import wraps
+
+
+_local = threading.local()
+
+
+class Instrumentation(object):
+    """Passes a record of every API call to a list of sinks.
+
+    Args:
+      sinks  : callables that are passed each record as a dict.
+      slow_ms: statements taking at least this many milliseconds have their
+               plan captured with EXPLAIN (ANALYZE, BUFFERS). None disables
+               plan capture.
+    """
+
+    def __init__(self, sinks, slow_ms=None):
+        self.sinks = list(sinks)
+        self.slow_ms = slow_ms
+
+    def emit(self, record):
+        """Pass a finished record to every sink."""
+        for sink in self.sinks:
+            sink(record)
+
+
+class CallRecord(object):
+    """The timings collected during a single API call."""
+
+    def __init__(self, instrumentation, function):
+        self.instrumentation = instrumentation
+        self.function = function
+        self.started = time.time()
+        self.connect_ms = 0.0
+        self.execute_ms = 0.0
+        self.fetch_ms = 0.0
+        self.rows = 0
+        self.statements = []
+
+    def asDict(self):
+        """Returns the record as a dict, with the time spent outside the
+           database reported as python_ms."""
+        total_ms = (time.time() - self.started) * 1000.0
+        return {"function": self.function,
+                "total_ms": total_ms,
+                "connect_ms": self.connect_ms,
+                "execute_ms": self.execute_ms,
+                "fetch_ms": self.fetch_ms,
+                "python_ms": max(0.0, total_ms - self.connect_ms -
+                                 self.execute_ms - self.fetch_ms),
+                "rows": self.rows,
+                "statements": self.statements}
+
+
+def current():
+    """Returns the record of the API call running on this thread, if any."""
+    return getattr(_local, "record", None)
+
+
+def instrumented(getInstrumentation):
+    """Decorate an API function so each call is recorded while
+       getInstrumentation() returns an Instrumentation. Calls made from
+       inside another API call are part of the outer call's record."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            instrumentation = getInstrumentation()
+            if instrumentation is None or current() is not None:
+                return func(*args, **kwargs)
+            _local.record = CallRecord(instrumentation, func.__name__)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record = _local.record
+                _local.record = None
+                instrumentation.emit(record.asDict())
+        return wrapper
+    return decorator
+
+
+class InstrumentedCursor(object):
+    """Wraps a cursor, adding its execute and fetch times to a record."""
+
+    def __init__(self, cursor, record):
+        self._cursor = cursor
+        self._record = record
+        self._statement = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def execute(self, query, vars=None):
+        start = time.time()
+        try:
+            return self._cursor.execute(query, vars)
+        finally:
+            elapsed = (time.time() - start) * 1000.0
+            self._record.execute_ms += elapsed
+            self._statement = {"statement": " ".join(query.split()),
+                               "execute_ms": elapsed,
+                               "fetch_ms": 0.0,
+                               "rows": 0,
+                               "explain": None}
+            self._record.statements.append(self._statement)
+            slow_ms = self._record.instrumentation.slow_ms
+            if slow_ms is not None and elapsed >= slow_ms:
+                self._statement["explain"] = self._explain(query, vars)
+
+    def _explain(self, query, vars):
+        """Returns the EXPLAIN (ANALYZE, BUFFERS) output of a statement,
+           run inside a savepoint that is rolled back, or a transaction of
+           its own on an autocommit connection."""
+        conn = self._cursor.connection
+        if conn.autocommit:
+            (begin, undo) = ("BEGIN", "ROLLBACK")
+        else:
+            (begin, undo) = ("SAVEPOINT instrumentation_explain",
+                             "ROLLBACK TO SAVEPOINT instrumentation_explain")
+        cur = conn.cursor()
+        try:
+            cur.execute(begin)
+            try:
+                cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, vars)
+                return "\n".join(row[0] for row in cur.fetchall())
+            finally:
+                cur.execute(undo)
+        except Exception as e:
+            return "EXPLAIN failed: %s" % (e,)
+        finally:
+            cur.close()
+
+    def _fetched(self, start, rows):
+        elapsed = (time.time() - start) * 1000.0
+        self._record.fetch_ms += elapsed
+        self._record.rows += rows
+        if self._statement is not None:
+            self._statement["fetch_ms"] += elapsed
+            self._statement["rows"] += rows
+
+    def fetchone(self):
+        start = time.time()
+        row = self._cursor.fetchone()
+        self._fetched(start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.time()
+        if size is None:
+            rows = self._cursor.fetchmany()
+        else:
+            rows = self._cursor.fetchmany(size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.time()
+        rows = self._cursor.fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+
+class LoggingSink(object):
+    """Writes a one line summary of each call to a logger, and the captured
+       plan of any slow statement."""
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger("tournament")
+        self.level = level
+
+    def __call__(self, record):
+        self.logger.log(self.level,
+                        "%s total=%.2fms connect=%.2fms execute=%.2fms "
+                        "fetch=%.2fms python=%.2fms rows=%d statements=%d",
+                        record["function"], record["total_ms"],
+                        record["connect_ms"], record["execute_ms"],
+                        record["fetch_ms"], record["python_ms"],
+                        record["rows"], len(record["statements"]))
+        for statement in record["statements"]:
+            if statement["explain"]:
+                self.logger.log(self.level, "%s slow statement %.2fms: %s\n%s",
+                                record["function"], statement["execute_ms"],
+                                statement["statement"], statement["explain"])
+
+
+class HistogramSink(object):
+    """Keeps a latency histogram of each API function in memory.
+
+    Args:
+      bounds: the upper bound in milliseconds of each bucket, calls slower
+              than the last bound are counted in a final overflow bucket.
+    """
+
+    def __init__(self, bounds=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)):
+        self.bounds = tuple(bounds)
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        bucket = len(self.bounds)
+        for (i, bound) in enumerate(self.bounds):
+            if record["total_ms"] <= bound:
+                bucket = i
+                break
+        with self._lock:
+            counts = self.histograms.setdefault(
+                record["function"], [0] * (len(self.bounds) + 1))
+            counts[bucket] += 1
+
+    def summary(self):
+        """Returns a dict mapping each function to a list of
+           (upper bound, count) tuples, the overflow bound being None."""
+        with self._lock:
+            return dict((function, list(zip(self.bounds + (None,), counts)))
+                        for (function, counts) in self.histograms.items())
+
+
+class JsonLinesSink(object):
+    """Appends each record to a file as a line of JSON."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, sort_keys=True)
+        with self._lock:
+            with open(self.path, "a") as output:
+                output.write(line + "\n")
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+#
+# live.py -- standings kept up to date from database notifications
+#
+# Every statement that writes t_matches or t_registrations sends a
+# notification on the tournament_standings channel when it commits, naming
+# the tournament and the players whose results changed (see
+# f_notify_standings in tournament.sql). A StandingsSubscriber listens on a
+# single connection and keeps a copy of each tournament it follows in
+# memory. On a change it reads back only the changed players and their
+# opponents, whose opponent match wins may have moved, and re-ranks the copy
+# locally, so any number of displays can read live standings for the cost of
+# one small query per change.
+
+import json
+import select
+import threading
+
+import psycopg2
+import psycopg2.extensions
+
+import tournament
+
+
+CHANNEL = "tournament_standings"
+
+
+class _TournamentCopy(object):
+    """The raw t_standings totals of one tournament, ranked on demand in the
+       same way as v_standings."""
+
+    def __init__(self, values, rows):
+        (self.win_value, self.loss_value, self.draw_value,
+         self.bye_value) = values
+        self.rows = {}
+        self.update(rows)
+
+    def update(self, rows):
+        """Replace the rows of the players in rows, each being (player_id,
+           name, wins, losses, draws, rounds_played, opponent_match_wins)."""
+        for row in rows:
+            self.rows[row[0]] = row[1:]
+        self._standings = None
+
+    def remove(self, player_ids):
+        """Drop the rows of players no longer registered."""
+        for player_id in player_ids:
+            self.rows.pop(player_id, None)
+        self._standings = None
+
+    def standings(self):
+        """Returns the standings in the form playerStandings does."""
+        if self._standings is None:
+            rounds = max([r[4] for r in self.rows.values()] or [0])
+            ranked = []
+            for (player_id, (name, wins, losses, draws, rounds_played,
+                             omw)) in self.rows.items():
+                byes = rounds - (wins + losses + draws)
+                score = (wins * self.win_value + byes * self.bye_value +
+                         losses * self.loss_value + draws * self.draw_value)
+                ranked.append((-score, -omw, player_id,
+                               (player_id, name, wins + byes, losses, draws,
+                                wins + byes + losses + draws, omw)))
+            ranked.sort()
+            self._standings = [r[3] for r in ranked]
+        return self._standings
+
+
+class StandingsSubscriber(object):
+    """Follows the standings of some tournaments through notifications.
+
+    Call open() to load the standings and start listening, then either call
+    poll() from an event loop or start() to poll from a background thread.
+
+    Args:
+      tourn_ids: the tournaments to follow.
+      dsn      : the connection string, the shared session's by default.
+      callback : called with (tourn_id, standings) after a tournament's
+                 standings change.
+    """
+
+    def __init__(self, tourn_ids, dsn=None, callback=None):
+        self.dsn = dsn or tournament.getSession().dsn
+        self.callbacks = [callback] if callback else []
+        self.queries = 0
+        self._tourn_ids = list(tourn_ids)
+        self._copies = {}
+        self._conn = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def open(self):
+        """Start listening and load the standings of every tournament."""
+        self._conn = psycopg2.connect(self.dsn)
+        self._conn.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        cur = self._conn.cursor()
+        # Listen before loading, so no change can fall between the two.
+        cur.execute("LISTEN " + CHANNEL)
+        cur.close()
+        for tourn_id in self._tourn_ids:
+            self._reload(tourn_id)
+        return self
+
+    def close(self):
+        """Stop polling and close the connection."""
+        self.stop()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def subscribe(self, callback):
+        """Add a callback to be called with (tourn_id, standings) after a
+           tournament's standings change."""
+        self.callbacks.append(callback)
+
+    def standings(self, tourn_id):
+        """Returns the local copy of a tournament's standings, in the form
+           playerStandings returns them."""
+        with self._lock:
+            return list(self._copies[tourn_id].standings())
+
+    def poll(self, timeout=0):
+        """Apply the notifications that have arrived, waiting up to timeout
+           seconds for the first. Returns the ids of the tournaments whose
+           standings changed."""
+        if not self._conn.notifies:
+            if select.select([self._conn], [], [], timeout) == ([], [], []):
+                return []
+        self._conn.poll()
+        changes = {}
+        while self._conn.notifies:
+            notify = self._conn.notifies.pop(0)
+            if notify.channel != CHANNEL:
+                continue
+            payload = json.loads(notify.payload)
+            tourn_id = payload["tourn_id"]
+            if tourn_id not in self._copies:
+                continue
+            # Every change to a tournament polled together is applied with
+            # one query, a reload winning over any list of players.
+            players = payload["players"]
+            if players is None or changes.get(tourn_id, ()) is None:
+                changes[tourn_id] = None
+            else:
+                changes.setdefault(tourn_id, set()).update(players)
+        for (tourn_id, players) in changes.items():
+            if players is None:
+                self._reload(tourn_id)
+            else:
+                self._refresh(tourn_id, players)
+        for tourn_id in changes:
+            standings = self.standings(tourn_id)
+            for callback in self.callbacks:
+                callback(tourn_id, standings)
+        return list(changes)
+
+    def start(self, interval=1.0):
+        """Poll from a daemon thread until stop() is called."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the polling thread, if one was started."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            self.poll(interval)
+
+    def _reload(self, tourn_id):
+        """Load every row of a tournament."""
+        cur = self._conn.cursor()
+        try:
+            cur.execute("""SELECT t.tourn_win_value,
+                                  t.tourn_loss_value,
+                                  t.tourn_draw_value,
+                                  t.tourn_bye_value,
+                                  s.player_id,
+                                  p.player_name,
+                                  s.wins,
+                                  s.losses,
+                                  s.draws,
+                                  s.rounds_played,
+                                  s.opponent_match_wins
+                             FROM t_tournaments t
+                                LEFT OUTER JOIN t_standings s
+                                  ON (s.tourn_id = t.tourn_id)
+                                LEFT OUTER JOIN t_players p
+                                  ON (p.player_id = s.player_id)
+                            WHERE t.tourn_id = %s""", (tourn_id,))
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+        self.queries += 1
+        if not rows:
+            raise ValueError("Tournament %s does not exist." % (tourn_id,))
+        copy = _TournamentCopy(rows[0][:4],
+                               [row[4:] for row in rows
+                                if row[4] is not None])
+        with self._lock:
+            self._copies[tourn_id] = copy
+
+    def _refresh(self, tourn_id, players):
+        """Read back the changed players and everyone they have met."""
+        players = list(players)
+        cur = self._conn.cursor()
+        try:
+            cur.execute("""SELECT s.player_id,
+                                  p.player_name,
+                                  s.wins,
+                                  s.losses,
+                                  s.draws,
+                                  s.rounds_played,
+                                  s.opponent_match_wins
+                             FROM t_standings s
+                                INNER JOIN t_players p
+                                   ON (p.player_id = s.player_id)
+                            WHERE s.tourn_id = %s
+                              AND (s.player_id = ANY(%s)
+                                   OR s.player_id IN (
+                                       SELECT o.opponent_id
+                                         FROM t_opponents o
+                                        WHERE o.tourn_id = %s
+                                          AND o.player_id = ANY(%s)))""",
+                        (tourn_id, players, tourn_id, players))
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+        self.queries += 1
+        found = set(row[0] for row in rows)
+        with self._lock:
+            copy = self._copies[tourn_id]
+            copy.remove([p for p in players if p not in found])
+            copy.update(rows)
@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+#
+# matching.py -- maximum weight matching in a general graph
+#
+# An implementation of Edmonds' blossom algorithm with the primal-dual
+# weight updates of Galil's "Efficient algorithms for finding maximum
+# matching in graphs", following the well known structure of Joris van
+# Rantwijk's mwmatching.py. It runs in O(n^3) time for n vertices, but on the
+# sparse graphs built by pairing.weightedPairPlayers each stage only touches
+# a few edges per vertex.
+#
+# Edges are (i, j, weight) tuples with vertices numbered from 0. Weights must
+# be integers, which keeps every dual variable an integer and the result
+# exact.
+
+
+def maxWeightMatching(edges, maxcardinality=False):
+    """Returns a maximum weight matching of a general graph.
+
+    Args:
+      edges         : a list of (i, j, weight) tuples, i and j being distinct
+                      vertex numbers from 0 and weight an integer. There must
+                      be at most one edge between any two vertices.
+      maxcardinality: when True only matchings with the largest possible
+                      number of edges are considered, the heaviest of those
+                      being returned.
+
+    Returns:
+      A list mate, mate[v] being the vertex matched to v or -1 if v is not
+      matched.
+    """
+    if not edges:
+        return []
+
+    nedge = len(edges)
+    nvertex = 0
+    for (i, j, weight) in edges:
+        if i < 0 or j < 0 or i == j:
+            raise ValueError("Invalid edge (%s, %s)." % (i, j))
+        nvertex = max(nvertex, i + 1, j + 1)
+    # Doubling the weights keeps the slack of every edge between two S
+    # vertices even, so delta is always an integer.
+    edges = [(i, j, 2 * weight) for (i, j, weight) in edges]
+    maxweight = max(0, max(weight for (i, j, weight) in edges))
+
+    # Edge k has endpoints 2k and 2k+1, endpoint[p] being the vertex.
+    endpoint = [edges[p // 2][p % 2] for p in range(2 * nedge)]
+    # neighbend[v] lists the remote endpoints of the edges at v.
+    neighbend = [[] for _ in range(nvertex)]
+    for (k, (i, j, weight)) in enumerate(edges):
+        neighbend[i].append(2 * k + 1)
+        neighbend[j].append(2 * k)
+
+    # mate[v] is the remote endpoint of v's matched edge, or -1.
+    mate = [-1] * nvertex
+    # Top level blossoms are labelled 0 (free), 1 (S) or 2 (T), label 5 is
+    # used temporarily by scanBlossom. labelend[b] is the endpoint through
+    # which b got its label.
+    label = [0] * (2 * nvertex)
+    labelend = [-1] * (2 * nvertex)
+    inblossom = list(range(nvertex))
+    blossomparent = [-1] * (2 * nvertex)
+    blossomchilds = [None] * (2 * nvertex)
+    blossombase = list(range(nvertex)) + [-1] * nvertex
+    blossomendps = [None] * (2 * nvertex)
+    bestedge = [-1] * (2 * nvertex)
+    blossombestedges = [None] * (2 * nvertex)
+    unusedblossoms = list(range(nvertex, 2 * nvertex))
+    dualvar = [maxweight] * nvertex + [0] * nvertex
+    allowedge = [False] * nedge
+    queue = []
+
+    def slack(k):
+        (i, j, weight) = edges[k]
+        return dualvar[i] + dualvar[j] - 2 * weight
+
+    def blossomLeaves(b):
+        if b < nvertex:
+            yield b
+        else:
+            for t in blossomchilds[b]:
+                if t < nvertex:
+                    yield t
+                else:
+                    for v in blossomLeaves(t):
+                        yield v
+
+    def assignLabel(w, t, p):
+        # Label the top level blossom containing w through endpoint p, and
+        # the mate of a T blossom's base as S.
+        b = inblossom[w]
+        label[w] = label[b] = t
+        labelend[w] = labelend[b] = p
+        bestedge[w] = bestedge[b] = -1
+        if t == 1:
+            queue.extend(blossomLeaves(b))
+        else:
+            base = blossombase[b]
+            assignLabel(endpoint[mate[base]], 1, mate[base] ^ 1)
+
+    def scanBlossom(v, w):
+        # Trace back from v and w to find a new blossom's base, or -1 if
+        # they lead to different roots and an augmenting path was found.
+        path = []
+        base = -1
+        while v != -1 or w != -1:
+            b = inblossom[v]
+            if label[b] & 4:
+                base = blossombase[b]
+                break
+            path.append(b)
+            label[b] = 5
+            if labelend[b] == -1:
+                v = -1
+            else:
+                v = endpoint[labelend[b]]
+                b = inblossom[v]
+                v = endpoint[labelend[b]]
+            if w != -1:
+                v, w = w, v
+        for b in path:
+            label[b] = 1
+        return base
+
+    def addBlossom(base, k):
+        # Make a new blossom from the edge k between two S vertices and the
+        # paths back to their common base.
+        (v, w, weight) = edges[k]
+        bb = inblossom[base]
+        bv = inblossom[v]
+        bw = inblossom[w]
+        b = unusedblossoms.pop()
+        blossombase[b] = base
+        blossomparent[b] = -1
+        blossomparent[bb] = b
+        blossomchilds[b] = path = []
+        blossomendps[b] = endps = []
+        while bv != bb:
+            blossomparent[bv] = b
+            path.append(bv)
+            endps.append(labelend[bv])
+            v = endpoint[labelend[bv]]
+            bv = inblossom[v]
+        path.append(bb)
+        path.reverse()
+        endps.reverse()
+        endps.append(2 * k)
+        while bw != bb:
+            blossomparent[bw] = b
+            path.append(bw)
+            endps.append(labelend[bw] ^ 1)
+            w = endpoint[labelend[bw]]
+            bw = inblossom[w]
+        label[b] = 1
+        labelend[b] = labelend[bb]
+        dualvar[b] = 0
+        for v in blossomLeaves(b):
+            if label[inblossom[v]] == 2:
+                queue.append(v)
+            inblossom[v] = b
+        # Keep the least slack edge from the new blossom to each S blossom.
+        bestedgeto = [-1] * (2 * nvertex)
+        for bv in path:
+            if blossombestedges[bv] is None:
+                nblists = [[p // 2 for p in neighbend[v]]
+                           for v in blossomLeaves(bv)]
+            else:
+                nblists = [blossombestedges[bv]]
+            for nblist in nblists:
+                for k in nblist:
+                    (i, j, weight) = edges[k]
+                    if inblossom[j] == b:
+                        i, j = j, i
+                    bj = inblossom[j]
+                    if (bj != b and label[bj] == 1 and
+                            (bestedgeto[bj] == -1 or
+                             slack(k) < slack(bestedgeto[bj]))):
+                        bestedgeto[bj] = k
+            blossombestedges[bv] = None
+            bestedge[bv] = -1
+        blossombestedges[b] = [k for k in bestedgeto if k != -1]
+        bestedge[b] = -1
+        for k in blossombestedges[b]:
+            if bestedge[b] == -1 or slack(k) < slack(bestedge[b]):
+                bestedge[b] = k
+
+    def expandBlossom(b, endstage):
+        # Turn the children of blossom b back into top level blossoms.
+        for s in blossomchilds[b]:
+            blossomparent[s] = -1
+            if s < nvertex:
+                inblossom[s] = s
+            elif endstage and dualvar[s] == 0:
+                expandBlossom(s, endstage)
+            else:
+                for v in blossomLeaves(s):
+                    inblossom[v] = s
+        if not endstage and label[b] == 2:
+            # Relabel the children on the even length path from the entry
+            # child to the base, and clear the others.
+            entrychild = inblossom[endpoint[labelend[b] ^ 1]]
+            j = blossomchilds[b].index(entrychild)
+            if j & 1:
+                j -= len(blossomchilds[b])
+                jstep = 1
+                endptrick = 0
+            else:
+                jstep = -1
+                endptrick = 1
+            p = labelend[b]
+            while j != 0:
+                label[endpoint[p ^ 1]] = 0
+                label[endpoint[blossomendps[b][j - endptrick] ^
+                               endptrick ^ 1]] = 0
+                assignLabel(endpoint[p ^ 1], 2, p)
+                allowedge[blossomendps[b][j - endptrick] // 2] = True
+                j += jstep
+                p = blossomendps[b][j - endptrick] ^ endptrick
+                allowedge[p // 2] = True
+                j += jstep
+            bv = blossomchilds[b][j]
+            label[endpoint[p ^ 1]] = label[bv] = 2
+            labelend[endpoint[p ^ 1]] = labelend[bv] = p
+            bestedge[bv] = -1
+            j += jstep
+            while blossomchilds[b][j] != entrychild:
+                bv = blossomchilds[b][j]
+                if label[bv] == 1:
+                    j += jstep
+                    continue
+                for v in blossomLeaves(bv):
+                    if label[v] != 0:
+                        break
+                if label[v] != 0:
+                    label[v] = 0
+                    label[endpoint[mate[blossombase[bv]]]] = 0
+                    assignLabel(v, 2, labelend[v])
+                j += jstep
+        label[b] = labelend[b] = -1
+        blossomchilds[b] = blossomendps[b] = None
+        blossombase[b] = -1
+        blossombestedges[b] = None
+        bestedge[b] = -1
+        unusedblossoms.append(b)
+
+    def augmentBlossom(b, v):
+        # Swap the matched and unmatched edges on the path through blossom
+        # b from vertex v to its base, making v the new base.
+        t = v
+        while blossomparent[t] != b:
+            t = blossomparent[t]
+        if t >= nvertex:
+            augmentBlossom(t, v)
+        i = j = blossomchilds[b].index(t)
+        if i & 1:
+            j -= len(blossomchilds[b])
+            jstep = 1
+            endptrick = 0
+        else:
+            jstep = -1
+            endptrick = 1
+        while j != 0:
+            j += jstep
+            t = blossomchilds[b][j]
+            p = blossomendps[b][j - endptrick] ^ endptrick
+            if t >= nvertex:
+                augmentBlossom(t, endpoint[p])
+            j += jstep
+            t = blossomchilds[b][j]
+            if t >= nvertex:
+                augmentBlossom(t, endpoint[p ^ 1])
+            mate[endpoint[p]] = p ^ 1
+            mate[endpoint[p ^ 1]] = p
+        blossomchilds[b] = blossomchilds[b][i:] + blossomchilds[b][:i]
+        blossomendps[b] = blossomendps[b][i:] + blossomendps[b][:i]
+        blossombase[b] = blossombase[blossomchilds[b][0]]
+
+    def augmentMatching(k):
+        # Swap the matched and unmatched edges along the augmenting path
+        # through edge k, which joins the trees of two free vertices.
+        (v, w, weight) = edges[k]
+        for (s, p) in ((v, 2 * k + 1), (w, 2 * k)):
+            while True:
+                bs = inblossom[s]
+                if bs >= nvertex:
+                    augmentBlossom(bs, s)
+                mate[s] = p
+                if labelend[bs] == -1:
+                    break
+                t = endpoint[labelend[bs]]
+                bt = inblossom[t]
+                s = endpoint[labelend[bt]]
+                j = endpoint[labelend[bt] ^ 1]
+                if bt >= nvertex:
+                    augmentBlossom(bt, j)
+                mate[j] = labelend[bt]
+                p = labelend[bt] ^ 1
+
+    # Each stage either augments the matching by one edge or proves that
+    # no further augmentation improves it.
+    for _ in range(nvertex):
+        label[:] = [0] * (2 * nvertex)
+        bestedge[:] = [-1] * (2 * nvertex)
+        blossombestedges[nvertex:] = [None] * nvertex
+        allowedge[:] = [False] * nedge
+        queue[:] = []
+        for v in range(nvertex):
+            if mate[v] == -1 and label[inblossom[v]] == 0:
+                assignLabel(v, 1, -1)
+
+        augmented = False
+        while True:
+            while queue and not augmented:
+                v = queue.pop()
+                for p in neighbend[v]:
+                    k = p // 2
+                    w = endpoint[p]
+                    if inblossom[v] == inblossom[w]:
+                        continue
+                    if not allowedge[k]:
+                        kslack = slack(k)
+                        if kslack <= 0:
+                            allowedge[k] = True
+                    if allowedge[k]:
+                        if label[inblossom[w]] == 0:
+                            assignLabel(w, 2, p ^ 1)
+                        elif label[inblossom[w]] == 1:
+                            base = scanBlossom(v, w)
+                            if base >= 0:
+                                addBlossom(base, k)
+                            else:
+                                augmentMatching(k)
+                                augmented = True
+                                break
+                        elif label[w] == 0:
+                            label[w] = 2
+                            labelend[w] = p ^ 1
+                    elif label[inblossom[w]] == 1:
+                        b = inblossom[v]
+                        if bestedge[b] == -1 or kslack < slack(bestedge[b]):
+                            bestedge[b] = k
+                    elif label[w] == 0:
+                        if bestedge[w] == -1 or kslack < slack(bestedge[w]):
+                            bestedge[w] = k
+            if augmented:
+                break
+
+            # No tight edge leads anywhere, so adjust the dual variables by
+            # the largest delta that keeps every slack non-negative.
+            deltatype = -1
+            delta = deltaedge = deltablossom = None
+            if not maxcardinality:
+                deltatype = 1
+                delta = min(dualvar[:nvertex])
+            for v in range(nvertex):
+                if label[inblossom[v]] == 0 and bestedge[v] != -1:
+                    d = slack(bestedge[v])
+                    if deltatype == -1 or d < delta:
+                        delta = d
+                        deltatype = 2
+                        deltaedge = bestedge[v]
+            for b in range(2 * nvertex):
+                if (blossomparent[b] == -1 and label[b] == 1 and
+                        bestedge[b] != -1):
+                    d = slack(bestedge[b]) // 2
+                    if deltatype == -1 or d < delta:
+                        delta = d
+                        deltatype = 3
+                        deltaedge = bestedge[b]
+            for b in range(nvertex, 2 * nvertex):
+                if (blossombase[b] >= 0 and blossomparent[b] == -1 and
+                        label[b] == 2 and
+                        (deltatype == -1 or dualvar[b] < delta)):
+                    delta = dualvar[b]
+                    deltatype = 4
+                    deltablossom = b
+            if deltatype == -1:
+                # Only reachable with maxcardinality, when no augmenting
+                # path is left.
+                deltatype = 1
+                delta = max(0, min(dualvar[:nvertex]))
+
+            for v in range(nvertex):
+                if label[inblossom[v]] == 1:
+                    dualvar[v] -= delta
+                elif label[inblossom[v]] == 2:
+                    dualvar[v] += delta
+            for b in range(nvertex, 2 * nvertex):
+                if blossombase[b] >= 0 and blossomparent[b] == -1:
+                    if label[b] == 1:
+                        dualvar[b] += delta
+                    elif label[b] == 2:
+                        dualvar[b] -= delta
+
+            if deltatype == 1:
+                break
+            elif deltatype == 2:
+                allowedge[deltaedge] = True
+                (i, j, weight) = edges[deltaedge]
+                if label[inblossom[i]] == 0:
+                    i, j = j, i
+                queue.append(i)
+            elif deltatype == 3:
+                allowedge[deltaedge] = True
+                (i, j, weight) = edges[deltaedge]
+                queue.append(i)
+            else:
+                expandBlossom(deltablossom, False)
+
+        if not augmented:
+            break
+
+        # Expand the S blossoms whose dual variable has reached zero.
+        for b in range(nvertex, 2 * nvertex):
+            if (blossomparent[b] == -1 and blossombase[b] >= 0 and
+                    label[b] == 1 and dualvar[b] == 0):
+                expandBlossom(b, True)
+
+    for v in range(nvertex):
+        if mate[v] >= 0:
+            mate[v] = endpoint[mate[v]]
+    return mate
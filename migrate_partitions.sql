@@ -0,0 +1,121 @@
+-- Migration for databases created with an unpartitioned t_matches and
+-- t_registrations, converting them to the partitioned tables of
+-- tournament.sql.
+--
+--     psql -d tournament -f migrate_partitions.sql
+--
+-- Everything runs in one transaction. The views over the two tables and
+-- their triggers are saved from the catalog, dropped, and recreated once the
+-- new tables are in place. A partition is created for every tournament and
+-- the rows are copied across before the triggers are recreated, so
+-- t_standings and t_opponents are left as they were.
+
+\set ON_ERROR_STOP on
+
+BEGIN;
+
+LOCK TABLE t_tournaments, t_matches, t_registrations IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE t_tournaments
+  ADD COLUMN IF NOT EXISTS tourn_archived BOOLEAN NOT NULL DEFAULT FALSE;
+
+
+-- Save the definitions that refer to the old tables, in creation order.
+CREATE TEMPORARY TABLE migrate_views ON COMMIT DROP AS
+SELECT c.oid,
+       c.relname,
+       pg_get_viewdef(c.oid) AS definition
+  FROM pg_class c
+ WHERE c.relkind = 'v'
+   AND c.relnamespace = (SELECT n.oid
+                           FROM pg_namespace n
+                          WHERE n.nspname = current_schema())
+   AND c.relname LIKE 'v\_%';
+
+CREATE TEMPORARY TABLE migrate_triggers ON COMMIT DROP AS
+SELECT t.oid,
+       pg_get_triggerdef(t.oid) AS definition
+  FROM pg_trigger t
+ WHERE t.tgrelid IN ('t_matches'::REGCLASS, 't_registrations'::REGCLASS)
+   AND NOT t.tgisinternal;
+
+DO $$
+DECLARE
+    v_view RECORD;
+BEGIN
+    FOR v_view IN SELECT relname FROM migrate_views ORDER BY oid DESC LOOP
+        EXECUTE format('DROP VIEW IF EXISTS %I', v_view.relname);
+    END LOOP;
+END;
+$$;
+
+
+-- Move the old tables aside, freeing the index and key names.
+ALTER TABLE t_matches RENAME TO t_matches_unpartitioned;
+ALTER TABLE t_registrations RENAME TO t_registrations_unpartitioned;
+ALTER TABLE t_matches_unpartitioned DROP CONSTRAINT t_matches_pkey;
+DROP INDEX i_matches_idx1, i_matches_idx2, i_matches_idx3,
+           i_registrations_idx1;
+ALTER SEQUENCE t_matches_match_id_seq OWNED BY NONE;
+
+
+-- The partitioned tables, as defined in tournament.sql. match_id keeps
+-- drawing from the existing sequence.
+CREATE TABLE t_matches
+(
+    match_id    INTEGER NOT NULL DEFAULT nextval('t_matches_match_id_seq'),
+    tourn_id    INTEGER NOT NULL REFERENCES t_tournaments(tourn_id),
+    match_no    INTEGER NOT NULL,
+    player_id   INTEGER NOT NULL REFERENCES t_players(player_id),
+    result_type VARCHAR(1) NOT NULL,
+    PRIMARY KEY (tourn_id, match_id)
+) PARTITION BY LIST (tourn_id);
+CREATE INDEX i_matches_idx1 ON t_matches (tourn_id, player_id, match_no);
+CREATE INDEX i_matches_idx2 ON t_matches (tourn_id, player_id, result_type);
+CREATE INDEX i_matches_idx3 ON t_matches (tourn_id, match_no);
+ALTER SEQUENCE t_matches_match_id_seq OWNED BY t_matches.match_id;
+
+CREATE TABLE t_registrations
+(
+    tourn_id  INTEGER NOT NULL REFERENCES t_tournaments(tourn_id),
+    player_id INTEGER NOT NULL REFERENCES t_players(player_id)
+) PARTITION BY LIST (tourn_id);
+CREATE UNIQUE INDEX i_registrations_idx1 ON t_registrations(tourn_id, player_id);
+
+
+-- The partition functions and trigger, shared with tournament.sql.
+\ir tournament_partitions.sql
+
+
+-- Copy the rows into a partition per tournament.
+SELECT f_create_tourn_partitions(t.tourn_id) FROM t_tournaments t;
+
+INSERT INTO t_matches (match_id, tourn_id, match_no, player_id, result_type)
+SELECT m.match_id, m.tourn_id, m.match_no, m.player_id, m.result_type
+  FROM t_matches_unpartitioned m;
+
+INSERT INTO t_registrations (tourn_id, player_id)
+SELECT r.tourn_id, r.player_id
+  FROM t_registrations_unpartitioned r;
+
+DROP TABLE t_matches_unpartitioned, t_registrations_unpartitioned;
+
+
+-- Recreate the triggers and views that were saved.
+DO $$
+DECLARE
+    v_definition RECORD;
+BEGIN
+    FOR v_definition IN SELECT definition FROM migrate_triggers ORDER BY oid
+    LOOP
+        EXECUTE v_definition.definition;
+    END LOOP;
+    FOR v_definition IN SELECT relname, definition FROM migrate_views
+                         ORDER BY oid LOOP
+        EXECUTE format('CREATE VIEW %I AS %s', v_definition.relname,
+                       rtrim(v_definition.definition, E'; \n'));
+    END LOOP;
+END;
+$$;
+
+COMMIT;
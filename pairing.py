@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+#
+# pairing.py -- in-memory Swiss pairing engine used by tournament.py
+#
+# Players are paired one score group at a time from the top of the standings
+# down. Within a group the top half is paired against the bottom half, as the
+# Swiss system recommends, and a depth first search swaps opponents whenever
+# that would produce a rematch. Players who cannot be paired inside their
+# group float down into the next group. Late in long events, when the search
+# runs out of budget or cannot avoid a rematch, the round is paired by
+# weightedPairPlayers instead.
+#
+# weightedPairPlayers is an alternative that pairs across score groups by
+# maximum weight matching (see matching.py), minimising a cost made up of
+# score differences, rematches, repeat byes and distance from the preferred
+# opponent. pairingCosts reports those costs for any round's pairing.
+
+import matching
+
+
+# The number of candidate opponents the search may try over a whole round, on
+# top of a few per player, before it gives up and the round is paired by
+# weightedPairPlayers. It keeps pathological histories from turning into an
+# exponential search.
+DEFAULT_BUDGET = 20000
+
+# The candidates allowed per player on top of the budget, enough for every
+# group to be paired at the first attempt several times over.
+TRIES_PER_PLAYER = 4
+
+
+class _BudgetExhausted(Exception):
+    """Raised when the search has tried every candidate it is allowed."""
+
+
+class _Budget(object):
+    """The candidates left for the searches of one pairPlayers call."""
+
+    def __init__(self, tries):
+        self.tries = tries
+
+    def spend(self):
+        self.tries -= 1
+        if self.tries < 0:
+            raise _BudgetExhausted()
+
+
+def pairPlayers(players, opponents, budget=DEFAULT_BUDGET):
+    """Pair every player for the next round.
+
+    Args:
+      players  : a list of (player_id, score, byes) tuples in standings order,
+                 the player in first place first.
+      opponents: a dict mapping each player_id to a set of the player ids they
+                 have already played.
+      budget   : the number of extra candidate opponents the search may try
+                 over the whole round. If it runs out, or the round cannot be
+                 paired group by group without a rematch, the round is paired
+                 by weightedPairPlayers, which keeps rematches to a minimum.
+
+    Returns:
+      A tuple of (pairs, bye):
+        pairs: a list of (id1, id2) tuples, id1 being the higher ranked.
+        bye: the id of the player receiving a bye, or None when there is an
+             even number of players.
+    """
+    try:
+        return _pairByGroups(list(players), opponents,
+                             _Budget(budget +
+                                     TRIES_PER_PLAYER * len(players)))
+    except _BudgetExhausted:
+        return _pairByWeight(players, opponents)
+
+
+def _pairByGroups(ranked, opponents, budget):
+    """Pair one score group at a time, returning (pairs, bye) as pairPlayers
+       does, or weightedPairPlayers' pairing if a rematch is unavoidable."""
+    players = ranked
+    bye = None
+    if len(ranked) % 2:
+        bye = _chooseBye(ranked)
+        ranked = [p for p in ranked if p[0] != bye]
+
+    groups = []
+    for player in ranked:
+        if groups and groups[-1][0][1] == player[1]:
+            groups[-1].append(player)
+        else:
+            groups.append([player])
+
+    pairs = []
+    carry = []
+    for index, group in enumerate(groups):
+        pool = carry + group
+        last = index == len(groups) - 1
+        paired, carry = _pairGroup(pool, opponents, budget, last)
+        if paired is None:
+            carry = pool
+            continue
+        pairs.extend(paired)
+
+    if carry:
+        # The bottom of the field cannot be paired without rematches between
+        # the groups as they stand, so pair everyone that is left by rank,
+        # then the whole field by rank, before pairing by weight, which
+        # keeps any rematches to a minimum.
+        paired = _searchPairs(carry, opponents, budget, adjacent=True)
+        if paired is None:
+            paired = _searchPairs(ranked, opponents, budget, adjacent=True)
+            if paired is not None:
+                return paired, bye
+            return _pairByWeight(players, opponents)
+        pairs.extend(paired)
+    return pairs, bye
+
+
+def _pairByWeight(players, opponents):
+    """Pair a round the search could not, by weightedPairPlayers with every
+       player of a block a candidate, so no rematch is made that the block
+       could avoid."""
+    return weightedPairPlayers(players, opponents, window=len(players))
+
+
+def _chooseBye(ranked):
+    """Returns the lowest ranked player among those with the fewest byes."""
+    fewest = min(p[2] for p in ranked)
+    for player in reversed(ranked):
+        if player[2] == fewest:
+            return player[0]
+
+
+def _pairGroup(pool, opponents, budget, last):
+    """Pair a score group together with any players floated into it.
+
+    Returns:
+      A tuple of (pairs, floaters). When the group has an odd number of
+      players the lowest ranked player that leaves a valid pairing floats
+      down. pairs is None if the group could not be paired at all.
+    """
+    if len(pool) % 2 == 0:
+        return _searchPairs(pool, opponents, budget), []
+    if last:
+        return None, pool
+    for drop in range(len(pool) - 1, -1, -1):
+        rest = pool[:drop] + pool[drop + 1:]
+        paired = _searchPairs(rest, opponents, budget)
+        if paired is not None:
+            return paired, [pool[drop]]
+    return None, pool
+
+
+def _candidates(a, size, used, met, ids, adjacent):
+    """Yield the positions a player at position a could be paired with.
+
+    The preferred opponent is the player at the same position in the bottom
+    half of the group, or the next player when adjacent is set, and the
+    search widens outwards from there.
+    """
+    half = size // 2
+    if adjacent or a >= half:
+        target = a + 1
+    else:
+        target = a + half
+    reach = max(size - target, target - a)
+    for offset in range(reach):
+        for b in (target + offset, target - offset) if offset else (target,):
+            if a < b < size and not used[b] and ids[b] not in met:
+                yield b
+
+
+def _searchPairs(pool, opponents, budget, adjacent=False):
+    """Depth first search for a pairing of pool with no rematches.
+
+    Returns:
+      A list of (id1, id2) tuples, or None if there is no such pairing.
+
+    Raises:
+      _BudgetExhausted: if the budget runs out first.
+    """
+    size = len(pool)
+    ids = [p[0] for p in pool]
+    used = [False] * size
+    stack = []
+    first = 0
+    empty = frozenset()
+    while True:
+        while first < size and used[first]:
+            first += 1
+        if first == size:
+            return [(ids[a], ids[b]) for (a, b, _) in stack]
+        used[first] = True
+        met = opponents.get(ids[first], empty)
+        stack.append((first, None,
+                      _candidates(first, size, used, met, ids, adjacent)))
+        # Advance the newest choice, backtracking while it is exhausted.
+        while stack:
+            (a, b, choices) = stack.pop()
+            if b is not None:
+                used[b] = False
+            b = next(choices, None)
+            budget.spend()
+            if b is not None:
+                used[b] = True
+                stack.append((a, b, choices))
+                first = a + 1
+                break
+            used[a] = False
+        else:
+            return None
+
+
+# The number of places either side of a player's preferred opponent that
+# weightedPairPlayers offers as candidates, and the number of players it
+# matches at a time. Together they bound the size of each matching problem.
+DEFAULT_WINDOW = 12
+DEFAULT_BLOCK_SIZE = 64
+
+
+class PairingCosts(object):
+    """The penalties weightedPairPlayers minimises over the whole round.
+
+    Args:
+      score  : per square of the difference in score between two players.
+      rematch: for pairing two players who have already met.
+      bye    : per bye already received by the player given the bye.
+      rank   : per place an opponent is from the one the Swiss system
+               prefers, the player at the same position in the other half of
+               the score group.
+    """
+
+    def __init__(self, score=100, rematch=100000, bye=100000, rank=1):
+        self.score = score
+        self.rematch = rematch
+        self.bye = bye
+        self.rank = rank
+
+
+def weightedPairPlayers(players, opponents, costs=None,
+                        window=DEFAULT_WINDOW, block_size=DEFAULT_BLOCK_SIZE):
+    """Pair every player by maximum weight matching.
+
+    Unlike pairPlayers, which pairs one score group at a time and floats
+    players down when a group cannot be paired, this finds the pairing with
+    the lowest total cost across groups. Two heuristics keep it fast on large
+    fields: each player is only offered the window of players around their
+    preferred opponent and those just below them, and the standings are
+    matched in blocks of about block_size players, a block's unmatched
+    players being carried into the next.
+
+    Args:
+      players   : a list of (player_id, score, byes) tuples in standings
+                  order, as pairPlayers takes.
+      opponents : a dict mapping each player_id to a set of the player ids
+                  they have already played.
+      costs     : the PairingCosts to minimise, the defaults if None.
+      window    : the number of candidate places either side of a player's
+                  preferred opponent.
+      block_size: the number of players matched at once, at least 2.
+
+    Returns:
+      A tuple of (pairs, bye) in the form pairPlayers returns.
+    """
+    if block_size < 2:
+        raise ValueError("block_size must be at least 2, a block of one "
+                         "player cannot be paired.")
+    costs = costs or PairingCosts()
+    ranked = list(players)
+    bye = None
+    if len(ranked) % 2:
+        last = len(ranked) - 1
+        bye = min(range(len(ranked)),
+                  key=lambda i: _byeCost(last - i, ranked[i], costs)["total"])
+        bye = ranked[bye][0]
+        ranked = [p for p in ranked if p[0] != bye]
+    targets = _targets(ranked)
+
+    pairs = []
+    carry = []
+    start = 0
+    while start < len(ranked):
+        end = min(len(ranked), start + block_size)
+        # Finish the block at the end of a score group when one is close.
+        while (end < len(ranked) and end < start + block_size * 3 // 2 and
+               ranked[end][1] == ranked[end - 1][1]):
+            end += 1
+        block = carry + list(range(start, end))
+        if len(block) % 2 and end < len(ranked):
+            block.pop()
+            end -= 1
+        matched, carry = _matchBlock(block, ranked, targets, opponents, costs,
+                                     window)
+        pairs.extend(matched)
+        start = end
+    if carry:
+        # The players left at the bottom could not be paired within their
+        # windows, so match them against every other player left.
+        matched, carry = _matchBlock(carry, ranked, targets, opponents, costs,
+                                     len(carry))
+        pairs.extend(matched)
+    return [(ranked[a][0], ranked[b][0]) for (a, b) in pairs], bye
+
+
+def pairingCosts(players, opponents, pairs, bye, costs=None):
+    """Returns the costs of a round's pairing, so the choices made can be
+       audited.
+
+    Args:
+      players  : the (player_id, score, byes) tuples the round was paired
+                 from, in standings order.
+      opponents: a dict mapping each player_id to a set of the player ids
+                 they had already played.
+      pairs    : the (id1, id2) pairs of the round.
+      bye      : the id of the player given the bye, or None.
+      costs    : the PairingCosts the round was paired with.
+
+    Returns:
+      A list of (id1, id2, cost) tuples, one for each pair and a final one
+      with an id2 of None for the bye. cost is a dict of the score, rematch,
+      bye and rank penalties and their total.
+    """
+    costs = costs or PairingCosts()
+    ranked = [p for p in players if p[0] != bye]
+    targets = _targets(ranked)
+    positions = dict((p[0], i) for (i, p) in enumerate(ranked))
+    results = []
+    for (id1, id2) in pairs:
+        (a, b) = sorted((positions[id1], positions[id2]))
+        results.append((id1, id2,
+                        _pairCost(ranked, targets, opponents, costs, a, b)))
+    if bye is not None:
+        places = [i for (i, p) in enumerate(reversed(players)) if p[0] == bye]
+        results.append((bye, None,
+                        _byeCost(places[0], players[-1 - places[0]], costs)))
+    return results
+
+
+def _targets(ranked):
+    """Returns the position of the opponent the Swiss system prefers for
+       each player: the same position in the bottom half of their score
+       group for the top half, and the next player below for the rest."""
+    targets = []
+    start = 0
+    while start < len(ranked):
+        end = start
+        while end < len(ranked) and ranked[end][1] == ranked[start][1]:
+            end += 1
+        half = (end - start) // 2
+        for i in range(start, end):
+            if i - start < half:
+                targets.append(i + half)
+            else:
+                targets.append(i + 1)
+        start = end
+    return targets
+
+
+def _pairCost(ranked, targets, opponents, costs, a, b):
+    """Returns the cost of pairing the players at positions a < b."""
+    meetings = 1 if ranked[b][0] in opponents.get(ranked[a][0], ()) else 0
+    cost = {"score": costs.score * (ranked[a][1] - ranked[b][1]) ** 2,
+            "rematch": costs.rematch * meetings,
+            "bye": 0,
+            "rank": costs.rank * abs(b - targets[a])}
+    cost["total"] = sum(cost.values())
+    return cost
+
+
+def _byeCost(places, player, costs):
+    """Returns the cost of giving the bye to player, who is places from the
+       bottom of the standings. Byes go to the player with the fewest byes,
+       the lowest ranked first."""
+    cost = {"score": 0,
+            "rematch": 0,
+            "bye": costs.bye * player[2],
+            "rank": costs.rank * places}
+    cost["total"] = sum(cost.values())
+    return cost
+
+
+def _matchBlock(block, ranked, targets, opponents, costs, window):
+    """Match the players at the positions in block, a list in rank order.
+
+    Returns:
+      A tuple of (pairs, unmatched), pairs being (a, b) tuples of positions
+      with a < b and unmatched the positions left without an opponent.
+    """
+    size = len(block)
+    index = dict((position, i) for (i, position) in enumerate(block))
+    candidates = {}
+    for (i, a) in enumerate(block):
+        # The players just below, and those around the preferred opponent.
+        near = set(block[i + 1:i + 1 + window])
+        target = index.get(targets[a])
+        if target is None:
+            target = min(size - 1, i + 1)
+        near.update(block[max(i + 1, target - window):target + window + 1])
+        for b in near:
+            candidates[(a, b)] = _pairCost(ranked, targets, opponents, costs,
+                                           a, b)["total"]
+    if not candidates:
+        return [], list(block)
+    ceiling = max(candidates.values()) + 1
+    edges = [(index[a], index[b], ceiling - cost)
+             for ((a, b), cost) in candidates.items()]
+    mate = matching.maxWeightMatching(edges, maxcardinality=True)
+    mate.extend([-1] * (size - len(mate)))
+    pairs = [(block[i], block[j]) for (i, j) in enumerate(mate) if i < j]
+    unmatched = [block[i] for (i, j) in enumerate(mate) if j == -1]
+    return sorted(pairs), unmatched
+
+
+# The pairing methods tournament.py can be asked to use, by name.
+METHODS = {
+    "dutch": pairPlayers,
+    "weighted": weightedPairPlayers,
+}
+
+
+def getMethod(name):
+    """Returns the pairing function registered under name."""
+    if name not in METHODS:
+        raise ValueError("Unknown pairing method '%s', expected one of %s."
+                         % (name, ", ".join(sorted(METHODS))))
+    return METHODS[name]
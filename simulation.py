@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+#
+# simulation.py -- Monte Carlo what-if runs over a snapshot of a tournament
+#
+# simulate takes a state.TournamentState and plays further rounds many times
+# over in memory, pairing each round with the same pairing.METHODS as
+# swissPairings and scoring it with the tournament's win, loss, draw and bye
+# values. Nothing is written to the database, so a director can ask how many
+# rounds a field needs before one player leads alone, and how often byes are
+# repeated or rematches forced, before the event starts.
+#
+# Each trial keeps its scores in plain lists indexed by standings position
+# and draws every result of a round in one batch. Trials are played in
+# fixed-size chunks by a pool of worker processes, each chunk seeded from the
+# run's seed, so a run with a seed gives the same outcomes on any number of
+# processes.
+
+import math
+import multiprocessing
+import random
+
+import pairing
+
+
+# The number of trials each worker plays at a time.
+CHUNK_SIZE = 25
+
+# The outcomes recorded for every trial.
+OUTCOMES = ("decided", "leaders", "winner_score", "byes", "repeat_byes",
+            "rematches")
+
+
+class SimulationResult(object):
+    """The outcomes of every trial of a simulation.
+
+    Attributes:
+      trials  : the number of trials played.
+      rounds  : the number of rounds each trial played.
+      outcomes: a dict mapping each name in OUTCOMES to a list of its value
+                in each trial:
+                  decided     : the round after which one player first led
+                                alone, counting the rounds already played,
+                                or None if no trial round decided it.
+                  leaders     : the players sharing the lead after the last
+                                round.
+                  winner_score: the leading score after the last round.
+                  byes        : the byes given.
+                  repeat_byes : the byes given to a player who had one.
+                  rematches   : the pairs of players who had met before.
+      winners : a dict mapping player ids to the number of trials they
+                finished first in, on score then opponent match wins.
+    """
+
+    def __init__(self, rounds):
+        self.trials = 0
+        self.rounds = rounds
+        self.outcomes = dict((name, []) for name in OUTCOMES)
+        self.winners = {}
+
+    def _add(self, trials):
+        for (outcome, winner) in trials:
+            self.trials += 1
+            for name in OUTCOMES:
+                self.outcomes[name].append(outcome[name])
+            self.winners[winner] = self.winners.get(winner, 0) + 1
+
+    def distribution(self, name):
+        """Returns a sorted list of (value, fraction of trials) tuples for
+           one outcome."""
+        counts = {}
+        for value in self.outcomes[name]:
+            counts[value] = counts.get(value, 0) + 1
+        # None, a trial never decided, sorts last.
+        return [(value, float(count) / self.trials)
+                for (value, count) in sorted(
+                    counts.items(), key=lambda c: (c[0] is None, c[0]))]
+
+    def mean(self, name):
+        """Returns the mean of an outcome over the trials it has a value
+           in, or None if it has none."""
+        values = [v for v in self.outcomes[name] if v is not None]
+        if not values:
+            return None
+        return float(sum(values)) / len(values)
+
+    def percentile(self, name, percent):
+        """Returns the smallest value of an outcome that at least percent of
+           the trials are at or below, None counting as above every value."""
+        values = sorted(self.outcomes[name],
+                        key=lambda v: (v is None, v))
+        if not values:
+            return None
+        index = int(math.ceil(len(values) * percent / 100.0)) - 1
+        return values[min(max(index, 0), len(values) - 1)]
+
+    def summary(self):
+        """Returns a dict mapping each outcome to a dict of its mean, median,
+           90th percentile and maximum."""
+        return dict((name, {"mean": self.mean(name),
+                            "p50": self.percentile(name, 50),
+                            "p90": self.percentile(name, 90),
+                            "max": self.percentile(name, 100)})
+                    for name in OUTCOMES)
+
+
+def defaultRounds(players):
+    """Returns the rounds simulated when none are given, a few more than the
+       log2(players) a Swiss event needs to leave one unbeaten player."""
+    return int(math.ceil(math.log(max(players, 2), 2))) + 3
+
+
+def simulate(snapshot, values, rounds=None, trials=1000, method="dutch",
+             draw_rate=0.0, favourite=0.5, seed=None, processes=None):
+    """Play the next rounds of a tournament many times over.
+
+    Args:
+      snapshot : a state.TournamentState of the tournament as it stands.
+      values   : the tournament's (win, loss, draw, bye) values.
+      rounds   : the number of rounds each trial plays, defaultRounds() of
+                 the field by default.
+      trials   : the number of trials to play.
+      method   : the pairing method from pairing.METHODS.
+      draw_rate: the chance that a game is drawn.
+      favourite: the chance that the higher ranked player of a pair wins a
+                 game that is not drawn.
+      seed     : seeds the trials, so a run can be repeated.
+      processes: the number of worker processes, the number of CPUs by
+                 default, or 0 to play every trial in this process.
+
+    Returns:
+      A SimulationResult.
+    """
+    pairing.getMethod(method)
+    if len(snapshot) < 2:
+        raise ValueError("A simulation needs at least two players.")
+    if not 0 <= draw_rate <= 1 or not 0 <= favourite <= 1:
+        raise ValueError("draw_rate and favourite must be between 0 and 1.")
+    if rounds is None:
+        rounds = defaultRounds(len(snapshot))
+    if seed is None:
+        seed = random.randrange(2 ** 31)
+
+    # Plain lists pickle cheaply and the same way on every Python.
+    start = (list(snapshot.player_ids),
+             list(snapshot.scores),
+             [w - b for (w, b) in zip(snapshot.wins, snapshot.byes)],
+             list(snapshot.byes),
+             [list(snapshot.opponentPositions(i))
+              for i in range(len(snapshot))],
+             max([w + l + d for (w, l, d) in zip(snapshot.wins,
+                                                 snapshot.losses,
+                                                 snapshot.draws)] or [0]))
+    settings = (tuple(values), rounds, method, draw_rate, favourite)
+    chunks = [(start, settings, seed + i, min(CHUNK_SIZE, trials - n))
+              for (i, n) in enumerate(range(0, trials, CHUNK_SIZE))]
+
+    result = SimulationResult(rounds)
+    if processes == 0 or len(chunks) < 2:
+        for chunk in chunks:
+            result._add(_playTrials(chunk))
+        return result
+    pool = multiprocessing.Pool(processes)
+    try:
+        for played in pool.imap(_playTrials, chunks):
+            result._add(played)
+    finally:
+        pool.close()
+        pool.join()
+    return result
+
+
+def _playTrials(chunk):
+    """Play one chunk of trials, run in a worker process by simulate.
+
+    Returns:
+      A list of (outcome, winner) tuples, outcome being a dict of OUTCOMES.
+    """
+    (start, settings, seed, count) = chunk
+    (player_ids, scores, wins, byes, meetings, played) = start
+    ((win_value, loss_value, draw_value, bye_value), rounds, method,
+     draw_rate, favourite) = settings
+    pair = pairing.getMethod(method)
+    rng = random.Random(seed)
+    positions = range(len(player_ids))
+    decisive = draw_rate + (1 - draw_rate) * favourite
+
+    trials = []
+    for _ in range(count):
+        score = list(scores)
+        won = list(wins)
+        had_bye = list(byes)
+        met = [list(m) for m in meetings]
+        opponents = dict((p, set(met[p])) for p in positions)
+        outcome = {"decided": None, "byes": 0, "repeat_byes": 0,
+                   "rematches": 0}
+        for round_no in range(played + 1, played + rounds + 1):
+            omw = [sum(won[o] for o in met[p]) for p in positions]
+            order = sorted(positions,
+                           key=lambda p: (-score[p], -omw[p], player_ids[p]))
+            (pairs, bye) = pair([(p, score[p], had_bye[p]) for p in order],
+                                opponents)
+            if bye is not None:
+                outcome["byes"] += 1
+                if had_bye[bye]:
+                    outcome["repeat_byes"] += 1
+                had_bye[bye] += 1
+                score[bye] += bye_value
+            draws = [rng.random() for _ in pairs]
+            for ((a, b), r) in zip(pairs, draws):
+                if b in opponents[a]:
+                    outcome["rematches"] += 1
+                opponents[a].add(b)
+                opponents[b].add(a)
+                met[a].append(b)
+                met[b].append(a)
+                if r < draw_rate:
+                    score[a] += draw_value
+                    score[b] += draw_value
+                    continue
+                (winner, loser) = (a, b) if r < decisive else (b, a)
+                score[winner] += win_value
+                score[loser] += loss_value
+                won[winner] += 1
+            top = max(score)
+            if outcome["decided"] is None and score.count(top) == 1:
+                outcome["decided"] = round_no
+        top = max(score)
+        omw = [sum(won[o] for o in met[p]) for p in positions]
+        first = min(positions,
+                    key=lambda p: (-score[p], -omw[p], player_ids[p]))
+        outcome["leaders"] = score.count(top)
+        outcome["winner_score"] = top
+        trials.append((outcome, player_ids[first]))
+    return trials
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+#
+# state.py -- compact in-memory model of a tournament's standings
+#
+# A TournamentState keeps one typed array per column instead of a tuple per
+# player, and the opponent history as a single array of player positions
+# with an offset per player (compressed sparse rows). That costs a few dozen
+# bytes per player plus four bytes per meeting, so a 100k player event fits
+# in a few megabytes. Player names are kept in a plain list and are not
+# counted in nbytes().
+
+from array import array
+from bisect import bisect_left
+
+
+class PlayerRecord(object):
+    """A read-only view of one player in a TournamentState."""
+
+    __slots__ = ("_state", "_index")
+
+    def __init__(self, state, index):
+        self._state = state
+        self._index = index
+
+    @property
+    def player_id(self):
+        return self._state.player_ids[self._index]
+
+    @property
+    def name(self):
+        return self._state.names[self._index]
+
+    @property
+    def wins(self):
+        return self._state.wins[self._index]
+
+    @property
+    def losses(self):
+        return self._state.losses[self._index]
+
+    @property
+    def draws(self):
+        return self._state.draws[self._index]
+
+    @property
+    def byes(self):
+        return self._state.byes[self._index]
+
+    @property
+    def opponent_match_wins(self):
+        return self._state.opponent_match_wins[self._index]
+
+    @property
+    def score(self):
+        return self._state.scores[self._index]
+
+    @property
+    def opponents(self):
+        """The ids of every opponent met, once per meeting."""
+        return self._state.opponentIds(self._index)
+
+    def __repr__(self):
+        return "PlayerRecord(%r, %r, score=%r)" % (self.player_id, self.name,
+                                                   self.score)
+
+
+class TournamentState(object):
+    """The standings and opponent history of a tournament held in columns.
+
+    Players are held in standings order. wins includes byes, as it does in
+    playerStandings.
+    """
+
+    __slots__ = ("tourn_id", "player_ids", "names", "wins", "losses", "draws",
+                 "byes", "opponent_match_wins", "scores", "offsets",
+                 "opponents", "_sorted_ids", "_sorted_positions")
+
+    def __init__(self, tourn_id, rows):
+        """Build the state from standings rows.
+
+        Args:
+          tourn_id: the tournament the rows belong to.
+          rows    : (player_id, name, wins, losses, draws, byes,
+                    opponent_match_wins, score, opponent_ids) tuples in
+                    standings order, opponent_ids being a list of the ids of
+                    every opponent met.
+        """
+        rows = list(rows)
+        self.tourn_id = tourn_id
+        self.player_ids = array('i', (r[0] for r in rows))
+        self.names = [r[1] for r in rows]
+        self.wins = array('h', (r[2] for r in rows))
+        self.losses = array('h', (r[3] for r in rows))
+        self.draws = array('h', (r[4] for r in rows))
+        self.byes = array('h', (r[5] for r in rows))
+        self.opponent_match_wins = array('i', (r[6] for r in rows))
+        self.scores = array('i', (r[7] for r in rows))
+        # Player ids are looked up by binary search over a sorted copy
+        # rather than a dict, which would cost far more than the columns.
+        order = sorted(range(len(rows)), key=lambda i: rows[i][0])
+        self._sorted_ids = array('i', (rows[i][0] for i in order))
+        self._sorted_positions = array('i', order)
+        self.offsets = array('i', [0])
+        self.opponents = array('i')
+        for r in rows:
+            for o in (r[8] or ()):
+                position = self._find(o)
+                if position is not None:
+                    self.opponents.append(position)
+            self.offsets.append(len(self.opponents))
+
+    def __len__(self):
+        return len(self.player_ids)
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self.player_ids):
+            raise IndexError(index)
+        return PlayerRecord(self, index)
+
+    def __iter__(self):
+        for i in range(len(self.player_ids)):
+            yield PlayerRecord(self, i)
+
+    def _find(self, player_id):
+        """Returns the position of a player, or None if they are not held."""
+        i = bisect_left(self._sorted_ids, player_id)
+        if i < len(self._sorted_ids) and self._sorted_ids[i] == player_id:
+            return self._sorted_positions[i]
+        return None
+
+    def position(self, player_id):
+        """Returns the position of a player in the state."""
+        position = self._find(player_id)
+        if position is None:
+            raise KeyError(player_id)
+        return position
+
+    def opponentPositions(self, index):
+        """Returns the positions of every opponent the player at index has
+           met, once per meeting."""
+        return self.opponents[self.offsets[index]:self.offsets[index + 1]]
+
+    def opponentIds(self, index):
+        """Returns the ids of every opponent the player at index has met."""
+        return [self.player_ids[o] for o in self.opponentPositions(index)]
+
+    def haveMet(self, player_id, opponent_id):
+        """Returns True if the two players have played each other."""
+        return (self.position(opponent_id) in
+                self.opponentPositions(self.position(player_id)))
+
+    def ranking(self, tiebreak=None):
+        """Returns the positions of the players ranked by score, then by
+           tiebreak (a column of the same length, opponent_match_wins by
+           default) and player id."""
+        if tiebreak is None:
+            tiebreak = self.opponent_match_wins
+        scores = self.scores
+        ids = self.player_ids
+        return array('i', sorted(range(len(ids)),
+                                 key=lambda i: (-scores[i], -tiebreak[i],
+                                                ids[i])))
+
+    def scoreGroups(self, order=None):
+        """Split a ranking into its score groups.
+
+        Args:
+          order: player positions in ranked order, ranking() by default.
+
+        Returns:
+          A list of (score, positions) tuples from the highest score down,
+          positions being an array of the players on that score.
+        """
+        if order is None:
+            order = self.ranking()
+        groups = []
+        start = 0
+        scores = self.scores
+        for end in range(1, len(order) + 1):
+            if end == len(order) or scores[order[end]] != scores[order[start]]:
+                groups.append((scores[order[start]], order[start:end]))
+                start = end
+        return groups
+
+    def pairingInput(self):
+        """Returns the (players, opponents) arguments pairing.pairPlayers
+           expects, in ranked order."""
+        players = [(self.player_ids[i], self.scores[i], self.byes[i])
+                   for i in self.ranking()]
+        opponents = dict((self.player_ids[i], set(self.opponentIds(i)))
+                         for i in range(len(self.player_ids)))
+        return players, opponents
+
+    def standings(self):
+        """Returns the standings in the form playerStandings does."""
+        return [(r.player_id, r.name, r.wins, r.losses, r.draws,
+                 r.wins + r.losses + r.draws, r.opponent_match_wins)
+                for r in (self[i] for i in self.ranking())]
+
+    def nbytes(self):
+        """Returns the bytes held by the column arrays."""
+        return sum(column.itemsize * len(column) for column in (
+            self.player_ids, self.wins, self.losses, self.draws, self.byes,
+            self.opponent_match_wins, self.scores, self.offsets,
+            self.opponents, self._sorted_ids, self._sorted_positions))
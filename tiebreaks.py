@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#
+# tiebreaks.py -- tiebreak calculations for tournament standings
+#
+# Every tiebreak is calculated from one load of a tournament's match records.
+# Players are numbered densely so their totals live in flat lists indexed by
+# that number, and each tiebreak is a single pass over the list of meetings,
+# which keeps the whole calculation linear in the number of matches.
+
+
+# The lowest match win percentage credited to any opponent, as used by the
+# DCI so that a player is not penalised heavily for meeting a player who
+# went on to lose every match.
+OMW_FLOOR = 1.0 / 3.0
+
+
+def matchWinPercentages(points, rounds, win_value, floor=OMW_FLOOR):
+    """Returns each player's match points as a fraction of the points
+       available, no lower than floor."""
+    available = float(rounds * win_value)
+    if available <= 0:
+        return [floor] * len(points)
+    return [max(floor, p / available) for p in points]
+
+
+def _omw(state):
+    """Opponents' match win percentage, the average of the floored match
+       win percentages of every opponent met."""
+    mwp = state["mwp"]
+    totals = [0.0] * state["size"]
+    counts = [0] * state["size"]
+    for (i, j, result) in state["meetings"]:
+        totals[i] += mwp[j]
+        counts[i] += 1
+    return [t / c if c else 0.0 for (t, c) in zip(totals, counts)]
+
+
+def _buchholz(state):
+    """The sum of the scores of every opponent met."""
+    points = state["points"]
+    totals = [0] * state["size"]
+    for (i, j, result) in state["meetings"]:
+        totals[i] += points[j]
+    return totals
+
+
+def _medianBuchholz(state):
+    """Buchholz without the highest and lowest scoring opponents. A player
+       who has met two opponents or fewer has none left once both are
+       trimmed, so plain Buchholz is used for them instead."""
+    points = state["points"]
+    scores = [[] for _ in range(state["size"])]
+    for (i, j, result) in state["meetings"]:
+        scores[i].append(points[j])
+    totals = []
+    for s in scores:
+        if len(s) > 2:
+            totals.append(sum(s) - max(s) - min(s))
+        else:
+            totals.append(sum(s))
+    return totals
+
+
+def _sonnebornBerger(state):
+    """The scores of the opponents a player beat plus half the scores of the
+       opponents they drew with."""
+    points = state["points"]
+    totals = [0.0] * state["size"]
+    for (i, j, result) in state["meetings"]:
+        if result == 'W':
+            totals[i] += points[j]
+        elif result == 'D':
+            totals[i] += points[j] / 2.0
+    return totals
+
+
+def _mwp(state):
+    """The player's own floored match win percentage."""
+    return state["mwp"]
+
+
+# The tiebreaks that can be configured for a tournament, by name.
+TIEBREAKS = {
+    "omw": _omw,
+    "buchholz": _buchholz,
+    "median_buchholz": _medianBuchholz,
+    "sonneborn_berger": _sonnebornBerger,
+    "mwp": _mwp,
+}
+
+
+def parseTiebreaks(text):
+    """Returns the list of tiebreak names in a comma separated string,
+       raising ValueError for any that are not known."""
+    names = [name.strip() for name in (text or "").split(",") if name.strip()]
+    for name in names:
+        if name not in TIEBREAKS:
+            raise ValueError("Unknown tiebreak '%s', expected one of %s." %
+                             (name, ", ".join(sorted(TIEBREAKS))))
+    return names
+
+
+def computeTiebreaks(player_ids, matches, values, names, floor=OMW_FLOOR):
+    """Calculate the named tiebreaks for every player in a tournament.
+
+    Args:
+      player_ids: the ids of every player registered in the tournament.
+      matches   : a list of (player_id, match_no, result_type) tuples, every
+                  match record of the tournament.
+      values    : a tuple of the tournament's (win, loss, draw, bye) values.
+      names     : the names of the tiebreaks to calculate, in order.
+      floor     : the lowest match win percentage credited to a player.
+
+    Returns:
+      A dict mapping each player id to a tuple of their tiebreak values, in
+      the same order as names.
+    """
+    (win_value, loss_value, draw_value, bye_value) = values
+    index = dict((player_id, i) for (i, player_id) in enumerate(player_ids))
+    size = len(player_ids)
+    wins = [0] * size
+    losses = [0] * size
+    draws = [0] * size
+    played = [0] * size
+    by_match = {}
+    for (player_id, match_no, result_type) in matches:
+        i = index.get(player_id)
+        if i is None:
+            continue
+        played[i] += 1
+        if result_type == 'W':
+            wins[i] += 1
+        elif result_type == 'L':
+            losses[i] += 1
+        elif result_type == 'D':
+            draws[i] += 1
+        by_match.setdefault(match_no, []).append((i, result_type))
+
+    # As in v_player_standings, every round a player has no result for is
+    # counted as a bye.
+    rounds = max(played) if played else 0
+    points = []
+    for i in range(size):
+        byes = rounds - (wins[i] + losses[i] + draws[i])
+        points.append(wins[i] * win_value + losses[i] * loss_value +
+                      draws[i] * draw_value + byes * bye_value)
+
+    meetings = []
+    for records in by_match.values():
+        if len(records) == 2:
+            ((i, result_i), (j, result_j)) = records
+            meetings.append((i, j, result_i))
+            meetings.append((j, i, result_j))
+
+    state = {
+        "size": size,
+        "points": points,
+        "mwp": matchWinPercentages(points, rounds, win_value, floor),
+        "meetings": meetings,
+    }
+    columns = [TIEBREAKS[name](state) for name in names]
+    return dict((player_id, tuple(column[i] for column in columns))
+                for (i, player_id) in enumerate(player_ids))
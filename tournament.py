@@ -3,60 +3,551 @@
 # tournament.py -- implementation of a Swiss-system tournament
 #
 
+import csv
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.pool
+
+import instrumentation
+import pairing
+import simulation
+import state
+import tiebreaks
+
+
+# The connection string can be overridden from the environment so the API can
+# be pointed at another database without code changes.
+DEFAULT_DSN = os.environ.get("TOURNAMENT_DSN", "dbname=tournament")
+
+# The schema loaded by initSchema.
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "tournament.sql")
+
+
+class TournamentSession(object):
+    """A thread-safe pool of database connections shared by the API.
+
+    Opening a new connection for every call costs a TCP and authentication
+    handshake which is usually more expensive than the query itself, so
+    connections are handed out from a pool and returned once the work is
+    done. The pool is created lazily on first use.
+
+    Args:
+      dsn    : the libpq connection string for the tournament database.
+      minconn: the number of connections kept open in the pool.
+      maxconn: the maximum number of connections the pool will open.
+      connect_kwargs: any further arguments for psycopg2.connect, such as a
+                      connection_factory or cursor_factory.
+    """
+
+    def __init__(self, dsn=DEFAULT_DSN, minconn=1, maxconn=10,
+                 **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size, expected "
+                             "0 <= minconn <= maxconn and maxconn >= 1.")
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.connect_kwargs = connect_kwargs
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _getPool(self):
+        """Returns the connection pool, creating it on first use."""
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = psycopg2.pool.ThreadedConnectionPool(
+                        self.minconn, self.maxconn, self.dsn,
+                        **self.connect_kwargs)
+        return self._pool
+
+    def _getconn(self, pool):
+        """Take a connection from the pool, timing the wait."""
+        record = instrumentation.current()
+        start = time.time()
+        conn = pool.getconn()
+        if record is not None:
+            record.connect_ms += (time.time() - start) * 1000.0
+        return conn
+
+    def _putconn(self, pool, conn):
+        """Return a connection to the pool, forgetting the statements
+           prepared on it if it is closed rather than kept."""
+        pool.putconn(conn, close=bool(conn.closed))
+        if conn.closed:
+            _forgetPrepared()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection from the pool for the duration of the block.
+
+        The connection is committed when the block completes and rolled back
+        if it raises, so each block is a single transaction.
+        """
+        pool = self._getPool()
+        conn = self._getconn(pool)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self._putconn(pool, conn)
+
+    @contextmanager
+    def cursor(self):
+        """Borrow a connection and yield a cursor on it inside a single
+        transaction."""
+        with self.connection() as conn:
+            cur = conn.cursor()
+            record = instrumentation.current()
+            try:
+                if record is None:
+                    yield cur
+                else:
+                    yield instrumentation.InstrumentedCursor(cur, record)
+            finally:
+                cur.close()
+
+    @contextmanager
+    def statement(self):
+        """Borrow a connection in autocommit mode and yield a cursor for a
+        single statement, which is its own transaction.
+
+        This saves the round trips cursor() spends on BEGIN and COMMIT, so it
+        suits work done by one statement, such as a read or a call to a
+        function that writes atomically.
+        """
+        pool = self._getPool()
+        conn = self._getconn(pool)
+        try:
+            conn.autocommit = True
+            cur = conn.cursor()
+            record = instrumentation.current()
+            try:
+                if record is None:
+                    yield cur
+                else:
+                    yield instrumentation.InstrumentedCursor(cur, record)
+            finally:
+                cur.close()
+        finally:
+            if not conn.closed:
+                conn.autocommit = False
+            self._putconn(pool, conn)
+
+    def close(self):
+        """Close every connection held by the pool."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+        _forgetPrepared()
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def getSession():
+    """Returns the session shared by the module level API functions."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = TournamentSession()
+    return _session
+
+
+def setSession(session, close=True):
+    """Replace the session shared by the module level API functions, closing
+       the previous one unless close is false. Returns the new session."""
+    global _session
+    with _session_lock:
+        previous = _session
+        _session = session
+    if close and previous is not None and previous is not session:
+        previous.close()
+    return session
+
+
+def configure(dsn=DEFAULT_DSN, minconn=1, maxconn=10):
+    """Point the API at a database with a pool of the given size.
+
+    Args:
+      dsn    : the libpq connection string for the tournament database.
+      minconn: the number of connections kept open in the pool.
+      maxconn: the maximum number of connections the pool will open.
+    """
+    return setSession(TournamentSession(dsn, minconn, maxconn))
 
 
 def connect():
-    """Connect to the PostgreSQL database.  Returns a database connection."""
-    return psycopg2.connect("dbname=tournament")
+    """Connect to the PostgreSQL database.  Returns a database connection.
+
+    This opens a dedicated connection outside of the pool, the API functions
+    themselves borrow connections from getSession().
+    """
+    return psycopg2.connect(getSession().dsn)
+
+
+_instrumentation = None
+
+
+def getInstrumentation():
+    """Returns the instrumentation recording API calls, or None."""
+    return _instrumentation
+
+
+def instrument(sinks, slow_ms=None):
+    """Record the timings of every API call and pass them to sinks.
+
+    Each call produces a dict with the time spent waiting for a connection,
+    executing statements, fetching rows and in Python, the rows returned and
+    the text of each statement. See instrumentation.py for the sinks
+    provided.
+
+    Args:
+      sinks  : a list of callables that are passed each record, an empty
+               list or None turns instrumentation off.
+      slow_ms: statements taking at least this many milliseconds have their
+               plan captured with EXPLAIN (ANALYZE, BUFFERS).
+
+    Returns:
+      The Instrumentation now in use, or None.
+    """
+    global _instrumentation
+    if sinks:
+        _instrumentation = instrumentation.Instrumentation(sinks, slow_ms)
+    else:
+        _instrumentation = None
+    return _instrumentation
+
+
+_instrumented = instrumentation.instrumented(getInstrumentation)
+
+
+class StandingsCache(object):
+    """A bounded least recently used cache of standings and pairings.
+
+    Results only change when matches or registrations are written, so reads
+    are cached against a per-tournament version number which every write
+    function bumps once its transaction has committed. An entry read before
+    the bump is stored under the old version and is never returned again.
+
+    The versions live in this process, so only writes made through this
+    module invalidate them. Writes from another process, tournament_async.py
+    or plain SQL are not seen, which is why the shared cache is off until
+    configureCache is called, and is only safe where this process is the
+    single writer of the tournaments it reads.
+
+    Args:
+      maxsize: the number of results kept, 0 disables the cache.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def version(self, tourn_id):
+        """Returns the current version of a tournament's results."""
+        with self._lock:
+            return self._versions.get(tourn_id, 0)
+
+    def invalidate(self, tourn_id):
+        """Mark every cached result for a tournament as stale."""
+        with self._lock:
+            self._versions[tourn_id] = self._versions.get(tourn_id, 0) + 1
+
+    def get(self, key, version):
+        """Returns the result cached for key at version, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.pop(key)
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, version, value):
+        """Cache value for key, evicting the least recently used results."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (version, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove every cached result and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Returns a dict of the hits, misses, size and maxsize."""
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "size": len(self._entries),
+                    "maxsize": self.maxsize}
+
+
+# Off by default, see StandingsCache for when it is safe to turn on.
+_cache = StandingsCache(0)
+
+
+def getCache():
+    """Returns the cache shared by playerStandings and swissPairings."""
+    return _cache
+
 
+def configureCache(maxsize):
+    """Replace the shared cache with an empty one holding up to maxsize
+       results, 0 disables caching. Returns the new cache.
 
+    Only turn the cache on where this process is the single writer of the
+    tournaments it reads, as writes made elsewhere do not invalidate it.
+    """
+    global _cache
+    _cache = StandingsCache(maxsize)
+    return _cache
+
+
+def _cached(func):
+    """Serve the results of func from the shared cache. The first argument
+       must be the tournament id, lists in the arguments are treated as
+       tuples."""
+    @wraps(func)
+    def wrapper(tourn_id, *args, **kwargs):
+        cache = _cache
+        key = _cacheKey(func.__name__, tourn_id, args, kwargs)
+        version = cache.version(tourn_id)
+        value = cache.get(key, version)
+        if value is None:
+            value = func(tourn_id, *args, **kwargs)
+            cache.put(key, version, value)
+        return list(value)
+    return wrapper
+
+
+def _cacheKey(name, tourn_id, args=(), kwargs=None):
+    """Returns the cache key of a call to the named function."""
+    return (name, tourn_id,
+            tuple(_hashable(a) for a in args),
+            tuple(sorted((k, _hashable(v))
+                         for (k, v) in (kwargs or {}).items())))
+
+
+def _hashable(value):
+    """Returns value with any list converted to a tuple."""
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+# The SQLSTATE f_report_match raises when a player has a pairing in a
+# started round, so reportMatch can report the result against the pairing.
+STARTED_ROUND_ERROR = "TR001"
+
+# The SQLSTATE f_report_match raises for a tournament that has been archived.
+ARCHIVED_ERROR = "TR002"
+
+
+# The statements run on every call of the hot read paths. Each is prepared on
+# a connection the first time it is used there and executed by name from
+# then on, so Postgres parses and rewrites the views once per connection and,
+# once it settles on a generic plan, stops planning them at all. Prepared
+# statements are not transactional, they last until the connection closes.
+_PREPARED = {
+    "ps_count_players": ("INTEGER", """
+        SELECT COUNT(r.player_id) AS player_count
+          FROM t_registrations r
+         WHERE r.tourn_id = $1"""),
+    "ps_standings": ("INTEGER", """
+        SELECT v.player_id,
+               v.player_name,
+               v.wins,
+               v.losses,
+               v.draws,
+               (v.wins + v.losses + v.draws) AS matches,
+               v.opponent_match_wins,
+               v.score
+          FROM v_standings v
+         WHERE v.tourn_id = $1
+         ORDER BY v.score DESC,
+                  v.opponent_match_wins DESC,
+                  v.player_id ASC"""),
+    "ps_standings_recalculated": ("INTEGER", """
+        SELECT v.player_id,
+               v.player_name,
+               v.wins,
+               v.losses,
+               v.draws,
+               (v.wins + v.losses + v.draws) AS matches,
+               v.opponent_match_wins,
+               v.score
+          FROM v_player_standings v
+         WHERE v.tourn_id = $1
+         ORDER BY v.score DESC,
+                  v.opponent_match_wins DESC,
+                  v.player_id ASC"""),
+    "ps_pairing_input": ("INTEGER", """
+        SELECT v.player_id,
+               v.player_name,
+               v.score,
+               v.byes
+          FROM v_standings v
+         WHERE v.tourn_id = $1
+         ORDER BY v.score DESC,
+                  v.opponent_match_wins DESC,
+                  v.player_id ASC"""),
+    "ps_opponents": ("INTEGER", """
+        SELECT o.player_id,
+               o.opponent_id
+          FROM t_opponents o
+         WHERE o.tourn_id = $1"""),
+}
+
+# The names prepared on each connection, keyed by id(conn) along with the
+# connection itself, so an id is not reused while its entry is held. Entries
+# are dropped by _forgetPrepared once their connection has been closed.
+_prepared = {}
+_prepared_lock = threading.Lock()
+
+
+def _preparedNames(conn):
+    """Returns the set of _PREPARED names prepared on a connection."""
+    with _prepared_lock:
+        if id(conn) not in _prepared:
+            _prepared[id(conn)] = (conn, set())
+        return _prepared[id(conn)][1]
+
+
+def _forgetPrepared():
+    """Drop the prepared names of every connection that has been closed,
+       called whenever a session closes or discards a connection."""
+    with _prepared_lock:
+        for key in [key for (key, (conn, names)) in _prepared.items()
+                    if conn.closed]:
+            del _prepared[key]
+
+
+def _prepare(conn, name):
+    """PREPARE one of the _PREPARED statements on a connection."""
+    # Prepared on a plain cursor, so an instrumented call records the
+    # statement it runs rather than the one-off PREPARE.
+    (types, query) = _PREPARED[name]
+    prepare = conn.cursor()
+    try:
+        prepare.execute("PREPARE %s (%s) AS %s" % (name, types, query))
+    finally:
+        prepare.close()
+
+
+def _executePrepared(cur, name, params):
+    """Execute one of the _PREPARED statements, preparing it first if this
+       is its first use on the cursor's connection.
+
+    A statement deallocated on the server while the connection stayed open,
+    by DISCARD ALL for example, is prepared again and the EXECUTE retried,
+    provided it was the first statement of its transaction. Later in a
+    transaction the error is raised, as the transaction has been aborted,
+    and the connection's names are forgotten so the next call prepares
+    them again.
+    """
+    conn = cur.connection
+    names = _preparedNames(conn)
+    first = (conn.autocommit or conn.get_transaction_status() ==
+             psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+    if name not in names:
+        _prepare(conn, name)
+        names.add(name)
+    execute = "EXECUTE %s (%s)" % (name, ", ".join(["%s"] * len(params)))
+    try:
+        cur.execute(execute, params)
+    except psycopg2.errors.InvalidSqlStatementName:
+        names.clear()
+        if not first:
+            raise
+        if not conn.autocommit:
+            conn.rollback()
+        _prepare(conn, name)
+        names.add(name)
+        cur.execute(execute, params)
+
+
+@_instrumented
 def createTournament(tourn_description, tourn_date):
     """Create new tournament, return the tournament ID"""
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""INSERT INTO t_tournaments (tourn_description,
-                                              tourn_date)
-                                      VALUES (%s, %s)""",
-                (tourn_description, tourn_date, ))
-    conn.commit()
-    cur.execute("""SELECT MAX(tourn_id) FROM t_tournaments""")
-    row = cur.fetchone()
+    with getSession().cursor() as cur:
+        cur.execute("""INSERT INTO t_tournaments (tourn_description,
+                                                  tourn_date)
+                                          VALUES (%s, %s)
+                       RETURNING tourn_id""",
+                    (tourn_description, tourn_date, ))
+        row = cur.fetchone()
 
     return row[0]
 
 
+@_instrumented
 def deleteMatches(tourn_id):
-    """Remove all the match records from the database."""
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""DELETE FROM t_matches WHERE tourn_id = %s""", (tourn_id,))
-    conn.commit()
-    conn.close()
+    """Remove all the match records from the database, along with the rounds
+       and pairings they were reported against."""
+    with getSession().cursor() as cur:
+        _checkActive(cur, tourn_id)
+        cur.execute("""DELETE FROM t_pairings WHERE tourn_id = %s""",
+                    (tourn_id,))
+        cur.execute("""DELETE FROM t_rounds WHERE tourn_id = %s""",
+                    (tourn_id,))
+        cur.execute("""DELETE FROM t_matches WHERE tourn_id = %s""",
+                    (tourn_id,))
+    _cache.invalidate(tourn_id)
 
 
+@_instrumented
 def deletePlayers(tourn_id):
     """Remove all the player records from the database for the tournament
        specified."""
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM t_registrations WHERE tourn_id = %s", (tourn_id,))
-    conn.commit()
-    conn.close()
+    with getSession().cursor() as cur:
+        _checkActive(cur, tourn_id)
+        cur.execute("DELETE FROM t_registrations WHERE tourn_id = %s",
+                    (tourn_id,))
+    _cache.invalidate(tourn_id)
 
 
+@_instrumented
 def countPlayers(tourn_id):
     """Returns the number of players currently registered."""
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""SELECT COUNT(r.player_id) AS player_count
-                     FROM t_registrations r
-                    WHERE r.tourn_id = %s""", (tourn_id,))
-    row = cur.fetchone()
-    conn.close()
+    with getSession().statement() as cur:
+        _executePrepared(cur, "ps_count_players", (tourn_id,))
+        row = cur.fetchone()
     return row[0]
 
 
+@_instrumented
 def registerPlayer(tourn_id, name):
     """Adds a player to the tournament database.
 
@@ -65,27 +556,76 @@ def registerPlayer(tourn_id, name):
 
     Args:
       name: the player's full name (need not be unique).
+
+    Returns:
+      The id assigned to the new player.
     """
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO t_players (player_name) VALUES (%s)", (name,))
-    conn.commit()
-    cur.execute("""INSERT INTO t_registrations (tourn_id, player_id)
-                   SELECT t.tourn_id,
-                          (SELECT MAX(player_id)
-                             FROM t_players) AS new_player_id
-                     FROM t_tournaments t
-                    WHERE t.tourn_id = %s""", (tourn_id, ))
-    conn.commit()
-    conn.close()
+    return registerPlayers(tourn_id, [name])[0]
 
 
-def playerStandings(tourn_id):
+@_instrumented
+def registerPlayers(tourn_id, names):
+    """Adds a whole roster of players to a tournament in one transaction.
+
+    Player ids are drawn from the t_players sequence up front and linked to
+    their registrations by id, so several registration desks can load players
+    at the same time without picking up each other's ids.
+
+    Args:
+      tourn_id: the tournament the players are registering for.
+      names   : a list of the players' full names (need not be unique).
+
+    Returns:
+      A list of the ids assigned to the players, in the same order as names.
+    """
+    names = list(names)
+    if not names:
+        return []
+    with getSession().cursor() as cur:
+        _checkActive(cur, tourn_id)
+        cur.execute("""WITH new_players AS (
+                           SELECT nextval('t_players_player_id_seq')
+                                    AS player_id,
+                                  n.player_name,
+                                  n.ord
+                             FROM unnest(%s::VARCHAR[])
+                                    WITH ORDINALITY AS n (player_name, ord)
+                       ), players AS (
+                           INSERT INTO t_players (player_id, player_name)
+                           SELECT np.player_id, np.player_name
+                             FROM new_players np
+                       ), registrations AS (
+                           INSERT INTO t_registrations (tourn_id, player_id)
+                           SELECT %s, np.player_id
+                             FROM new_players np
+                       )
+                       SELECT np.player_id
+                         FROM new_players np
+                        ORDER BY np.ord""", (names, tourn_id))
+        rows = cur.fetchall()
+    _cache.invalidate(tourn_id)
+    return [row[0] for row in rows]
+
+
+@_instrumented
+@_cached
+def playerStandings(tourn_id, recalculate=False, tiebreaks=None):
     """Returns a list of the players and their match records sorted by wins.
 
     The first entry in the list should be the player in first place, or a
     player tied for first place if there is currently a tie.
 
+    Args:
+      tourn_id   : the tournament to return the standings of.
+      recalculate: when True the standings are calculated from the matches
+                   by the v_player_standings view rather than read from the
+                   maintained t_standings table. Both return the same rows.
+      tiebreaks  : a list of tiebreak names from tiebreaks.TIEBREAKS, or True
+                   for the tournament's configured tiebreaks. When given,
+                   players on the same score are ranked by these tiebreaks
+                   instead of opponent_match_wins and each row has an extra
+                   tuple of the tiebreak values.
+
     Returns:
       A list of tuples, each of which contains
       (id, name, wins, losses, draws, matches, opponent_match_wins):
@@ -98,26 +638,347 @@ def playerStandings(tourn_id):
         opponent_match_wins: the number of matches won by each opponent
                              this player has played.
     """
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""SELECT v.player_id,
-                          v.player_name,
-                          v.wins,
-                          v.losses,
-                          v.draws,
-                          (v.wins + v.losses + v.draws) AS matches,
-                          v.opponent_match_wins
-                     FROM v_player_standings v
-                    WHERE v.tourn_id = %s
-                """, (tourn_id,))
-    rows = cur.fetchall()
+    # Without tiebreaks the standings are a single statement, which needs
+    # no transaction of its own.
+    session = getSession()
+    with (session.cursor() if tiebreaks else session.statement()) as cur:
+        _executePrepared(cur, ("ps_standings_recalculated" if recalculate
+                               else "ps_standings"), (tourn_id,))
+        rows = cur.fetchall()
+        if tiebreaks:
+            values = _loadTiebreaks(cur, tourn_id, tiebreaks,
+                                    [row[0] for row in rows])
     results = []
     for row in rows:
-        results.append(row)
-    conn.close()
+        results.append(row[:7])
+    if tiebreaks:
+        scores = dict((row[0], row[7]) for row in rows)
+        results.sort(key=lambda row: ([-scores[row[0]]] +
+                                      [-v for v in values[row[0]]] +
+                                      [row[0]]))
+        results = [row + (values[row[0]],) for row in results]
     return results
 
 
+def _loadTiebreaks(cur, tourn_id, names, player_ids):
+    """Returns the tiebreak values of every player in a tournament, loading
+       its match records once. names may be True for the tournament's
+       configured tiebreaks."""
+    cur.execute("""SELECT t.tourn_win_value,
+                          t.tourn_loss_value,
+                          t.tourn_draw_value,
+                          t.tourn_bye_value,
+                          t.tourn_tiebreaks
+                     FROM t_tournaments t
+                    WHERE t.tourn_id = %s""", (tourn_id,))
+    row = cur.fetchone()
+    if names is True:
+        names = tiebreaks.parseTiebreaks(row[4])
+    cur.execute("""SELECT m.player_id,
+                          m.match_no,
+                          m.result_type
+                     FROM t_matches m
+                    WHERE m.tourn_id = %s""", (tourn_id,))
+    return tiebreaks.computeTiebreaks(player_ids, cur.fetchall(), row[:4],
+                                      names)
+
+
+# The standings columns in the order playerStandings returns them, shared by
+# the streaming and export paths.
+_STANDINGS_QUERY = """SELECT v.player_id,
+                             v.player_name,
+                             v.wins,
+                             v.losses,
+                             v.draws,
+                             (v.wins + v.losses + v.draws) AS matches,
+                             v.opponent_match_wins
+                        FROM v_standings v
+                       WHERE v.tourn_id = %s
+                       ORDER BY v.score DESC,
+                                v.opponent_match_wins DESC,
+                                v.player_id ASC"""
+
+# The tables of a tournament's started round in the form swissPairings
+# returns them, for exportPairings.
+_STARTED_PAIRINGS_QUERY = """SELECT p.player_1_id,
+                                    p1.player_name AS player_1_name,
+                                    p.player_2_id,
+                                    p2.player_name AS player_2_name
+                               FROM t_rounds r
+                                  JOIN t_pairings p
+                                    ON p.round_id = r.round_id
+                                  JOIN t_players p1
+                                    ON p1.player_id = p.player_1_id
+                                  JOIN t_players p2
+                                    ON p2.player_id = p.player_2_id
+                              WHERE r.tourn_id = %s
+                                AND r.round_status = 'P'
+                              ORDER BY p.table_no"""
+
+
+def iterStandings(tourn_id, batch_size=1000):
+    """Yields the standings of a tournament one row at a time.
+
+    The rows are read through a server side cursor batch_size rows at a
+    time, so memory use does not grow with the size of the event. A pooled
+    connection is held until the generator is exhausted or closed.
+
+    Returns:
+      A generator of tuples in the form playerStandings returns.
+    """
+    with getSession().connection() as conn:
+        cur = conn.cursor(name="standings_%d" % tourn_id)
+        cur.itersize = batch_size
+        try:
+            cur.execute(_STANDINGS_QUERY, (tourn_id,))
+            for row in cur:
+                yield row
+        finally:
+            cur.close()
+
+
+def _copyOut(query, params, output, format):
+    """Stream the results of query to output with COPY ... TO STDOUT, as CSV
+       with a header or as one JSON object per line."""
+    if format not in ("csv", "jsonl"):
+        raise ValueError("Unknown export format '%s', expected csv or "
+                         "jsonl." % (format,))
+    with getSession().cursor() as cur:
+        query = cur.mogrify(query, params).decode(cur.connection.encoding)
+        if format == "csv":
+            copy = "COPY (%s) TO STDOUT WITH (FORMAT csv, HEADER)" % query
+        else:
+            # CSV with quote and delimiter characters that never appear in
+            # JSON writes each object exactly as PostgreSQL renders it, where
+            # the text format would escape its backslashes.
+            copy = ("COPY (SELECT row_to_json(q) FROM (%s) q) TO STDOUT "
+                    "WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')"
+                    % query)
+        cur.copy_expert(copy, output)
+
+
+@_instrumented
+def exportStandings(tourn_id, output, format="csv"):
+    """Write the standings of a tournament to a file object.
+
+    The rows are streamed straight from the database with COPY, so memory
+    use is constant however large the event is.
+
+    Args:
+      tourn_id: the tournament to export.
+      output  : a file object opened for writing.
+      format  : 'csv' for CSV with a header row, or 'jsonl' for one JSON
+                object per line.
+    """
+    _copyOut(_STANDINGS_QUERY, (tourn_id,), output, format)
+
+
+@_instrumented
+def exportPairings(tourn_id, output, format="csv"):
+    """Write the next round's pairings of a tournament to a file object, in
+       the same formats as exportStandings.
+
+    The stored pairings of a round started with startRound are streamed with
+    COPY. Only when no round is open are the pairings computed by
+    swissPairings and written from Python.
+    """
+    if format not in ("csv", "jsonl"):
+        raise ValueError("Unknown export format '%s', expected csv or "
+                         "jsonl." % (format,))
+    with getSession().statement() as cur:
+        cur.execute("""SELECT 1
+                         FROM t_rounds r
+                        WHERE r.tourn_id = %s
+                          AND r.round_status = 'P'""", (tourn_id,))
+        started = cur.fetchone() is not None
+    if started:
+        _copyOut(_STARTED_PAIRINGS_QUERY, (tourn_id,), output, format)
+        return
+    columns = ("player_1_id", "player_1_name", "player_2_id", "player_2_name")
+    if format == "csv":
+        writer = csv.writer(output)
+        writer.writerow(columns)
+        for row in swissPairings(tourn_id):
+            writer.writerow(row)
+    else:
+        for row in swissPairings(tourn_id):
+            output.write(json.dumps(dict(zip(columns, row))) + "\n")
+
+
+@_instrumented
+def setTiebreaks(tourn_id, names):
+    """Configure the tiebreaks used to rank players on the same score.
+
+    Args:
+      tourn_id: the tournament to configure.
+      names   : a list of tiebreak names from tiebreaks.TIEBREAKS, in the
+                order they are applied.
+    """
+    text = ",".join(names)
+    tiebreaks.parseTiebreaks(text)
+    with getSession().cursor() as cur:
+        cur.execute("""UPDATE t_tournaments
+                          SET tourn_tiebreaks = %s
+                        WHERE tourn_id = %s""", (text, tourn_id))
+    _cache.invalidate(tourn_id)
+
+
+@_instrumented
+def checkStandings(tourn_id):
+    """Compares the maintained standings against a full recalculation.
+
+    t_standings is updated incrementally as matches are reported, this
+    recalculates every player's totals with the v_player_standings view and
+    reports any player whose stored totals disagree.
+
+    Returns:
+      A list of tuples, one for each player that differs, each of which
+      contains (id, stored, expected) where stored and expected are
+      (wins, losses, draws, byes, opponent_match_wins) tuples. The stored
+      value is None when the player has no t_standings row.
+    """
+    with getSession().cursor() as cur:
+        cur.execute("""SELECT v.player_id,
+                              s.wins,
+                              s.losses,
+                              s.draws,
+                              s.byes,
+                              s.opponent_match_wins,
+                              v.wins,
+                              v.losses,
+                              v.draws,
+                              v.byes,
+                              v.opponent_match_wins
+                         FROM v_player_standings v
+                            LEFT OUTER JOIN v_standings s
+                              ON (s.tourn_id = v.tourn_id)
+                             AND (s.player_id = v.player_id)
+                        WHERE v.tourn_id = %s
+                        ORDER BY v.player_id
+                    """, (tourn_id,))
+        rows = cur.fetchall()
+    results = []
+    for row in rows:
+        stored = None if row[1] is None else tuple(row[1:6])
+        expected = tuple(row[6:11])
+        if stored != expected:
+            results.append((row[0], stored, expected))
+    return results
+
+
+@_instrumented
+def rebuildStandings(tourn_id):
+    """Recreates the maintained standings for a tournament from its matches.
+
+    Returns:
+      The differences checkStandings found before the rebuild, an empty list
+      means the stored standings were already correct.
+    """
+    differences = checkStandings(tourn_id)
+    with getSession().cursor() as cur:
+        _checkActive(cur, tourn_id)
+        cur.execute("SELECT f_rebuild_standings(%s)", (tourn_id,))
+    _cache.invalidate(tourn_id)
+    return differences
+
+
+@_instrumented
+def archiveTournament(tourn_id, drop=False):
+    """Detach a finished tournament's match and registration partitions.
+
+    The partitions are moved to the tournament_archive schema, or dropped
+    when drop is True, without deleting any rows. The final standings stay
+    readable through playerStandings. Registering, reporting, pairing,
+    deleting or resetting the tournament afterwards raises ValueError.
+    """
+    with getSession().cursor() as cur:
+        cur.execute("SELECT f_archive_tournament(%s, %s)", (tourn_id, drop))
+    _cache.invalidate(tourn_id)
+
+
+def _checkActive(cur, tourn_id):
+    """Raise ValueError if a tournament has been archived, as its partitions
+       are detached and nothing more can be recorded or paired for it."""
+    cur.execute("""SELECT t.tourn_archived
+                     FROM t_tournaments t
+                    WHERE t.tourn_id = %s""", (tourn_id,))
+    row = cur.fetchone()
+    if row is not None and row[0]:
+        raise ValueError("Tournament %s has been archived." % (tourn_id,))
+
+
+def initSchema(dsn=None, path=SCHEMA_PATH):
+    """Load the schema from tournament.sql into a database, replacing any
+       tables already there, in a single transaction.
+
+    The CREATE DATABASE statement and psql commands at the top of the file
+    are skipped, so the schema is loaded into whichever database dsn, or
+    the shared session by default, points at. Files included with \\i or
+    \\ir, such as tournament_partitions.sql, are read in their place.
+
+    Tables archived to the tournament_archive schema are not replaced. They
+    are left where they are, and the foreign keys they had to the tables
+    that are dropped and recreated are removed by DROP TABLE ... CASCADE.
+    """
+    conn = psycopg2.connect(dsn or getSession().dsn)
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("".join(_schemaLines(path)))
+    finally:
+        conn.close()
+    _cache.clear()
+
+
+def _schemaLines(path):
+    """Returns the lines of a psql script that initSchema runs, with the
+       files it includes read in their place, relative to the script."""
+    lines = []
+    with open(path) as schema:
+        for line in schema:
+            command = line.split()
+            if command and command[0] in ("\\i", "\\ir"):
+                lines.extend(_schemaLines(
+                    os.path.join(os.path.dirname(path), command[1])))
+            elif (not line.startswith("\\") and
+                  not line.upper().startswith("CREATE DATABASE")):
+                lines.append(line)
+    return lines
+
+
+@_instrumented
+def resetTournament(tourn_id=None):
+    """Quickly remove a tournament's players, matches and rounds.
+
+    The tournament's partitions are truncated instead of deleting their rows,
+    which is much faster than deleteMatches and deletePlayers for a large
+    event. With no tourn_id every table is truncated and every id sequence
+    restarted. Tables already archived to the tournament_archive schema are
+    no longer partitions and are not dropped; they are only emptied through
+    any foreign keys they still have to t_players and t_tournaments.
+    """
+    with getSession().cursor() as cur:
+        if tourn_id is None:
+            cur.execute("""TRUNCATE t_pairings,
+                                    t_rounds,
+                                    t_opponents,
+                                    t_standings,
+                                    t_matches,
+                                    t_registrations,
+                                    t_players,
+                                    t_tournaments
+                           RESTART IDENTITY CASCADE""")
+            cur.execute("ALTER SEQUENCE s_match_no RESTART")
+        else:
+            _checkActive(cur, tourn_id)
+            cur.execute("SELECT f_reset_tournament(%s)", (tourn_id,))
+    if tourn_id is None:
+        _cache.clear()
+    else:
+        _cache.invalidate(tourn_id)
+
+
+@_instrumented
 def reportMatch(tourn_id, winner, loser, draw_flag):
     """Records the outcome of a single match between two players.
 
@@ -125,57 +986,271 @@ def reportMatch(tourn_id, winner, loser, draw_flag):
       winner   : the id number of the player who won
       loser    : the id number of the player who lost
       draw_flag: 'Y' to indicate a draw, 'N' to indicate a standard result
+
+    Both records are written by the f_report_match function in a single
+    statement, so the result is atomic and takes one round trip. When the
+    players have a pairing in a round started by startRound the result is
+    reported against that pairing instead, as reportRound does.
+
+    Returns:
+      The match number of the result.
     """
-    conn = connect()
-    cur = conn.cursor()
-    # Insert the winning record, or mark as a draw if designated
+    if winner is None:
+        raise ValueError("Every result needs a winning player id.")
+    if winner == loser:
+        raise ValueError("Player %s appears more than once in the "
+                         "round." % (winner,))
+    try:
+        with getSession().statement() as cur:
+            cur.execute("SELECT f_report_match(%s, %s, %s, %s)",
+                        (tourn_id, winner, loser, draw_flag))
+            match_no = cur.fetchone()[0]
+    except psycopg2.Error as e:
+        if e.pgcode == ARCHIVED_ERROR:
+            raise ValueError("Tournament %s has been archived." % (tourn_id,))
+        if e.pgcode != STARTED_ROUND_ERROR:
+            raise
+        match_no = _reportResults(tourn_id,
+                                  [(winner, loser, draw_flag)])[winner]
+    _cache.invalidate(tourn_id)
+    return match_no
+
+
+@_instrumented
+def reportRound(tourn_id, results):
+    """Records the outcome of every match in a round in one transaction.
+
+    Each match takes its match number from the s_match_no sequence, so the
+    whole round is written with a single statement however many tables were
+    played, and rounds reported at the same time cannot collide. Results of
+    players with a pairing in a round started by startRound are reported
+    against their pairings, as reportPairings does, so the round completes.
+
+    Args:
+      tourn_id: the tournament the round was played in.
+      results : a list of (winner, loser, draw_flag) tuples, in the same form
+                as the arguments to reportMatch. A loser of None records a
+                bye for the winner.
+    """
+    _reportResults(tourn_id, results)
+
+
+def _reportResults(tourn_id, results):
+    """Record a list of results in one transaction, returning a dict mapping
+       each player to their match number."""
+    results = list(results)
+    seen = set()
+    for (winner, loser, draw_flag) in results:
+        for player_id in (winner, loser):
+            if player_id is None:
+                continue
+            if player_id in seen:
+                raise ValueError("Player %s appears more than once in the "
+                                 "round." % (player_id,))
+            seen.add(player_id)
+        if winner is None:
+            raise ValueError("Every result needs a winning player id.")
+    if not results:
+        return {}
+    with getSession().cursor() as cur:
+        _checkActive(cur, tourn_id)
+        started = _startedPairings(cur, tourn_id, list(seen))
+        plain = []
+        paired = []
+        for (winner, loser, draw_flag) in results:
+            pairing = started.get(winner) or started.get(loser)
+            if pairing is None:
+                plain.append((winner, loser, draw_flag))
+                continue
+            (pairing_id, id1, id2) = pairing
+            if id2 is None or set((winner, loser)) != set((id1, id2)):
+                raise ValueError("Player %s is paired at pairing %s of a "
+                                 "started round, the result must be for "
+                                 "that pairing." % (
+                                     winner if winner in (id1, id2)
+                                     else loser, pairing_id))
+            paired.append((pairing_id, winner, draw_flag))
+        match_nos = {}
+        if plain:
+            match_nos.update(_insertResults(
+                cur, tourn_id, [r[0] for r in plain], [r[1] for r in plain],
+                [r[2] for r in plain]))
+        if paired:
+            match_nos.update(_reportPairings(cur, paired)[1])
+    _cache.invalidate(tourn_id)
+    return match_nos
+
+
+def _startedPairings(cur, tourn_id, player_ids):
+    """Returns a dict mapping each of the players with an unreported pairing
+       in a started round of the tournament to its (pairing_id, id1, id2).
+       The started rounds are locked first, as reportPairings locks them."""
+    cur.execute("""SELECT r.round_id
+                     FROM t_rounds r
+                    WHERE r.tourn_id = %s
+                      AND r.round_status = 'P'
+                    ORDER BY r.round_id
+                      FOR UPDATE""", (tourn_id,))
+    if not cur.fetchall():
+        return {}
+    cur.execute("""SELECT p.pairing_id,
+                          p.player_1_id,
+                          p.player_2_id
+                     FROM t_rounds r
+                        JOIN t_pairings p
+                          ON p.round_id = r.round_id
+                    WHERE r.tourn_id = %s
+                      AND r.round_status = 'P'
+                      AND p.match_no IS NULL
+                      AND (p.player_1_id = ANY(%s)
+                           OR p.player_2_id = ANY(%s))""",
+                (tourn_id, player_ids, player_ids))
+    started = {}
+    for (pairing_id, id1, id2) in cur.fetchall():
+        for player_id in (id1, id2):
+            if player_id is not None:
+                started[player_id] = (pairing_id, id1, id2)
+    return started
+
+
+def _insertResults(cur, tourn_id, winners, losers, draw_flags):
+    """Insert the match records of a list of results with one statement,
+       returning a dict mapping each player to their match number."""
     cur.execute("""
+                WITH results AS (
+                    SELECT r.winner,
+                           r.loser,
+                           r.draw_flag,
+                           nextval('s_match_no') AS match_no
+                      FROM unnest(%s::INTEGER[],
+                                  %s::INTEGER[],
+                                  %s::VARCHAR[])
+                             AS r (winner, loser, draw_flag)
+                )
                 INSERT INTO t_matches (tourn_id,
                                        match_no,
                                        player_id,
                                        result_type)
-                SELECT %s AS tourn_id,
-                       COALESCE(MAX(m.match_no),0)+1 AS match_no,
-                       %s AS player_id,
+                -- The winning record, a draw if designated or a bye
+                -- when there was no opponent.
+                SELECT t.tourn_id,
+                       r.match_no,
+                       r.winner,
                        CASE
-                         WHEN %s = 'Y' THEN 'D'
+                         WHEN r.loser IS NULL THEN 'B'
+                         WHEN r.draw_flag = 'Y' THEN 'D'
                          ELSE 'W'
                        END AS result_type
                   FROM t_tournaments t
-                     LEFT OUTER JOIN t_matches m
-                       ON (m.tourn_id = t.tourn_id)
+                     CROSS JOIN results r
                  WHERE t.tourn_id = %s
-                """, (tourn_id,
-                      winner,
-                      draw_flag,
-                      tourn_id))
-    conn.commit()
-    # Insert the losing record, or mark as a draw if required.
-    cur.execute("""
-                INSERT INTO t_matches (tourn_id,
-                                       match_no,
-                                       player_id,
-                                       result_type)
-                SELECT %s AS tourn_id,
-                       COALESCE(MAX(m.match_no),0) AS match_no,
-                       %s AS player_id,
+                 UNION ALL
+                -- The losing record, or a draw if required.
+                SELECT t.tourn_id,
+                       r.match_no,
+                       r.loser,
                        CASE
-                         WHEN %s = 'Y' THEN 'D'
+                         WHEN r.draw_flag = 'Y' THEN 'D'
                          ELSE 'L'
                        END AS result_type
                   FROM t_tournaments t
-                     LEFT OUTER JOIN t_matches m
-                       ON (m.tourn_id = t.tourn_id)
+                     CROSS JOIN results r
                  WHERE t.tourn_id = %s
-                """, (tourn_id,
-                      loser,
-                      draw_flag,
+                   AND r.loser IS NOT NULL
+                RETURNING match_no, player_id
+                """, (winners,
+                      losers,
+                      draw_flags,
+                      tourn_id,
                       tourn_id))
-    conn.commit()
-    conn.close()
+    return dict((player_id, match_no)
+                for (match_no, player_id) in cur.fetchall())
+
+
+@_instrumented
+def loadTournamentState(tourn_id):
+    """Returns the standings and opponent history of a tournament as a
+       compact state.TournamentState, loaded with a single query."""
+    with getSession().cursor() as cur:
+        cur.execute("""SELECT v.player_id,
+                              v.player_name,
+                              v.wins,
+                              v.losses,
+                              v.draws,
+                              v.byes,
+                              v.opponent_match_wins,
+                              v.score,
+                              ARRAY(SELECT o.opponent_id
+                                      FROM t_opponents o
+                                     WHERE o.tourn_id = v.tourn_id
+                                       AND o.player_id = v.player_id)
+                         FROM v_standings v
+                        WHERE v.tourn_id = %s
+                        ORDER BY v.score DESC,
+                                 v.opponent_match_wins DESC,
+                                 v.player_id ASC
+                    """, (tourn_id,))
+        rows = cur.fetchall()
+    return state.TournamentState(tourn_id, rows)
+
+
+@_instrumented
+def simulateTournament(tourn_id, rounds=None, trials=1000, method="dutch",
+                       draw_rate=0.0, favourite=0.5, seed=None,
+                       processes=None):
+    """Play the next rounds of a tournament many times over in memory.
+
+    The standings, meetings and scoring values are read once and every trial
+    is then paired and scored by simulation.simulate, without writing to the
+    database. Registering the expected field first shows how an event will
+    run before it starts.
+
+    Args:
+      tourn_id : the tournament to simulate.
+      rounds   : the number of rounds each trial plays, a few more than
+                 log2 of the field by default.
+      trials   : the number of trials to play.
+      method   : the pairing method from pairing.METHODS.
+      draw_rate: the chance that a game is drawn.
+      favourite: the chance that the higher ranked player wins a game that
+                 is not drawn.
+      seed     : seeds the trials, so a run can be repeated.
+      processes: the number of worker processes, the number of CPUs by
+                 default, or 0 to play every trial in this process.
+
+    Returns:
+      A simulation.SimulationResult holding each trial's outcomes.
+    """
+    with getSession().cursor() as cur:
+        cur.execute("""SELECT t.tourn_win_value,
+                              t.tourn_loss_value,
+                              t.tourn_draw_value,
+                              t.tourn_bye_value
+                         FROM t_tournaments t
+                        WHERE t.tourn_id = %s
+                    """, (tourn_id,))
+        values = cur.fetchone()
+    if values is None:
+        raise ValueError("Tournament %s does not exist." % (tourn_id,))
+    return simulation.simulate(loadTournamentState(tourn_id), values,
+                               rounds=rounds, trials=trials, method=method,
+                               draw_rate=draw_rate, favourite=favourite,
+                               seed=seed, processes=processes)
 
 
-def swissPairings(tourn_id):
+def _loadOpponents(cur, tourn_id):
+    """Returns a dict mapping each player to the set of players they have
+       met in the tournament, read from the t_opponents adjacency list."""
+    _executePrepared(cur, "ps_opponents", (tourn_id,))
+    opponents = {}
+    for (player_id, opponent_id) in cur.fetchall():
+        opponents.setdefault(player_id, set()).add(opponent_id)
+    return opponents
+
+
+@_instrumented
+@_cached
+def swissPairings(tourn_id, method="dutch"):
     """Returns a list of pairs of players for the next round of a match.
 
     Assuming that there are an even number of players registered, each player
@@ -183,6 +1258,18 @@ def swissPairings(tourn_id):
     player with an equal or nearly-equal win record, that is, a player adjacent
     to him or her in the standings.
 
+    The standings and every previous meeting are loaded once and the pairing
+    itself is done in memory by pairing.pairPlayers. When there is an odd
+    number of players the lowest ranked player without a bye is left out of
+    the pairings and receives the bye. Once a round has been started with
+    startRound its stored pairings are returned until every result is in.
+
+    Args:
+      tourn_id: the tournament to pair.
+      method  : the pairing method from pairing.METHODS, "dutch" to pair one
+                score group at a time or "weighted" to pair by maximum
+                weight matching across groups.
+
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
         id1: the first player's unique id
@@ -190,19 +1277,424 @@ def swissPairings(tourn_id):
         id2: the second player's unique id
         name2: the second player's name
     """
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""SELECT p.player_1_id,
-                          p.player_1_name,
-                          p.player_2_id,
-                          p.player_2_name
-                     FROM v_swiss_matchups p
-                    WHERE p.tourn_id = %s
-                """, (tourn_id,))
-    rows = cur.fetchall()
+    with getSession().cursor() as cur:
+        pairings = _roundPairings(cur, tourn_id, open_only=True)
+        if pairings:
+            return [(id1, name1, id2, name2)
+                    for (pairing_id, id1, name1, id2, name2) in pairings
+                    if id2 is not None]
+        _checkActive(cur, tourn_id)
+        (pairs, bye, names) = _nextPairings(cur, tourn_id, method)
+
     results = []
-    for row in rows:
-        results.append(row)
-    conn.close()
+    for (id1, id2) in pairs:
+        results.append((id1, names[id1], id2, names[id2]))
 
     return results
+
+
+def _nextPairings(cur, tourn_id, method="dutch"):
+    """Pair the next round of a tournament, returning the pairs and bye
+       from the pairing method and a dict of the players' names."""
+    pair = pairing.getMethod(method)
+    (players, opponents, names) = _loadPairingInput(cur, tourn_id)
+    (pairs, bye) = pair(players, opponents)
+    return pairs, bye, names
+
+
+def _loadPairingInput(cur, tourn_id):
+    """Returns the (player_id, score, byes) tuples of a tournament in
+       standings order, the players each has met and their names."""
+    _executePrepared(cur, "ps_pairing_input", (tourn_id,))
+    standings = cur.fetchall()
+    opponents = _loadOpponents(cur, tourn_id)
+
+    names = {}
+    players = []
+    for (player_id, player_name, score, byes) in standings:
+        names[player_id] = player_name
+        players.append((player_id, score, byes))
+
+    return players, opponents, names
+
+
+@_instrumented
+def auditPairings(tourn_id, method="weighted"):
+    """Returns the next round's pairings with the cost of each decision.
+
+    The pairing is the one swissPairings would compute with the same method,
+    and the costs are the penalties pairing.PairingCosts defines, so a
+    tournament director can see which pairs float across score groups,
+    which are rematches and why the bye went where it did.
+
+    Returns:
+      A list of (id1, name1, id2, name2, cost) tuples, cost being a dict of
+      the score, rematch, bye and rank penalties and their total. The last
+      tuple has an id2 and name2 of None when a player receives the bye.
+    """
+    pair = pairing.getMethod(method)
+    with getSession().cursor() as cur:
+        _checkActive(cur, tourn_id)
+        (players, opponents, names) = _loadPairingInput(cur, tourn_id)
+    (pairs, bye) = pair(players, opponents)
+    return [(id1, names[id1], id2, names.get(id2), cost)
+            for (id1, id2, cost) in pairing.pairingCosts(players, opponents,
+                                                          pairs, bye)]
+
+
+def _pairFlight(players, opponents):
+    """Pair one tournament, run in a worker process by pairAllTournaments."""
+    return pairing.pairPlayers(players, opponents)
+
+
+@_instrumented
+def pairAllTournaments(tourn_ids, processes=None):
+    """Returns the next round's pairings of many tournaments at once.
+
+    The standings and meetings of every tournament are loaded with one query
+    each, in a single transaction, and the pairings are then computed in
+    parallel by a pool of worker processes. A tournament that fails to pair
+    does not hold up the others, its exception is returned in place of its
+    pairings. A tournament with a round started by startRound is not paired
+    again, its stored pairings are returned as swissPairings returns them.
+
+    Args:
+      tourn_ids: the ids of the tournaments to pair.
+      processes: the number of worker processes, the number of CPUs by
+                 default, or 0 to pair every tournament in this process.
+
+    Returns:
+      A dict mapping each tournament id to either a list of pairings in the
+      form returned by swissPairings, or the exception raised pairing it.
+    """
+    tourn_ids = list(tourn_ids)
+    results = {}
+    with getSession().cursor() as cur:
+        for tourn_id in tourn_ids:
+            stored = _roundPairings(cur, tourn_id, open_only=True)
+            if stored:
+                results[tourn_id] = [(id1, name1, id2, name2)
+                                     for (pairing_id, id1, name1, id2, name2)
+                                     in stored if id2 is not None]
+        cur.execute("""SELECT t.tourn_id
+                         FROM t_tournaments t
+                        WHERE t.tourn_id = ANY(%s)
+                          AND t.tourn_archived""", (tourn_ids,))
+        for (tourn_id,) in cur.fetchall():
+            results.setdefault(tourn_id, ValueError(
+                "Tournament %s has been archived." % (tourn_id,)))
+        tourn_ids = [t for t in tourn_ids if t not in results]
+        players = dict((t, []) for t in tourn_ids)
+        names = {}
+        opponents = dict((t, {}) for t in tourn_ids)
+        cur.execute("""SELECT v.tourn_id,
+                              v.player_id,
+                              v.player_name,
+                              v.score,
+                              v.byes
+                         FROM v_standings v
+                        WHERE v.tourn_id = ANY(%s)
+                        ORDER BY v.tourn_id,
+                                 v.score DESC,
+                                 v.opponent_match_wins DESC,
+                                 v.player_id ASC
+                    """, (tourn_ids,))
+        for (tourn_id, player_id, player_name, score, byes) in cur.fetchall():
+            names[player_id] = player_name
+            players[tourn_id].append((player_id, score, byes))
+        cur.execute("""SELECT o.tourn_id,
+                              o.player_id,
+                              o.opponent_id
+                         FROM t_opponents o
+                        WHERE o.tourn_id = ANY(%s)
+                    """, (tourn_ids,))
+        for (tourn_id, player_id, opponent_id) in cur.fetchall():
+            opponents[tourn_id].setdefault(player_id, set()).add(opponent_id)
+
+    if processes == 0 or len(tourn_ids) < 2:
+        pool = None
+        pending = {}
+    else:
+        pool = multiprocessing.Pool(processes)
+        pending = dict((t, pool.apply_async(_pairFlight,
+                                            (players[t], opponents[t])))
+                       for t in tourn_ids)
+    try:
+        for tourn_id in tourn_ids:
+            try:
+                if pool is None:
+                    (pairs, bye) = _pairFlight(players[tourn_id],
+                                               opponents[tourn_id])
+                else:
+                    (pairs, bye) = pending[tourn_id].get()
+            except Exception as e:
+                results[tourn_id] = e
+                continue
+            results[tourn_id] = [(id1, names[id1], id2, names[id2])
+                                 for (id1, id2) in pairs]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return results
+
+
+@_instrumented
+def startRound(tourn_id, method="dutch"):
+    """Pair the next round of a tournament and store the pairings.
+
+    The pairings are computed once and kept in t_pairings under a new
+    t_rounds record, so later reads with roundPairings or swissPairings are
+    indexed lookups and always return the same tables. Calling startRound
+    again before every result of the round is in returns the stored round
+    rather than pairing another. The tournament row is locked while the
+    round is created, so concurrent calls cannot start two rounds.
+
+    Args:
+      tourn_id: the tournament to pair.
+      method  : the pairing method, as for swissPairings.
+
+    Returns:
+      A list of (pairing_id, id1, name1, id2, name2) tuples in table order,
+      results of the round are reported against the pairing_id with
+      reportPairing. A player with the bye is paired with an id2 and name2
+      of None, and their bye is recorded when the rest of the round is
+      complete.
+    """
+    with getSession().cursor() as cur:
+        cur.execute("""SELECT t.tourn_archived
+                         FROM t_tournaments t
+                        WHERE t.tourn_id = %s
+                          FOR UPDATE""", (tourn_id,))
+        row = cur.fetchone()
+        if row is None:
+            raise ValueError("Tournament %s does not exist." % (tourn_id,))
+        if row[0]:
+            raise ValueError("Tournament %s has been archived." % (tourn_id,))
+        pairings = _roundPairings(cur, tourn_id, open_only=True)
+        if pairings:
+            return pairings
+        (pairs, bye, names) = _nextPairings(cur, tourn_id, method)
+        if not pairs and bye is None:
+            raise ValueError("Tournament %s has no players to pair."
+                             % (tourn_id,))
+        players_1 = [id1 for (id1, id2) in pairs]
+        players_2 = [id2 for (id1, id2) in pairs]
+        if bye is not None:
+            players_1.append(bye)
+            players_2.append(None)
+        cur.execute("""WITH new_round AS (
+                           INSERT INTO t_rounds (tourn_id, round_no)
+                           SELECT %s, COALESCE(MAX(r.round_no), 0) + 1
+                             FROM t_rounds r
+                            WHERE r.tourn_id = %s
+                           RETURNING round_id, tourn_id
+                       )
+                       INSERT INTO t_pairings (round_id,
+                                               tourn_id,
+                                               table_no,
+                                               player_1_id,
+                                               player_2_id)
+                       SELECT nr.round_id,
+                              nr.tourn_id,
+                              p.table_no,
+                              p.player_1_id,
+                              p.player_2_id
+                         FROM new_round nr
+                            CROSS JOIN unnest(%s::INTEGER[], %s::INTEGER[])
+                                         WITH ORDINALITY
+                                         AS p (player_1_id, player_2_id,
+                                               table_no)
+                       RETURNING round_id""",
+                    (tourn_id, tourn_id, players_1, players_2))
+        round_id = cur.fetchone()[0]
+        # A round with nothing but a bye is complete as soon as it starts.
+        _completeRounds(cur, tourn_id, [round_id])
+        pairings = _roundPairings(cur, tourn_id, round_id=round_id)
+    _cache.invalidate(tourn_id)
+    return pairings
+
+
+@_instrumented
+def roundPairings(tourn_id, round_no=None):
+    """Returns the stored pairings of a round, in the form startRound
+       returns them, read with an indexed lookup.
+
+    Args:
+      tourn_id: the tournament the round belongs to.
+      round_no: the number of the round, the most recent round by default.
+    """
+    with getSession().cursor() as cur:
+        return _roundPairings(cur, tourn_id, round_no=round_no)
+
+
+def _roundPairings(cur, tourn_id, round_no=None, round_id=None,
+                   open_only=False):
+    """Returns the stored pairings of one round of a tournament: the round
+       given by round_id or round_no, the open round if open_only, or else
+       the most recent round."""
+    if round_id is not None:
+        condition = "r.round_id = %s"
+        params = (tourn_id, round_id)
+    elif round_no is not None:
+        condition = "r.round_no = %s"
+        params = (tourn_id, round_no)
+    elif open_only:
+        condition = "r.round_status = 'P'"
+        params = (tourn_id,)
+    else:
+        condition = """r.round_no = (SELECT MAX(x.round_no)
+                                       FROM t_rounds x
+                                      WHERE x.tourn_id = r.tourn_id)"""
+        params = (tourn_id,)
+    cur.execute("""SELECT p.pairing_id,
+                          p.player_1_id,
+                          p1.player_name,
+                          p.player_2_id,
+                          p2.player_name
+                     FROM t_rounds r
+                        JOIN t_pairings p
+                          ON p.round_id = r.round_id
+                        JOIN t_players p1
+                          ON p1.player_id = p.player_1_id
+                        LEFT JOIN t_players p2
+                          ON p2.player_id = p.player_2_id
+                    WHERE r.tourn_id = %s
+                      AND """ + condition + """
+                    ORDER BY p.table_no""", params)
+    return [tuple(row) for row in cur.fetchall()]
+
+
+@_instrumented
+def reportPairing(pairing_id, winner, draw_flag):
+    """Records the outcome of a stored pairing.
+
+    Args:
+      pairing_id: the pairing returned by startRound.
+      winner    : the id number of the player who won, either player of a
+                  draw.
+      draw_flag : 'Y' to indicate a draw, 'N' to indicate a standard result
+    """
+    reportPairings([(pairing_id, winner, draw_flag)])
+
+
+@_instrumented
+def reportPairings(results):
+    """Records the outcome of many stored pairings in one transaction.
+
+    The loser of each pairing is taken from the stored pairing, so only the
+    winner is needed. When the last result of a round is reported the bye,
+    if there is one, is recorded and the round is marked complete.
+
+    Args:
+      results: a list of (pairing_id, winner, draw_flag) tuples, in the same
+               form as the arguments to reportPairing, all belonging to one
+               tournament.
+    """
+    results = list(results)
+    if not results:
+        return
+    with getSession().cursor() as cur:
+        (tourn_id, match_nos) = _reportPairings(cur, results)
+    _cache.invalidate(tourn_id)
+
+
+def _reportPairings(cur, results):
+    """Record the results of stored pairings and complete their rounds,
+       returning the tournament and a dict mapping each player to their
+       match number."""
+    pairing_ids = [pairing_id for (pairing_id, winner, draw_flag) in results]
+    if len(set(pairing_ids)) != len(pairing_ids):
+        raise ValueError("A pairing appears more than once in the results.")
+    # Lock the rounds first, so that two transactions reporting the
+    # last results of a round cannot both miss recording its bye.
+    cur.execute("""SELECT r.round_id
+                     FROM t_rounds r
+                    WHERE r.round_id IN (SELECT p.round_id
+                                           FROM t_pairings p
+                                          WHERE p.pairing_id = ANY(%s))
+                    ORDER BY r.round_id
+                      FOR UPDATE""", (pairing_ids,))
+    cur.execute("""SELECT p.pairing_id,
+                          p.tourn_id,
+                          p.round_id,
+                          p.player_1_id,
+                          p.player_2_id,
+                          p.match_no
+                     FROM t_pairings p
+                    WHERE p.pairing_id = ANY(%s)""", (pairing_ids,))
+    pairings = dict((row[0], row[1:]) for row in cur.fetchall())
+    tourn_ids = set(p[0] for p in pairings.values())
+    if len(tourn_ids) > 1:
+        raise ValueError("Every pairing must belong to one tournament.")
+    winners = []
+    losers = []
+    draw_flags = []
+    for (pairing_id, winner, draw_flag) in results:
+        if pairing_id not in pairings:
+            raise ValueError("Pairing %s does not exist." % (pairing_id,))
+        (tourn_id, round_id, id1, id2, match_no) = pairings[pairing_id]
+        if id2 is None:
+            raise ValueError("Pairing %s is a bye, it is recorded when "
+                             "the round is complete." % (pairing_id,))
+        if match_no is not None:
+            raise ValueError("Pairing %s has already been reported."
+                             % (pairing_id,))
+        if winner not in (id1, id2):
+            raise ValueError("Player %s is not in pairing %s."
+                             % (winner, pairing_id))
+        winners.append(winner)
+        losers.append(id2 if winner == id1 else id1)
+        draw_flags.append(draw_flag)
+    tourn_id = tourn_ids.pop()
+    _checkActive(cur, tourn_id)
+    match_nos = _insertResults(cur, tourn_id, winners, losers, draw_flags)
+    _setPairingMatches(cur, pairing_ids,
+                       [match_nos[winner] for winner in winners])
+    _completeRounds(cur, tourn_id, set(p[1] for p in pairings.values()))
+    return tourn_id, match_nos
+
+
+def _setPairingMatches(cur, pairing_ids, match_nos):
+    """Record the match number of each reported pairing."""
+    cur.execute("""UPDATE t_pairings p
+                      SET match_no = r.match_no
+                     FROM unnest(%s::INTEGER[], %s::INTEGER[])
+                            AS r (pairing_id, match_no)
+                    WHERE p.pairing_id = r.pairing_id""",
+                (pairing_ids, match_nos))
+
+
+def _completeRounds(cur, tourn_id, round_ids):
+    """Record the bye and mark complete each of the rounds whose only
+       unreported pairing, if any, is a bye."""
+    cur.execute("""SELECT r.round_id,
+                          p.pairing_id,
+                          p.player_1_id,
+                          p.player_2_id
+                     FROM t_rounds r
+                        LEFT JOIN t_pairings p
+                          ON p.round_id = r.round_id
+                         AND p.match_no IS NULL
+                    WHERE r.round_id = ANY(%s)
+                      AND r.round_status = 'P'""", (list(round_ids),))
+    outstanding = {}
+    for (round_id, pairing_id, id1, id2) in cur.fetchall():
+        pending = outstanding.setdefault(round_id, [])
+        if pairing_id is not None:
+            pending.append((pairing_id, id1, id2))
+    complete = [round_id for (round_id, pending) in outstanding.items()
+                if all(id2 is None for (pairing_id, id1, id2) in pending)]
+    if not complete:
+        return
+    byes = [(pairing_id, id1)
+            for round_id in complete
+            for (pairing_id, id1, id2) in outstanding[round_id]]
+    if byes:
+        match_nos = _insertResults(cur, tourn_id, [id1 for (p, id1) in byes],
+                                   [None] * len(byes), ['N'] * len(byes))
+        _setPairingMatches(cur, [p for (p, id1) in byes],
+                           [match_nos[id1] for (p, id1) in byes])
+    cur.execute("""UPDATE t_rounds
+                      SET round_status = 'C'
+                    WHERE round_id = ANY(%s)""", (complete,))
@@ -13,8 +13,12 @@ CREATE DATABASE tournament;
 --
 --    Table      : t_tournaments
 --    Description: Simple table that stores data unique to each tournament
---                 being run.
-DROP TABLE t_tournaments CASCADE;
+--                 being run. tourn_tiebreaks is a comma separated list of
+--                 the tiebreaks from tiebreaks.py used to rank players on
+--                 the same score, in the order they are applied.
+--                 tourn_archived is set once f_archive_tournament has
+--                 detached the tournament's partitions.
+DROP TABLE IF EXISTS t_tournaments CASCADE;
 CREATE TABLE t_tournaments
 (
     tourn_id          SERIAL PRIMARY KEY,
@@ -24,7 +28,9 @@ CREATE TABLE t_tournaments
     tourn_win_value   INTEGER DEFAULT 3,
     tourn_loss_value  INTEGER DEFAULT 0,
     tourn_draw_value  INTEGER DEFAULT 1,
-    tourn_bye_value   INTEGER DEFAULT 3
+    tourn_bye_value   INTEGER DEFAULT 3,
+    tourn_tiebreaks   VARCHAR(80) DEFAULT 'omw,buchholz,sonneborn_berger',
+    tourn_archived    BOOLEAN NOT NULL DEFAULT FALSE
 );
 CREATE INDEX i_tournaments_idx1 ON t_tournaments (tourn_id);
 
@@ -32,7 +38,7 @@ CREATE INDEX i_tournaments_idx1 ON t_tournaments (tourn_id);
 --    Table      : t_players
 --    Description: A simple table that stores data unique to each player
 --
-DROP TABLE t_players CASCADE;
+DROP TABLE IF EXISTS t_players CASCADE;
 CREATE TABLE t_players
 (
     player_id   SERIAL PRIMARY KEY,
@@ -50,18 +56,35 @@ CREATE INDEX i_players_idx1 ON t_players (player_id);
 --        match_no    - Which other match_no to link to in this table, there should
 --                      only be one other record in this table with the same value
 --        player_id   - The id number of the player who's result is recorded
---        result_type - The result of the match the player_id, W=Win, L=Loss, D=Draw
-DROP TABLE t_matches CASCADE;
+--        result_type - The result of the match the player_id, W=Win, L=Loss, D=Draw,
+--                      B=Bye. A bye is the only record for its match_no.
+--
+--                 The table is partitioned by tournament, each tournament's
+--                 records being held in their own t_matches_<tourn_id>
+--                 partition created by f_create_tourn_partitions. Queries
+--                 filtered by tourn_id only touch that partition, and a
+--                 finished tournament can be detached or dropped with
+--                 f_archive_tournament without deleting rows.
+DROP TABLE IF EXISTS t_matches CASCADE;
 CREATE TABLE t_matches
 (
-    match_id    SERIAL PRIMARY KEY,
+    match_id    SERIAL,
     tourn_id    INTEGER NOT NULL REFERENCES t_tournaments(tourn_id),
     match_no    INTEGER NOT NULL,
     player_id   INTEGER NOT NULL REFERENCES t_players(player_id),
-    result_type VARCHAR(1) NOT NULL
-);
+    result_type VARCHAR(1) NOT NULL,
+    PRIMARY KEY (tourn_id, match_id)
+) PARTITION BY LIST (tourn_id);
 CREATE INDEX i_matches_idx1 ON t_matches (tourn_id, player_id, match_no);
 CREATE INDEX i_matches_idx2 ON t_matches (tourn_id, player_id, result_type);
+CREATE INDEX i_matches_idx3 ON t_matches (tourn_id, match_no);
+
+--    Sequence   : s_match_no
+--    Description: Hands out match numbers for t_matches. Both records of a
+--                 match share one value, taken once per match, so concurrent
+--                 reporters never collide and no MAX(match_no) scan is needed.
+DROP SEQUENCE IF EXISTS s_match_no;
+CREATE SEQUENCE s_match_no;
 
 
 --    Table      : t_registrations
@@ -69,336 +92,611 @@ CREATE INDEX i_matches_idx2 ON t_matches (tourn_id, player_id, result_type);
 --                 for the purpose of registrations. This could be extended in 
 --                 the future to include a registration status which might 
 --                 indicate payments or withdrawals for each tournament.
-DROP TABLE t_registrations CASCADE;
+--                 Partitioned by tournament in the same way as t_matches.
+DROP TABLE IF EXISTS t_registrations CASCADE;
 CREATE TABLE t_registrations
 (
     tourn_id  INTEGER NOT NULL REFERENCES t_tournaments(tourn_id),
     player_id INTEGER NOT NULL REFERENCES t_players(player_id)
-);
+) PARTITION BY LIST (tourn_id);
 CREATE UNIQUE INDEX i_registrations_idx1 ON t_registrations(tourn_id, player_id);
 
 
---    View       : v_player_wins
---    Description: To provide a total amount of wins for each player in each
---                 tournament. Will also return zero when no matches exist for
---                 the player in a tournament.
---
-CREATE OR REPLACE VIEW v_player_wins AS
-SELECT reg.tourn_id,
-       reg.player_id,
-       SUM(COALESCE(CASE 
-                      WHEN match.result_type = 'W' THEN 1
-                      ELSE 0 
-                    END, 0)) AS wins
-  FROM t_registrations reg
-     LEFT OUTER JOIN t_matches match
-       ON (match.player_id = reg.player_id)
-      AND (match.result_type = 'W')
- GROUP BY reg.tourn_id,
-          reg.player_id;
-
-
---    View       : v_player_losses
---    Description: To provide a total amount of losses for each player in each
---                 tournament. Will also return zero when no matches exist for
---                 the player in a tournament.
-CREATE OR REPLACE VIEW v_player_losses AS
-SELECT reg.tourn_id,
-       reg.player_id,
-       SUM(COALESCE(CASE 
-                      WHEN match.result_type = 'L' THEN 1
-                      ELSE 0 
-                    END, 0)) AS losses
-  FROM t_registrations reg
-     LEFT OUTER JOIN t_matches match
-       ON (match.player_id = reg.player_id)
-      AND (match.result_type = 'L')
- GROUP BY reg.tourn_id,
-          reg.player_id;
-
-
-
---    View       : v_player_draws
---    Description: To provide a total amount of draws for each player in each
---                 tournament. Will also return zero when no matches exist for
---                 the player in a tournament.
-CREATE OR REPLACE VIEW v_player_draws AS
-SELECT reg.tourn_id,
-       reg.player_id,
-       SUM(COALESCE(CASE 
-                      WHEN match.result_type = 'D' THEN 1
-                      ELSE 0 
-                    END, 0)) AS draws
-  FROM t_registrations reg
-     LEFT OUTER JOIN t_matches match
-       ON (match.player_id = reg.player_id)
-      AND (match.result_type = 'D')
- GROUP BY reg.tourn_id,
-          reg.player_id;
-
-
---    View       : v_rounds_played
---    Description: This view provides the amount of rounds played for each
---                 player in a tournament. The idea of this view is so a 
---                 maximum value can be determined in the following view
---                 to ascertain how many rounds have been played so far.
-CREATE OR REPLACE VIEW v_rounds_played AS
-SELECT match.tourn_id,
-       match.player_id,
-       COUNT(1) AS rounds_played
-  FROM t_matches match
- GROUP BY match.tourn_id,
-          match.player_id;
-
-
---    View       : v_player_byes
---    Description: This view provides a sum of how many byes a player has
---                 been allocated in a tournament. It does this bye 
---                 determining how many rounds have been played so far in 
---                 the tournament then subtracting the amount of matches 
---                 the player has actually played. So if 5 rounds have
---                 taken place and the player has only played 4, then it
---                 is safe to assume they have missed a round, therefore
---                 they are allocated a bye.
-CREATE OR REPLACE VIEW v_player_byes AS
-SELECT reg.tourn_id,
-       reg.player_id,
-       ((SELECT COALESCE(MAX(p.rounds_played),0)
-           FROM v_rounds_played p
-          WHERE p.tourn_id = reg.tourn_id) - 
-        (SUM(COALESCE(CASE
-                        WHEN match.result_type IN ('W','L','D') THEN 1
-                        ELSE 0 
-                      END, 0)))) AS byes
-  FROM t_registrations reg
-     LEFT OUTER JOIN t_matches match
-       ON (match.player_id = reg.player_id)
-      AND (match.tourn_id = reg.tourn_id)
-      AND (match.result_type IN ('W','L','D'))
- GROUP BY reg.tourn_id, reg.player_id;
-
-
---  View       : v_opponent_match_wins
---  Description: This view provides another level of ranking scores
---               by adding up all the wins of any opponent they have
---               played before. This would mean that if two players are
---               at the same win level, we can determine who the better
---               player might be at that point because they could have
---               won games against people who have won a lot of games 
---               as well.
-CREATE OR REPLACE VIEW v_opponent_match_wins AS
-SELECT reg.tourn_id,
-       reg.player_id,
-       SUM(COALESCE(CASE
-                      WHEN opp_wins.result_type = 'W' THEN 1
-                      ELSE 0 
-                    END, 0)) AS opponent_match_wins
-  FROM t_registrations reg
-      LEFT OUTER JOIN t_matches matches
-        ON (matches.tourn_id = reg.tourn_id)
-       AND (matches.player_id = reg.player_id)
-      LEFT OUTER JOIN t_matches opp_match
-        ON (opp_match.tourn_id = reg.tourn_id)
-       AND (opp_match.match_no = matches.match_no)
-       AND (opp_match.player_id <> matches.player_id)
-      LEFT OUTER JOIN t_matches opp_wins
-        ON (opp_wins.tourn_id = reg.tourn_id)
-       AND (opp_wins.player_id = opp_match.player_id)
-       AND (opp_wins.player_id <> matches.player_id)
-       AND (opp_wins.result_type = 'W')
- GROUP BY reg.tourn_id,
-          reg.player_id
- ORDER BY reg.tourn_id,
-          reg.player_id ASC;
+--    Include    : tournament_partitions.sql
+--    Description: f_create_tourn_partitions, the tr_tournaments_partitions
+--                 trigger that calls it for each new tournament, and
+--                 f_archive_tournament with its tournament_archive schema.
+\ir tournament_partitions.sql
 
 
+--    Function   : f_reset_tournament
+--    Description: Removes every registration, match, round and standing of
+--                 a tournament, keeping the tournament itself. The
+--                 tournament's partitions are truncated rather than deleted
+--                 from row by row, so the match triggers do not fire and
+--                 the maintained tables are cleared directly.
+CREATE OR REPLACE FUNCTION f_reset_tournament(p_tourn_id INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    v_table TEXT;
+BEGIN
+    FOREACH v_table IN ARRAY ARRAY['t_matches', 't_registrations'] LOOP
+        IF to_regclass(format('%s_%s', v_table, p_tourn_id)) IS NOT NULL THEN
+            EXECUTE format('TRUNCATE %I', v_table || '_' || p_tourn_id);
+        END IF;
+    END LOOP;
+    DELETE FROM t_pairings WHERE tourn_id = p_tourn_id;
+    DELETE FROM t_rounds WHERE tourn_id = p_tourn_id;
+    DELETE FROM t_opponents WHERE tourn_id = p_tourn_id;
+    DELETE FROM t_standings WHERE tourn_id = p_tourn_id;
+    PERFORM pg_notify('tournament_standings',
+                      json_build_object('tourn_id', p_tourn_id,
+                                        'players', NULL)::TEXT);
+END;
+$$ LANGUAGE plpgsql;
+
+
+--    Table      : t_rounds
+--    Description: One record for each round of a tournament, created when
+--                 the round is paired by startRound.
+--    Field Descriptions
+--        round_no     - The number of the round within the tournament
+--        round_status - P=Paired, results are still to be reported,
+--                       C=Complete, every pairing has a result
+DROP TABLE IF EXISTS t_rounds CASCADE;
+CREATE TABLE t_rounds
+(
+    round_id     SERIAL PRIMARY KEY,
+    tourn_id     INTEGER NOT NULL REFERENCES t_tournaments(tourn_id),
+    round_no     INTEGER NOT NULL,
+    round_status VARCHAR(1) NOT NULL DEFAULT 'P'
+);
+CREATE UNIQUE INDEX i_rounds_idx1 ON t_rounds (tourn_id, round_no);
+
+
+--    Table      : t_pairings
+--    Description: The pairings of each round, stored once when the round is
+--                 started so they can be read back without pairing again
+--                 and results can be reported against them.
+--    Field Descriptions
+--        table_no    - The order of the pairing within the round
+--        player_2_id - NULL when player_1_id has the bye
+--        match_no    - The t_matches records of the result, NULL until the
+--                      result is reported
+DROP TABLE IF EXISTS t_pairings CASCADE;
+CREATE TABLE t_pairings
+(
+    pairing_id  SERIAL PRIMARY KEY,
+    round_id    INTEGER NOT NULL REFERENCES t_rounds(round_id),
+    tourn_id    INTEGER NOT NULL REFERENCES t_tournaments(tourn_id),
+    table_no    INTEGER NOT NULL,
+    player_1_id INTEGER NOT NULL REFERENCES t_players(player_id),
+    player_2_id INTEGER REFERENCES t_players(player_id),
+    match_no    INTEGER
+);
+CREATE UNIQUE INDEX i_pairings_idx1 ON t_pairings (round_id, table_no);
+CREATE INDEX i_pairings_idx2 ON t_pairings (tourn_id, round_id);
+
 --    View       : v_player_standings
---    Description: This view brings all of the current results together in 
---                 one place and ranks them by the total score. Retrieving 
+--    Description: This view brings all of the current results together in
+--                 one place and ranks them by the total score. Retrieving
 --                 the win/loss/draw/bye values from the tournament details
 --                 and calculating the total score based on the result types.
---                 This allows for more flexibility later on if different 
+--                 This allows for more flexibility later on if different
 --                 tournaments wish to provide their own score values.
+--
+--                 Wins, losses, draws and rounds played are counted with
+--                 FILTER clauses in a single pass over the tournament's
+--                 matches. Byes are the most rounds played by anyone in the
+--                 tournament less the matches the player has played, taken
+--                 with a window rather than a subquery per player. Opponent
+--                 match wins add up the wins of the opponent in each match
+--                 the player has played.
 CREATE OR REPLACE VIEW v_player_standings AS
-SELECT reg.tourn_id,
-       reg.player_id,
+SELECT s.tourn_id,
+       s.player_id,
        p.player_name,
-       (wins.wins + byes.byes) AS wins,
-       loss.losses,
-       draw.draws,
-       byes.byes,
-       opp_wins.opponent_match_wins,
-       sum(wins.wins   * tourn.tourn_win_value  +
-           byes.byes   * tourn.tourn_bye_value  +
-           loss.losses * tourn.tourn_loss_value +
-           draw.draws  * tourn.tourn_draw_value) AS score
-  FROM t_registrations reg
+       (s.wins + s.byes) AS wins,
+       s.losses,
+       s.draws,
+       s.byes,
+       s.opponent_match_wins,
+       (s.wins   * tourn.tourn_win_value  +
+        s.byes   * tourn.tourn_bye_value  +
+        s.losses * tourn.tourn_loss_value +
+        s.draws  * tourn.tourn_draw_value) AS score
+  FROM (SELECT r.tourn_id,
+               r.player_id,
+               r.wins,
+               r.losses,
+               r.draws,
+               (MAX(r.rounds_played) OVER (PARTITION BY r.tourn_id) -
+                (r.wins + r.losses + r.draws)) AS byes,
+               r.opponent_match_wins
+          FROM (SELECT reg.tourn_id,
+                       reg.player_id,
+                       COUNT(1) FILTER (WHERE match.result_type = 'W') AS wins,
+                       COUNT(1) FILTER (WHERE match.result_type = 'L') AS losses,
+                       COUNT(1) FILTER (WHERE match.result_type = 'D') AS draws,
+                       COUNT(match.match_id) AS rounds_played,
+                       COALESCE(SUM(opp_wins.wins), 0) AS opponent_match_wins
+                  FROM t_registrations reg
+                     LEFT OUTER JOIN t_matches match
+                       ON (match.tourn_id = reg.tourn_id)
+                      AND (match.player_id = reg.player_id)
+                     LEFT OUTER JOIN t_matches opp_match
+                       ON (opp_match.tourn_id = match.tourn_id)
+                      AND (opp_match.match_no = match.match_no)
+                      AND (opp_match.player_id <> match.player_id)
+                     LEFT OUTER JOIN (SELECT m.tourn_id,
+                                             m.player_id,
+                                             COUNT(1) AS wins
+                                        FROM t_matches m
+                                       WHERE m.result_type = 'W'
+                                       GROUP BY m.tourn_id,
+                                                m.player_id) opp_wins
+                       ON (opp_wins.tourn_id = opp_match.tourn_id)
+                      AND (opp_wins.player_id = opp_match.player_id)
+                 GROUP BY reg.tourn_id,
+                          reg.player_id) r) s
     INNER JOIN t_tournaments tourn
-       ON (reg.tourn_id = tourn.tourn_id)
+       ON (s.tourn_id = tourn.tourn_id)
     INNER JOIN t_players p
-       ON (reg.player_id = p.player_id)
-    INNER JOIN v_player_wins wins
-       ON (wins.tourn_id = reg.tourn_id)
-      AND (wins.player_id = reg.player_id)
-    INNER JOIN v_player_losses loss
-       ON (loss.tourn_id = reg.tourn_id)
-      AND (loss.player_id = reg.player_id)
-    INNER JOIN v_player_draws draw
-       ON (draw.tourn_id = reg.tourn_id)
-      AND (draw.player_id = reg.player_id)
-    INNER JOIN v_player_byes byes
-       ON (byes.tourn_id = reg.tourn_id)
-      AND (byes.player_id = reg.player_id)
-    INNER JOIN v_opponent_match_wins opp_wins
-       ON (opp_wins.tourn_id = reg.tourn_id)
-      AND (opp_wins.player_id = reg.player_id)
- GROUP BY reg.tourn_id, 
-          reg.player_id, 
-          p.player_name,
-          wins,
-          loss.losses,
-          draw.draws,
-          byes.byes,
-          opp_wins.opponent_match_wins
- ORDER BY reg.tourn_id ASC,
+       ON (s.player_id = p.player_id)
+ ORDER BY s.tourn_id ASC,
           score DESC,
-          opp_wins.opponent_match_wins DESC;
-
- 
---  View       : v_win_group_totals
---  Description: This view counts the amount of players in each win group
---               so views later on can use this number when working out 
---               how to split the groups into even numbers.
-CREATE OR REPLACE VIEW v_win_group_totals AS
-SELECT t.tourn_id, 
-       t.wins,
-       COUNT(t.player_id) AS group_count
-  FROM v_player_standings t
- GROUP BY t.tourn_id, t.wins;
-
-
---  View       : v_win_group_split
---  Description: This view splits each win group into a top half and 
---               bottom half as the swiss pairing system recommends 
---               but also by placing players with byes at the top
---               so they will always be matched incase there is an 
---               uneven number of players in the tournament.
-CREATE OR REPLACE VIEW v_win_group_split AS
+          s.opponent_match_wins DESC,
+          s.player_id ASC;
+
+
+--    Table      : t_opponents
+--    Description: An adjacency list of who has played who in a tournament,
+--                 with one record in each direction for every match. It is
+--                 maintained from t_matches by tr_matches_opponents_insert
+--                 so rematch checks and opponent lists are index lookups
+--                 instead of self joins of t_matches on match_no.
+DROP TABLE IF EXISTS t_opponents CASCADE;
+CREATE TABLE t_opponents
+(
+    tourn_id    INTEGER NOT NULL REFERENCES t_tournaments(tourn_id),
+    player_id   INTEGER NOT NULL REFERENCES t_players(player_id),
+    opponent_id INTEGER NOT NULL REFERENCES t_players(player_id),
+    match_no    INTEGER NOT NULL,
+    PRIMARY KEY (tourn_id, player_id, opponent_id, match_no)
+);
+-- Finds both records of a match, as f_standings_match_insert does for
+-- every match a statement completes.
+CREATE INDEX i_opponents_idx1 ON t_opponents (tourn_id, match_no);
+
+
+--    Function   : f_rebuild_opponents
+--    Description: Recreates the t_opponents records of a tournament from
+--                 t_matches.
+CREATE OR REPLACE FUNCTION f_rebuild_opponents(p_tourn_id INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    DELETE FROM t_opponents WHERE tourn_id = p_tourn_id;
+    INSERT INTO t_opponents (tourn_id, player_id, opponent_id, match_no)
+    SELECT m1.tourn_id,
+           m1.player_id,
+           m2.player_id,
+           m1.match_no
+      FROM t_matches m1
+        INNER JOIN t_matches m2
+           ON (m2.tourn_id = m1.tourn_id)
+          AND (m2.match_no = m1.match_no)
+          AND (m2.player_id <> m1.player_id)
+     WHERE m1.tourn_id = p_tourn_id;
+END;
+$$ LANGUAGE plpgsql;
+
+
+--    Function   : f_opponents_match_insert
+--    Description: Records both directions of a meeting in t_opponents once
+--                 the second record of a match is inserted.
+CREATE OR REPLACE FUNCTION f_opponents_match_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO t_opponents (tourn_id, player_id, opponent_id, match_no)
+    SELECT m.tourn_id, pair.player_id, pair.opponent_id, m.match_no
+      FROM t_matches m
+        CROSS JOIN LATERAL (VALUES (NEW.player_id, m.player_id),
+                                   (m.player_id, NEW.player_id))
+                             AS pair (player_id, opponent_id)
+     WHERE m.tourn_id = NEW.tourn_id
+       AND m.match_no = NEW.match_no
+       AND m.player_id <> NEW.player_id
+       AND m.match_id < NEW.match_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Row triggers fire before statement triggers, so t_opponents is up to date
+-- before tr_matches_standings_insert runs.
+CREATE TRIGGER tr_matches_opponents_insert
+AFTER INSERT ON t_matches
+FOR EACH ROW EXECUTE PROCEDURE f_opponents_match_insert();
+
+
+--    Table      : t_standings
+--    Description: Keeps a running total of each registered player's results
+--                 in a tournament so standings can be read with an index
+--                 lookup instead of re-aggregating t_matches on every call.
+--                 The rows are maintained by the triggers below in the same
+--                 transaction as the match results, and can be recreated
+--                 from t_matches at any time with f_rebuild_standings.
+--    Field Descriptions
+--        wins                - Matches won, not including byes
+--        losses              - Matches lost
+--        draws               - Matches drawn
+--        rounds_played       - Every match record for the player, including
+--                              byes, used to derive implicit byes the same
+--                              way v_player_standings does
+--        opponent_match_wins - The same total as v_player_standings
+DROP TABLE IF EXISTS t_standings CASCADE;
+CREATE TABLE t_standings
+(
+    tourn_id            INTEGER NOT NULL REFERENCES t_tournaments(tourn_id),
+    player_id           INTEGER NOT NULL REFERENCES t_players(player_id),
+    wins                INTEGER NOT NULL DEFAULT 0,
+    losses              INTEGER NOT NULL DEFAULT 0,
+    draws               INTEGER NOT NULL DEFAULT 0,
+    rounds_played       INTEGER NOT NULL DEFAULT 0,
+    opponent_match_wins INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (tourn_id, player_id)
+);
+
+
+--    Function   : f_rebuild_standings
+--    Description: Recalculates every t_standings row for a tournament from
+--                 t_registrations and t_matches, rebuilding t_opponents
+--                 first as the opponent match wins are counted from it, and
+--                 notifies subscribers that the whole tournament changed.
+CREATE OR REPLACE FUNCTION f_rebuild_standings(p_tourn_id INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    PERFORM f_rebuild_opponents(p_tourn_id);
+    DELETE FROM t_standings WHERE tourn_id = p_tourn_id;
+    INSERT INTO t_standings (tourn_id,
+                             player_id,
+                             wins,
+                             losses,
+                             draws,
+                             rounds_played,
+                             opponent_match_wins)
+    SELECT reg.tourn_id,
+           reg.player_id,
+           SUM(CASE WHEN match.result_type = 'W' THEN 1 ELSE 0 END),
+           SUM(CASE WHEN match.result_type = 'L' THEN 1 ELSE 0 END),
+           SUM(CASE WHEN match.result_type = 'D' THEN 1 ELSE 0 END),
+           COUNT(match.match_id),
+           (SELECT COUNT(1)
+              FROM t_opponents opp
+                INNER JOIN t_matches opp_wins
+                   ON (opp_wins.tourn_id = opp.tourn_id)
+                  AND (opp_wins.player_id = opp.opponent_id)
+                  AND (opp_wins.result_type = 'W')
+             WHERE opp.tourn_id = reg.tourn_id
+               AND opp.player_id = reg.player_id)
+      FROM t_registrations reg
+         LEFT OUTER JOIN t_matches match
+           ON (match.tourn_id = reg.tourn_id)
+          AND (match.player_id = reg.player_id)
+     WHERE reg.tourn_id = p_tourn_id
+     GROUP BY reg.tourn_id,
+              reg.player_id;
+    -- Every player may have changed, see f_notify_standings.
+    PERFORM pg_notify('tournament_standings',
+                      json_build_object('tourn_id', p_tourn_id,
+                                        'players', NULL)::TEXT);
+END;
+$$ LANGUAGE plpgsql;
+
+
+--    Function   : f_standings_register
+--    Description: Adds or removes the t_standings rows of the players
+--                 registered to, or deleted from, a tournament by a
+--                 statement. The rows are written in (tourn_id, player_id)
+--                 order, the same order f_standings_match_insert locks
+--                 them in, so concurrent statements queue on the first row
+--                 they share instead of deadlocking.
+CREATE OR REPLACE FUNCTION f_standings_register()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO t_standings (tourn_id, player_id)
+        SELECT c.tourn_id, c.player_id
+          FROM changed_registrations c
+         ORDER BY c.tourn_id, c.player_id
+        ON CONFLICT DO NOTHING;
+    ELSE
+        PERFORM 1
+           FROM t_standings s
+          WHERE (s.tourn_id, s.player_id) IN (SELECT c.tourn_id, c.player_id
+                                                FROM changed_registrations c)
+          ORDER BY s.tourn_id, s.player_id
+            FOR UPDATE;
+        DELETE FROM t_standings s
+         USING changed_registrations c
+         WHERE s.tourn_id = c.tourn_id
+           AND s.player_id = c.player_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A trigger with transition tables can only have one event.
+CREATE TRIGGER tr_registrations_standings_insert
+AFTER INSERT ON t_registrations
+REFERENCING NEW TABLE AS changed_registrations
+FOR EACH STATEMENT EXECUTE PROCEDURE f_standings_register();
+
+CREATE TRIGGER tr_registrations_standings_delete
+AFTER DELETE ON t_registrations
+REFERENCING OLD TABLE AS changed_registrations
+FOR EACH STATEMENT EXECUTE PROCEDURE f_standings_register();
+
+
+--    Function   : f_standings_match_insert
+--    Description: Applies the match records inserted by a statement to
+--                 t_standings. Each player's own totals are incremented, a
+--                 win is added to the opponent_match_wins of everyone the
+--                 winner met in earlier matches, and the two players of
+--                 each match completed by the statement pick up each
+--                 other's win totals. A match is completed by its second
+--                 record, so it is only counted once whichever order its
+--                 records arrive in. A statement may insert many matches,
+--                 but only one record per player, as reportRound does.
+--                 Every row the statement changes is locked first, in
+--                 (tourn_id, player_id) order, so concurrent reports that
+--                 share players queue instead of deadlocking.
+CREATE OR REPLACE FUNCTION f_standings_match_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM 1
+       FROM t_standings s
+      WHERE (s.tourn_id, s.player_id) IN (SELECT n.tourn_id, n.player_id
+                                            FROM new_matches n
+                                          UNION
+                                          SELECT o.tourn_id, o.opponent_id
+                                            FROM new_matches n
+                                              INNER JOIN t_opponents o
+                                                 ON (o.tourn_id = n.tourn_id)
+                                                AND (o.player_id = n.player_id))
+      ORDER BY s.tourn_id, s.player_id
+        FOR UPDATE;
+
+    UPDATE t_standings s
+       SET wins = s.wins + n.wins,
+           losses = s.losses + n.losses,
+           draws = s.draws + n.draws,
+           rounds_played = s.rounds_played + n.rounds_played
+      FROM (SELECT tourn_id,
+                   player_id,
+                   SUM(CASE WHEN result_type = 'W' THEN 1 ELSE 0 END) AS wins,
+                   SUM(CASE WHEN result_type = 'L' THEN 1 ELSE 0 END) AS losses,
+                   SUM(CASE WHEN result_type = 'D' THEN 1 ELSE 0 END) AS draws,
+                   COUNT(1) AS rounds_played
+              FROM new_matches
+             GROUP BY tourn_id, player_id) n
+     WHERE s.tourn_id = n.tourn_id
+       AND s.player_id = n.player_id;
+
+    -- The t_opponents rows of a match only exist once it is complete, so
+    -- joining them on the new match numbers finds the completed matches.
+    UPDATE t_standings s
+       SET opponent_match_wins = s.opponent_match_wins + gained.wins
+      FROM (SELECT gains.tourn_id,
+                   gains.player_id,
+                   SUM(gains.wins) AS wins
+              FROM (SELECT o.tourn_id, o.opponent_id AS player_id, 1 AS wins
+                      FROM new_matches n
+                        INNER JOIN t_opponents o
+                           ON (o.tourn_id = n.tourn_id)
+                          AND (o.player_id = n.player_id)
+                          AND (o.match_no <> n.match_no)
+                     WHERE n.result_type = 'W'
+                    UNION ALL
+                    SELECT o.tourn_id, o.player_id, opp.wins
+                      FROM (SELECT DISTINCT tourn_id, match_no
+                              FROM new_matches) n
+                        INNER JOIN t_opponents o
+                           ON (o.tourn_id = n.tourn_id)
+                          AND (o.match_no = n.match_no)
+                        INNER JOIN t_standings opp
+                           ON (opp.tourn_id = o.tourn_id)
+                          AND (opp.player_id = o.opponent_id)) gains
+             GROUP BY gains.tourn_id, gains.player_id) gained
+     WHERE s.tourn_id = gained.tourn_id
+       AND s.player_id = gained.player_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER tr_matches_standings_insert
+AFTER INSERT ON t_matches
+REFERENCING NEW TABLE AS new_matches
+FOR EACH STATEMENT EXECUTE PROCEDURE f_standings_match_insert();
+
+
+--    Function   : f_standings_match_delete
+--    Description: Removing match records can change the totals of anyone
+--                 who played the players involved, so the opponents and
+--                 standings of each affected tournament are rebuilt once
+--                 per statement.
+CREATE OR REPLACE FUNCTION f_standings_match_delete()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_tourn RECORD;
+BEGIN
+    FOR v_tourn IN SELECT DISTINCT tourn_id FROM old_matches LOOP
+        PERFORM f_rebuild_standings(v_tourn.tourn_id);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER tr_matches_standings_delete
+AFTER DELETE ON t_matches
+REFERENCING OLD TABLE AS old_matches
+FOR EACH STATEMENT EXECUTE PROCEDURE f_standings_match_delete();
+
+
+--    Function   : f_notify_standings
+--    Description: Sends a notification on the tournament_standings channel
+--                 for each tournament a statement on t_matches or
+--                 t_registrations touched. Notifications are delivered when
+--                 the transaction commits, and identical ones in the same
+--                 transaction are sent once. The payload is a JSON object
+--                 with the tourn_id and the ids of the players whose results
+--                 or registrations changed. players is null when every
+--                 player may have changed, as after matches are deleted, or
+--                 when the list would not fit in a notification.
+CREATE OR REPLACE FUNCTION f_notify_standings()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_change RECORD;
+BEGIN
+    FOR v_change IN SELECT c.tourn_id,
+                           array_agg(DISTINCT c.player_id) AS players
+                      FROM changed_rows c
+                     GROUP BY c.tourn_id LOOP
+        PERFORM pg_notify('tournament_standings',
+                          json_build_object(
+                              'tourn_id', v_change.tourn_id,
+                              'players',
+                              CASE
+                                WHEN TG_TABLE_NAME = 't_matches'
+                                 AND TG_OP = 'DELETE' THEN NULL
+                                WHEN cardinality(v_change.players) > 500
+                                  THEN NULL
+                                ELSE v_change.players
+                              END)::TEXT);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER tr_matches_notify_insert
+AFTER INSERT ON t_matches
+REFERENCING NEW TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE f_notify_standings();
+
+CREATE TRIGGER tr_matches_notify_delete
+AFTER DELETE ON t_matches
+REFERENCING OLD TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE f_notify_standings();
+
+CREATE TRIGGER tr_registrations_notify_insert
+AFTER INSERT ON t_registrations
+REFERENCING NEW TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE f_notify_standings();
+
+CREATE TRIGGER tr_registrations_notify_delete
+AFTER DELETE ON t_registrations
+REFERENCING OLD TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE f_notify_standings();
+
+
+--    View       : v_standings
+--    Description: The same rows as v_player_standings read from t_standings.
+--                 Byes are derived from the most rounds played by anyone in
+--                 the tournament, exactly as v_player_standings does.
+CREATE OR REPLACE VIEW v_standings AS
 SELECT s.tourn_id,
        s.player_id,
-       s.player_name,
-       s.wins,
+       p.player_name,
+       (s.wins + s.byes) AS wins,
+       s.losses,
+       s.draws,
        s.byes,
-       NTILE((t.group_count/(t.group_count/2))::INTEGER) OVER (PARTITION BY s.tourn_id, s.wins
-                                                                   ORDER BY s.tourn_id, s.byes DESC) AS group_split
-  FROM v_player_standings s
-    INNER JOIN v_win_group_totals t
-       ON (s.tourn_id = t.tourn_id)
-      AND (s.wins = t.wins)
-      AND (t.group_count > 1)  -- This clause limits a potential divide by zero on previous tournaments that have completed.
- ORDER BY s.tourn_id, 
-          s.wins DESC, 
+       s.opponent_match_wins,
+       (s.wins   * tourn.tourn_win_value  +
+        s.byes   * tourn.tourn_bye_value  +
+        s.losses * tourn.tourn_loss_value +
+        s.draws  * tourn.tourn_draw_value) AS score
+  FROM (SELECT st.tourn_id,
+               st.player_id,
+               st.wins,
+               st.losses,
+               st.draws,
+               (MAX(st.rounds_played) OVER (PARTITION BY st.tourn_id) -
+                (st.wins + st.losses + st.draws)) AS byes,
+               st.opponent_match_wins
+          FROM t_standings st) s
+    INNER JOIN t_tournaments tourn
+       ON (s.tourn_id = tourn.tourn_id)
+    INNER JOIN t_players p
+       ON (s.player_id = p.player_id)
+ ORDER BY s.tourn_id ASC,
+          score DESC,
+          s.opponent_match_wins DESC,
           s.player_id ASC;
 
 
---  View       : v_win_group_order
---  Description: This view will number each win groups split so they 
---               can be joined on the same split_order in the matchups
---               view. The sorting is done by joining to the opponent
---               match wins view, which provides 
-CREATE OR REPLACE VIEW v_win_group_order AS
-SELECT s.tourn_id,
-       s.player_id,
-       s.player_name,
-       s.wins,
-       s.group_split,
-       ROW_NUMBER() OVER (PARTITION BY s.tourn_id, 
-                                       s.wins,
-                                       s.group_split
-                              ORDER BY op_wins.opponent_match_wins DESC) AS split_order
-  FROM v_win_group_split s
-    INNER JOIN v_opponent_match_wins op_wins
-       ON (op_wins.tourn_id = s.tourn_id)
-      AND (op_wins.player_id = s.player_id)
- ORDER BY s.tourn_id,
-          s.wins DESC,
-          s.group_split ASC;
-
-
---  View       : v_swiss_matchups
---  Description: The final view that provides which matches to play next.
---               The first half of the union limits the matchups to players
---               that have not played against each other before. The second
---               half of the union is for matches classified as rematches.
---               This works on the assumption that if there is one rematch,
---               there has to be another rematch taking place in the same
---               win grouping, which we will end up swapping oppoenents with.
-CREATE OR REPLACE VIEW v_swiss_matchups AS
-SELECT p1.tourn_id,
-       p1.player_id   AS player_1_id,
-       p1.player_name AS player_1_name,
-       p2.player_id   AS player_2_id,
-       p2.player_name AS player_2_name
-  FROM v_win_group_order p1
-     INNER join v_win_group_order p2
-        ON (p2.tourn_id = p1.tourn_id)
-       AND (p2.wins = p1.wins)
-       AND (p2.split_order = p1.split_order)
-       AND (p2.group_split = 2)
- WHERE p1.group_split = 1
-   -- Exclude rematches, we deal with these in the other half
-   -- of the union
-   AND NOT EXISTS (SELECT 1
-                     FROM t_matches m1
-                       INNER JOIN t_matches m2
-                          ON (m2.tourn_id = m1.tourn_id) 
-                         AND (m2.match_no = m1.match_no)
-                         AND (m2.player_id = p2.player_id)
-                    WHERE m1.player_id = p1.player_id)
- UNION
-SELECT p1.tourn_id,
-       p1.player_id              AS player_1_id,
-       p1.player_name            AS player_1_name,
-       other_rematch.player_id   AS player_2_id,
-       other_rematch.player_name AS player_2_name
-  FROM v_win_group_order p1
-    -- Join to the rematch we want to avoid so we can use it
-    -- to include the exact records we excluded in the query
-    -- from the first half of the union
-    INNER join v_win_group_order rematch
-       ON (rematch.tourn_id = p1.tourn_id)
-      AND (rematch.wins = p1.wins)
-      AND (rematch.split_order = p1.split_order)
-      AND (rematch.group_split = 2)
-    -- Join to the other rematch taking place in the same win group
-    -- but on the 2nd half of the group split so we end up swapping
-    -- the 2nd player of each matchup
-    INNER JOIN v_win_group_order other_rematch 
-       ON (other_rematch.tourn_id = p1.tourn_id)
-      AND (other_rematch.wins = p1.wins)
-      AND (other_rematch.group_split = 2)   
-      AND (other_rematch.split_order <> p1.split_order)
- WHERE p1.group_split = 1
-   -- Only include records for other matchups where
-   -- the other match is classified as a rematch as well.
-   AND EXISTS (SELECT 1
-                 FROM v_win_group_order rm
-                WHERE rm.tourn_id = other_rematch.tourn_id
-                  AND rm.wins = other_rematch.wins
-                  AND rm.group_split = 1
-                  AND rm.split_order = other_rematch.split_order
-                  AND EXISTS (SELECT 1
-                                FROM t_matches m1
-                                  INNER JOIN t_matches m2
-                                     ON (m2.tourn_id = m1.tourn_id) 
-                                    AND (m2.match_no = m1.match_no)
-                                    AND (m2.player_id = other_rematch.player_id)
-                               WHERE m1.player_id = rm.player_id))
-   -- Only include records where a rematch exists
-   AND EXISTS (SELECT 1
-                 FROM t_matches m1
-                   INNER JOIN t_matches m2
-                      ON (m2.tourn_id = m1.tourn_id) 
-                     AND (m2.match_no = m1.match_no)
-                     AND (m2.player_id = rematch.player_id)
-                WHERE m1.player_id = p1.player_id);
+
+--    Function   : f_report_match
+--    Description: Records the result of one match, the winner's and the
+--                 loser's records being written by a single statement under
+--                 one match number from s_match_no, and returns the match
+--                 number. A NULL p_loser records a bye for the winner.
+--                 A player with an unreported pairing in a started round is
+--                 refused with SQLSTATE TR001, as the result belongs to the
+--                 pairing, which reportRound reports it against. A
+--                 tournament archived by f_archive_tournament is refused
+--                 with SQLSTATE TR002.
+--                 PL/pgSQL keeps the plan of the insert for the life of the
+--                 connection, and called outside a transaction block the
+--                 whole result is written in one round trip.
+CREATE OR REPLACE FUNCTION f_report_match(p_tourn_id INTEGER,
+                                          p_winner INTEGER,
+                                          p_loser INTEGER,
+                                          p_draw_flag VARCHAR)
+RETURNS INTEGER AS $$
+DECLARE
+    v_match_no INTEGER;
+BEGIN
+    IF EXISTS (SELECT 1
+                 FROM t_tournaments t
+                WHERE t.tourn_id = p_tourn_id
+                  AND t.tourn_archived) THEN
+        RAISE EXCEPTION 'Tournament % has been archived.', p_tourn_id
+              USING ERRCODE = 'TR002';
+    END IF;
+    IF EXISTS (SELECT 1
+                 FROM t_rounds r
+                    JOIN t_pairings p
+                      ON p.round_id = r.round_id
+                WHERE r.tourn_id = p_tourn_id
+                  AND r.round_status = 'P'
+                  AND p.match_no IS NULL
+                  AND (p.player_1_id IN (p_winner, p_loser)
+                       OR p.player_2_id IN (p_winner, p_loser))) THEN
+        RAISE EXCEPTION 'Player % or % has a pairing in a started round.',
+                        p_winner, p_loser
+              USING ERRCODE = 'TR001';
+    END IF;
+    v_match_no := nextval('s_match_no');
+    INSERT INTO t_matches (tourn_id,
+                           match_no,
+                           player_id,
+                           result_type)
+    SELECT p_tourn_id,
+           v_match_no,
+           r.player_id,
+           r.result_type
+      FROM (VALUES (p_winner,
+                    CASE
+                      WHEN p_loser IS NULL THEN 'B'
+                      WHEN p_draw_flag = 'Y' THEN 'D'
+                      ELSE 'W'
+                    END),
+                   (p_loser,
+                    CASE
+                      WHEN p_draw_flag = 'Y' THEN 'D'
+                      ELSE 'L'
+                    END)) AS r (player_id, result_type)
+     WHERE r.player_id IS NOT NULL;
+    RETURN v_match_no;
+END;
+$$ LANGUAGE plpgsql;
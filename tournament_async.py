@@ -0,0 +1,570 @@
+#!/usr/bin/env python3
+#
+# tournament_async.py -- asyncio implementation of the Swiss-system
+# tournament API
+#
+# The functions here take the same arguments and return the same shapes as
+# tournament.py, but run on psycopg 3's asyncio support with a shared
+# AsyncConnectionPool, so one process can serve many concurrent requests
+# without tying up a thread for each. Pairing and tiebreaks are computed by
+# the same pairing.py and tiebreaks.py code.
+#
+# This module needs Python 3.7 or later and psycopg 3 with its connection
+# pool, installed with pip install "psycopg[pool]". tournament.py and the
+# rest of the project keep running on psycopg2 and Python 2.
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+
+import pairing
+import tiebreaks
+
+
+DEFAULT_DSN = os.environ.get("TOURNAMENT_DSN", "dbname=tournament")
+
+# The SQLSTATE f_report_match raises when a player has a pairing in a
+# started round, so reportMatch can report the result against the pairing.
+STARTED_ROUND_ERROR = "TR001"
+
+# The SQLSTATE f_report_match raises for a tournament that has been archived.
+ARCHIVED_ERROR = "TR002"
+
+
+class AsyncTournamentSession(object):
+    """A pool of asynchronous database connections shared by the API.
+
+    The pool, and the lock that guards opening it, are created on first
+    use, inside the event loop that runs the API calls.
+
+    Args:
+      dsn    : the libpq connection string for the tournament database.
+      minconn: the number of connections kept open in the pool.
+      maxconn: the maximum number of connections the pool will open.
+    """
+
+    def __init__(self, dsn=DEFAULT_DSN, minconn=1, maxconn=10):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size, expected "
+                             "0 <= minconn <= maxconn and maxconn >= 1.")
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._pool = None
+        self._lock = None
+
+    def _getLock(self):
+        """Returns the lock guarding the pool, creating it on first use so
+           it belongs to the running loop on every Python 3 version."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _getPool(self):
+        """Returns the connection pool, opening it on first use."""
+        if self._pool is None:
+            async with self._getLock():
+                if self._pool is None:
+                    pool = AsyncConnectionPool(self.dsn,
+                                               min_size=self.minconn,
+                                               max_size=self.maxconn,
+                                               open=False)
+                    await pool.open()
+                    self._pool = pool
+        return self._pool
+
+    @asynccontextmanager
+    async def cursor(self):
+        """Borrow a connection and yield a cursor on it inside a single
+        transaction, committed when the block completes and rolled back if
+        it raises."""
+        pool = await self._getPool()
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                yield cur
+
+    async def close(self):
+        """Close every connection held by the pool."""
+        async with self._getLock():
+            if self._pool is not None:
+                await self._pool.close()
+                self._pool = None
+
+
+_session = None
+
+
+def getSession():
+    """Returns the session shared by the module level API functions."""
+    global _session
+    if _session is None:
+        _session = AsyncTournamentSession()
+    return _session
+
+
+async def setSession(session):
+    """Replace the session shared by the module level API functions, closing
+       the previous one. Returns the new session."""
+    global _session
+    previous = _session
+    _session = session
+    if previous is not None and previous is not session:
+        await previous.close()
+    return session
+
+
+async def configure(dsn=DEFAULT_DSN, minconn=1, maxconn=10):
+    """Point the API at a database with a pool of the given size."""
+    return await setSession(AsyncTournamentSession(dsn, minconn, maxconn))
+
+
+async def createTournament(tourn_description, tourn_date):
+    """Create new tournament, return the tournament ID"""
+    async with getSession().cursor() as cur:
+        await cur.execute("""INSERT INTO t_tournaments (tourn_description,
+                                                        tourn_date)
+                                                VALUES (%s, %s)
+                             RETURNING tourn_id""",
+                          (tourn_description, tourn_date, ))
+        row = await cur.fetchone()
+    return row[0]
+
+
+async def deleteMatches(tourn_id):
+    """Remove all the match records from the database, along with the rounds
+       and pairings they were reported against."""
+    async with getSession().cursor() as cur:
+        await _checkActive(cur, tourn_id)
+        await cur.execute("""DELETE FROM t_pairings WHERE tourn_id = %s""",
+                          (tourn_id,))
+        await cur.execute("""DELETE FROM t_rounds WHERE tourn_id = %s""",
+                          (tourn_id,))
+        await cur.execute("""DELETE FROM t_matches WHERE tourn_id = %s""",
+                          (tourn_id,))
+
+
+async def deletePlayers(tourn_id):
+    """Remove all the player records from the database for the tournament
+       specified."""
+    async with getSession().cursor() as cur:
+        await _checkActive(cur, tourn_id)
+        await cur.execute("DELETE FROM t_registrations WHERE tourn_id = %s",
+                          (tourn_id,))
+
+
+async def _checkActive(cur, tourn_id):
+    """Raise ValueError if a tournament has been archived, as
+       tournament._checkActive does."""
+    await cur.execute("""SELECT t.tourn_archived
+                           FROM t_tournaments t
+                          WHERE t.tourn_id = %s""", (tourn_id,))
+    row = await cur.fetchone()
+    if row is not None and row[0]:
+        raise ValueError("Tournament %s has been archived." % (tourn_id,))
+
+
+async def countPlayers(tourn_id):
+    """Returns the number of players currently registered."""
+    async with getSession().cursor() as cur:
+        await cur.execute("""SELECT COUNT(r.player_id) AS player_count
+                               FROM t_registrations r
+                              WHERE r.tourn_id = %s""", (tourn_id,))
+        row = await cur.fetchone()
+    return row[0]
+
+
+async def registerPlayer(tourn_id, name):
+    """Adds a player to the tournament database, returning their id."""
+    return (await registerPlayers(tourn_id, [name]))[0]
+
+
+async def registerPlayers(tourn_id, names):
+    """Adds a whole roster of players to a tournament in one transaction,
+       returning the ids assigned in the same order as names."""
+    names = list(names)
+    if not names:
+        return []
+    async with getSession().cursor() as cur:
+        await _checkActive(cur, tourn_id)
+        await cur.execute("""WITH new_players AS (
+                                 SELECT nextval('t_players_player_id_seq')
+                                          AS player_id,
+                                        n.player_name,
+                                        n.ord
+                                   FROM unnest(%s::VARCHAR[])
+                                          WITH ORDINALITY
+                                          AS n (player_name, ord)
+                             ), players AS (
+                                 INSERT INTO t_players (player_id,
+                                                        player_name)
+                                 SELECT np.player_id, np.player_name
+                                   FROM new_players np
+                             ), registrations AS (
+                                 INSERT INTO t_registrations (tourn_id,
+                                                              player_id)
+                                 SELECT %s, np.player_id
+                                   FROM new_players np
+                             )
+                             SELECT np.player_id
+                               FROM new_players np
+                              ORDER BY np.ord""", (names, tourn_id))
+        rows = await cur.fetchall()
+    return [row[0] for row in rows]
+
+
+async def playerStandings(tourn_id, recalculate=False, tiebreaks=None):
+    """Returns a list of the players and their match records sorted by wins,
+       as tournament.playerStandings does."""
+    async with getSession().cursor() as cur:
+        await cur.execute("""SELECT v.player_id,
+                                    v.player_name,
+                                    v.wins,
+                                    v.losses,
+                                    v.draws,
+                                    (v.wins + v.losses + v.draws) AS matches,
+                                    v.opponent_match_wins,
+                                    v.score
+                               FROM """ + ("v_player_standings" if recalculate
+                                           else "v_standings") + """ v
+                              WHERE v.tourn_id = %s
+                              ORDER BY v.score DESC,
+                                       v.opponent_match_wins DESC,
+                                       v.player_id ASC
+                          """, (tourn_id,))
+        rows = await cur.fetchall()
+        if tiebreaks:
+            values = await _loadTiebreaks(cur, tourn_id, tiebreaks,
+                                          [row[0] for row in rows])
+    results = [tuple(row[:7]) for row in rows]
+    if tiebreaks:
+        scores = dict((row[0], row[7]) for row in rows)
+        results.sort(key=lambda row: ([-scores[row[0]]] +
+                                      [-v for v in values[row[0]]] +
+                                      [row[0]]))
+        results = [row + (values[row[0]],) for row in results]
+    return results
+
+
+async def _loadTiebreaks(cur, tourn_id, names, player_ids):
+    """Returns the tiebreak values of every player in a tournament, loading
+       its match records once. names may be True for the tournament's
+       configured tiebreaks."""
+    await cur.execute("""SELECT t.tourn_win_value,
+                                t.tourn_loss_value,
+                                t.tourn_draw_value,
+                                t.tourn_bye_value,
+                                t.tourn_tiebreaks
+                           FROM t_tournaments t
+                          WHERE t.tourn_id = %s""", (tourn_id,))
+    row = await cur.fetchone()
+    if names is True:
+        names = tiebreaks.parseTiebreaks(row[4])
+    await cur.execute("""SELECT m.player_id,
+                                m.match_no,
+                                m.result_type
+                           FROM t_matches m
+                          WHERE m.tourn_id = %s""", (tourn_id,))
+    return tiebreaks.computeTiebreaks(player_ids, await cur.fetchall(),
+                                      row[:4], names)
+
+
+async def reportMatch(tourn_id, winner, loser, draw_flag):
+    """Records the outcome of a single match between two players.
+
+    Args:
+      winner   : the id number of the player who won
+      loser    : the id number of the player who lost
+      draw_flag: 'Y' to indicate a draw, 'N' to indicate a standard result
+
+    The result is written by the f_report_match function, which psycopg
+    prepares on the connection once it has been called a few times. When
+    the players have a pairing in a round started by tournament.startRound
+    the result is reported against that pairing instead, as reportRound
+    does.
+
+    Returns:
+      The match number of the result.
+    """
+    if winner is None:
+        raise ValueError("Every result needs a winning player id.")
+    if winner == loser:
+        raise ValueError("Player %s appears more than once in the "
+                         "round." % (winner,))
+    try:
+        async with getSession().cursor() as cur:
+            await cur.execute("SELECT f_report_match(%s, %s, %s, %s)",
+                              (tourn_id, winner, loser, draw_flag))
+            row = await cur.fetchone()
+    except psycopg.Error as e:
+        if e.sqlstate == ARCHIVED_ERROR:
+            raise ValueError("Tournament %s has been archived." % (tourn_id,))
+        if e.sqlstate != STARTED_ROUND_ERROR:
+            raise
+        return (await _reportResults(tourn_id,
+                                     [(winner, loser, draw_flag)]))[winner]
+    return row[0]
+
+
+async def reportRound(tourn_id, results):
+    """Records the outcome of every match in a round in one transaction.
+
+    Results of players with a pairing in a round started by
+    tournament.startRound are reported against their pairings, so the round
+    completes, as tournament.reportRound does.
+
+    Args:
+      tourn_id: the tournament the round was played in.
+      results : a list of (winner, loser, draw_flag) tuples, in the same form
+                as the arguments to reportMatch. A loser of None records a
+                bye for the winner.
+    """
+    await _reportResults(tourn_id, results)
+
+
+async def _reportResults(tourn_id, results):
+    """Record a list of results in one transaction, returning a dict mapping
+       each player to their match number, as tournament._reportResults
+       does."""
+    results = list(results)
+    seen = set()
+    for (winner, loser, draw_flag) in results:
+        for player_id in (winner, loser):
+            if player_id is None:
+                continue
+            if player_id in seen:
+                raise ValueError("Player %s appears more than once in the "
+                                 "round." % (player_id,))
+            seen.add(player_id)
+        if winner is None:
+            raise ValueError("Every result needs a winning player id.")
+    if not results:
+        return {}
+    async with getSession().cursor() as cur:
+        await _checkActive(cur, tourn_id)
+        started = await _startedPairings(cur, tourn_id, list(seen))
+        plain = []
+        paired = []
+        for (winner, loser, draw_flag) in results:
+            pairing_row = started.get(winner) or started.get(loser)
+            if pairing_row is None:
+                plain.append((winner, loser, draw_flag))
+                continue
+            (pairing_id, round_id, id1, id2) = pairing_row
+            if id2 is None or {winner, loser} != {id1, id2}:
+                raise ValueError("Player %s is paired at pairing %s of a "
+                                 "started round, the result must be for "
+                                 "that pairing." % (
+                                     winner if winner in (id1, id2)
+                                     else loser, pairing_id))
+            paired.append((pairing_id, round_id, winner, loser, draw_flag))
+        match_nos = {}
+        if plain:
+            match_nos.update(await _insertResults(
+                cur, tourn_id, [r[0] for r in plain], [r[1] for r in plain],
+                [r[2] for r in plain]))
+        if paired:
+            paired_nos = await _insertResults(
+                cur, tourn_id, [r[2] for r in paired], [r[3] for r in paired],
+                [r[4] for r in paired])
+            await _setPairingMatches(cur, [r[0] for r in paired],
+                                     [paired_nos[r[2]] for r in paired])
+            await _completeRounds(cur, tourn_id, {r[1] for r in paired})
+            match_nos.update(paired_nos)
+    return match_nos
+
+
+async def _startedPairings(cur, tourn_id, player_ids):
+    """Returns a dict mapping each of the players with an unreported pairing
+       in a started round of the tournament to its (pairing_id, round_id,
+       id1, id2). The started rounds are locked first, as
+       tournament.reportPairings locks them."""
+    await cur.execute("""SELECT r.round_id
+                           FROM t_rounds r
+                          WHERE r.tourn_id = %s
+                            AND r.round_status = 'P'
+                          ORDER BY r.round_id
+                            FOR UPDATE""", (tourn_id,))
+    if not await cur.fetchall():
+        return {}
+    await cur.execute("""SELECT p.pairing_id,
+                                p.round_id,
+                                p.player_1_id,
+                                p.player_2_id
+                           FROM t_rounds r
+                              JOIN t_pairings p
+                                ON p.round_id = r.round_id
+                          WHERE r.tourn_id = %s
+                            AND r.round_status = 'P'
+                            AND p.match_no IS NULL
+                            AND (p.player_1_id = ANY(%s)
+                                 OR p.player_2_id = ANY(%s))""",
+                      (tourn_id, player_ids, player_ids))
+    started = {}
+    for (pairing_id, round_id, id1, id2) in await cur.fetchall():
+        for player_id in (id1, id2):
+            if player_id is not None:
+                started[player_id] = (pairing_id, round_id, id1, id2)
+    return started
+
+
+async def _insertResults(cur, tourn_id, winners, losers, draw_flags):
+    """Insert the match records of a list of results with one statement,
+       returning a dict mapping each player to their match number."""
+    await cur.execute("""
+                      WITH results AS (
+                          SELECT r.winner,
+                                 r.loser,
+                                 r.draw_flag,
+                                 nextval('s_match_no') AS match_no
+                            FROM unnest(%s::INTEGER[],
+                                        %s::INTEGER[],
+                                        %s::VARCHAR[])
+                                   AS r (winner, loser, draw_flag)
+                      )
+                      INSERT INTO t_matches (tourn_id,
+                                             match_no,
+                                             player_id,
+                                             result_type)
+                      SELECT t.tourn_id,
+                             r.match_no,
+                             r.winner,
+                             CASE
+                               WHEN r.loser IS NULL THEN 'B'
+                               WHEN r.draw_flag = 'Y' THEN 'D'
+                               ELSE 'W'
+                             END AS result_type
+                        FROM t_tournaments t
+                           CROSS JOIN results r
+                       WHERE t.tourn_id = %s
+                       UNION ALL
+                      SELECT t.tourn_id,
+                             r.match_no,
+                             r.loser,
+                             CASE
+                               WHEN r.draw_flag = 'Y' THEN 'D'
+                               ELSE 'L'
+                             END AS result_type
+                        FROM t_tournaments t
+                           CROSS JOIN results r
+                       WHERE t.tourn_id = %s
+                         AND r.loser IS NOT NULL
+                      RETURNING match_no, player_id
+                      """, (winners,
+                            losers,
+                            draw_flags,
+                            tourn_id,
+                            tourn_id))
+    return {player_id: match_no
+            for (match_no, player_id) in await cur.fetchall()}
+
+
+async def _setPairingMatches(cur, pairing_ids, match_nos):
+    """Record the match number of each reported pairing."""
+    await cur.execute("""UPDATE t_pairings p
+                            SET match_no = r.match_no
+                           FROM unnest(%s::INTEGER[], %s::INTEGER[])
+                                  AS r (pairing_id, match_no)
+                          WHERE p.pairing_id = r.pairing_id""",
+                      (pairing_ids, match_nos))
+
+
+async def _completeRounds(cur, tourn_id, round_ids):
+    """Record the bye and mark complete each of the rounds whose only
+       unreported pairing, if any, is a bye."""
+    await cur.execute("""SELECT r.round_id,
+                                p.pairing_id,
+                                p.player_1_id,
+                                p.player_2_id
+                           FROM t_rounds r
+                              LEFT JOIN t_pairings p
+                                ON p.round_id = r.round_id
+                               AND p.match_no IS NULL
+                          WHERE r.round_id = ANY(%s)
+                            AND r.round_status = 'P'""", (list(round_ids),))
+    outstanding = {}
+    for (round_id, pairing_id, id1, id2) in await cur.fetchall():
+        pending = outstanding.setdefault(round_id, [])
+        if pairing_id is not None:
+            pending.append((pairing_id, id1, id2))
+    complete = [round_id for (round_id, pending) in outstanding.items()
+                if all(id2 is None for (pairing_id, id1, id2) in pending)]
+    if not complete:
+        return
+    byes = [(pairing_id, id1)
+            for round_id in complete
+            for (pairing_id, id1, id2) in outstanding[round_id]]
+    if byes:
+        match_nos = await _insertResults(
+            cur, tourn_id, [id1 for (p, id1) in byes], [None] * len(byes),
+            ['N'] * len(byes))
+        await _setPairingMatches(cur, [p for (p, id1) in byes],
+                                 [match_nos[id1] for (p, id1) in byes])
+    await cur.execute("""UPDATE t_rounds
+                            SET round_status = 'C'
+                          WHERE round_id = ANY(%s)""", (complete,))
+
+
+async def swissPairings(tourn_id, method="dutch"):
+    """Returns a list of (id1, name1, id2, name2) pairs for the next round,
+       as tournament.swissPairings does.
+
+    The stored pairings of a round started with tournament.startRound are
+    returned until every result is in. Otherwise the standings and meetings
+    are loaded and the round is paired by the pairing.METHODS entry for
+    method in the default executor, so a long search does not hold up the
+    event loop.
+    """
+    pair = pairing.getMethod(method)
+    async with getSession().cursor() as cur:
+        await cur.execute("""SELECT p.player_1_id,
+                                    p1.player_name,
+                                    p.player_2_id,
+                                    p2.player_name
+                               FROM t_rounds r
+                                  JOIN t_pairings p
+                                    ON p.round_id = r.round_id
+                                  JOIN t_players p1
+                                    ON p1.player_id = p.player_1_id
+                                  JOIN t_players p2
+                                    ON p2.player_id = p.player_2_id
+                              WHERE r.tourn_id = %s
+                                AND r.round_status = 'P'
+                              ORDER BY p.table_no
+                          """, (tourn_id,))
+        stored = await cur.fetchall()
+        if stored:
+            return [tuple(row) for row in stored]
+        await _checkActive(cur, tourn_id)
+        await cur.execute("""SELECT v.player_id,
+                                    v.player_name,
+                                    v.score,
+                                    v.byes
+                               FROM v_standings v
+                              WHERE v.tourn_id = %s
+                              ORDER BY v.score DESC,
+                                       v.opponent_match_wins DESC,
+                                       v.player_id ASC
+                          """, (tourn_id,))
+        standings = await cur.fetchall()
+        await cur.execute("""SELECT o.player_id,
+                                    o.opponent_id
+                               FROM t_opponents o
+                              WHERE o.tourn_id = %s
+                          """, (tourn_id,))
+        meetings = await cur.fetchall()
+
+    names = {}
+    players = []
+    for (player_id, player_name, score, byes) in standings:
+        names[player_id] = player_name
+        players.append((player_id, score, byes))
+    opponents = {}
+    for (player_id, opponent_id) in meetings:
+        opponents.setdefault(player_id, set()).add(opponent_id)
+
+    loop = asyncio.get_running_loop()
+    (pairs, bye) = await loop.run_in_executor(None, pair, players, opponents)
+    return [(id1, names[id1], id2, names[id2]) for (id1, id2) in pairs]
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+#
+# Test cases for tournament_async.py, mirroring tournament_test.py
+
+import asyncio
+import datetime
+import random
+import string
+
+import tournament
+from tournament_async import *
+
+
+NAMES = ["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie",
+         "Markov Chaney", "Joe Malik", "Mao Tsu-hsi", "Atlanta Hope",
+         "Bruno Walton", "Boots O'Neal", "Cathy Burton", "Diane Grant",
+         "Melpomene Murray", "Dom Sheed", "Matthew Priddis", "Josh Kennedy",
+         "Josh Hill", "Nic Natanui", "Luke Shuey", "Sharrod Well",
+         "Mark LeCras", "Andrew Gaff", "Jack Darling", "Chris Jones",
+         "Buddy Franklin", "Kurt Tippett", "Leeroy Jetta", "Adam Goodes",
+         "Kieran Jack", "Mike Tyson", "Jon Brown", "Ty Vickery"]
+
+
+async def reset(tourn_id):
+    await deleteMatches(tourn_id)
+    await deletePlayers(tourn_id)
+
+
+async def testCreateTournament():
+    """ Extra Credit: Support more than one tournament """
+    rand_string = ''.join(random.choice(string.ascii_uppercase + string.digits)
+                          for _ in range(5))
+    t = await createTournament('Tournament Test ' + rand_string,
+                               datetime.date.today())
+    if t < 0:
+        raise ValueError(
+            "create tournament should return a valid ID to use.")
+    print("0. Created a new tournament OK.")
+    return t
+
+
+async def testDeleteMatches(tourn_id):
+    await deleteMatches(tourn_id)
+    print("1. Old matches can be deleted.")
+
+
+async def testDelete(tourn_id):
+    await reset(tourn_id)
+    print("2. Player records can be deleted.")
+
+
+async def testCount(tourn_id):
+    await reset(tourn_id)
+    c = await countPlayers(tourn_id)
+    if c == '0':
+        raise TypeError(
+            "countPlayers() should return numeric zero, not string '0'.")
+    if c != 0:
+        raise ValueError("After deleting, countPlayers should return zero.")
+    print("3. After deleting, countPlayers() returns zero.")
+
+
+async def testRegister(tourn_id):
+    await reset(tourn_id)
+    await registerPlayer(tourn_id, "Chandra Nalaar")
+    if await countPlayers(tourn_id) != 1:
+        raise ValueError(
+            "After one player registers, countPlayers() should be 1.")
+    print("4. After registering a player, countPlayers() returns 1.")
+
+
+async def testRegisterCountDelete(tourn_id):
+    await reset(tourn_id)
+    for name in NAMES[4:8]:
+        await registerPlayer(tourn_id, name)
+    if await countPlayers(tourn_id) != 4:
+        raise ValueError(
+            "After registering four players, countPlayers should be 4.")
+    await deletePlayers(tourn_id)
+    if await countPlayers(tourn_id) != 0:
+        raise ValueError("After deleting, countPlayers should return zero.")
+    print("5. Players can be registered and deleted.")
+
+
+async def testStandingsBeforeMatches(tourn_id):
+    await reset(tourn_id)
+    await registerPlayer(tourn_id, "Melpomene Murray")
+    await registerPlayer(tourn_id, "Randy Schwartz")
+    standings = await playerStandings(tourn_id)
+    if len(standings) < 2:
+        raise ValueError("Players should appear in playerStandings even before"
+                         " they have played any matches.")
+    elif len(standings) > 2:
+        raise ValueError("Only registered players should appear in standings.")
+    if len(standings[0]) != 7:
+        raise ValueError("Each playerStandings row should have seven columns.")
+    [(id1, name1, wins1, losses1, draws1, matches1, oppwins1),
+     (id2, name2, wins2, losses2, draws2, matches2, oppwins2)] = standings
+    if matches1 != 0 or matches2 != 0 or wins1 != 0 or wins2 != 0:
+        raise ValueError(
+            "Newly registered players should have no matches or wins.")
+    if set([name1, name2]) != set(["Melpomene Murray", "Randy Schwartz"]):
+        raise ValueError("Registered players' names should appear in "
+                         "standings, even if they have no matches played.")
+    print("6. Newly registered players appear in the standings with no "
+          "matches.")
+
+
+async def testReportMatches(tourn_id):
+    await reset(tourn_id)
+    [id1, id2, id3, id4] = await registerPlayers(tourn_id, NAMES[8:12])
+    await reportMatch(tourn_id, id1, id2, "N")
+    await reportMatch(tourn_id, id3, id4, "N")
+    for (i, n, w, l, d, m, o) in await playerStandings(tourn_id):
+        if m != 1:
+            raise ValueError("Each player should have one match recorded.")
+        if i in (id1, id3) and w != 1:
+            raise ValueError("Each match winner should have one win recorded.")
+        elif i in (id2, id4) and w != 0:
+            raise ValueError("Each match loser should have zero wins "
+                             "recorded.")
+    print("7. After a match, players have updated standings.")
+
+
+async def testPairings(tourn_id):
+    await reset(tourn_id)
+    [id1, id2, id3, id4] = await registerPlayers(tourn_id, NAMES[:4])
+    await reportMatch(tourn_id, id1, id2, "N")
+    await reportMatch(tourn_id, id3, id4, "N")
+    pairings = await swissPairings(tourn_id)
+    if len(pairings) != 2:
+        raise ValueError(
+            "For four players, swissPairings should return two pairs.")
+    [(pid1, pname1, pid2, pname2), (pid3, pname3, pid4, pname4)] = pairings
+    correct_pairs = set([frozenset([id1, id3]), frozenset([id2, id4])])
+    actual_pairs = set([frozenset([pid1, pid2]), frozenset([pid3, pid4])])
+    if correct_pairs != actual_pairs:
+        raise ValueError(
+            "After one match, players with one win should be paired.")
+    print("8. After one match, players with one win are paired.")
+
+
+async def testPreventRematch(tourn_id):
+    """ Extra Credit: Prevent rematches between players """
+    await reset(tourn_id)
+    await registerPlayers(tourn_id, NAMES)
+    matchups = set()
+    for _ in range(5):
+        for (pid1, pname1, pid2, pname2) in await swissPairings(tourn_id):
+            await reportMatch(tourn_id, pid1, pid2, "N")
+            if frozenset([pid1, pid2]) in matchups:
+                raise ValueError("Rematch has taken place")
+            matchups.add(frozenset([pid1, pid2]))
+    print("9. Rematches prevented where possible.")
+
+
+async def testUnevenPlayers(tourn_id):
+    """ Extra Credit: Don't assume an even number of players. """
+    await reset(tourn_id)
+    await registerPlayers(tourn_id, NAMES[:5])
+    for (pid1, pname1, pid2, pname2) in await swissPairings(tourn_id):
+        await reportMatch(tourn_id, pid1, pid2, "N")
+    for (i, n, w, l, d, m, o) in await playerStandings(tourn_id):
+        if l == 0 and w == 0:
+            raise ValueError("Bye has not been correctly recorded")
+    print("10. Bye assigned to correct players when uneven registrations"
+          " exist.")
+
+
+async def testReportDrawnGame(tourn_id):
+    """ Extra Credit: Support games where a draw (tied game) is possible. """
+    await reset(tourn_id)
+    await registerPlayers(tourn_id, NAMES[:2])
+    for (pid1, pname1, pid2, pname2) in await swissPairings(tourn_id):
+        await reportMatch(tourn_id, pid1, pid2, "Y")
+    for (i, n, w, l, d, m, o) in await playerStandings(tourn_id):
+        if d != 1:
+            raise ValueError("Each player should one draw recorded.")
+    print("11. Drawn game reported OK.")
+
+
+async def testRankOMWSameNumberOfWins(tourn_id):
+    """ Extra Credit: When two players have the same number of wins, rank
+        them according to OMW (Opponent Match Wins).
+    """
+    await reset(tourn_id)
+    await registerPlayers(tourn_id, NAMES)
+    for _ in range(4):
+        await reportRound(tourn_id, [
+            (pid1, pid2, "N")
+            for (pid1, pname1, pid2, pname2) in await swissPairings(tourn_id)])
+    top = None
+    for (i, n, w, l, d, m, o) in await playerStandings(tourn_id):
+        if w == 4:
+            if top is None:
+                top = o
+            elif o > top:
+                raise ValueError("Lower ranked player with same wins"
+                                 " has higher OMW")
+    print("12. Two players, same number of wins, ranked by OMW.")
+
+
+async def testConcurrentTournaments():
+    """ Many tournaments can be served concurrently from one pool. """
+    async def runEvent(index):
+        tourn_id = await createTournament("Concurrent %d" % index,
+                                          datetime.date.today())
+        await registerPlayers(tourn_id, NAMES[:8])
+        for _ in range(3):
+            await reportRound(tourn_id, [
+                (pid1, pid2, "N")
+                for (pid1, pname1, pid2, pname2)
+                in await swissPairings(tourn_id)])
+        return await playerStandings(tourn_id)
+
+    results = await asyncio.gather(*[runEvent(i) for i in range(20)])
+    for standings in results:
+        if sum(row[5] for row in standings) != 8 * 3:
+            raise ValueError("Every concurrent tournament should record "
+                             "every match.")
+    print("13. Concurrent tournaments share the connection pool.")
+
+
+async def testPairingsMatchSync(tourn_id):
+    """ Pairings agree with tournament.swissPairings for every method, and
+        a started round's stored pairings are returned until it is done.
+    """
+    await reset(tourn_id)
+    await registerPlayers(tourn_id, NAMES[:9])
+    await reportRound(tourn_id, [
+        (pid1, pid2, "N")
+        for (pid1, pname1, pid2, pname2) in await swissPairings(tourn_id)])
+    for method in ("dutch", "weighted"):
+        if (await swissPairings(tourn_id, method) !=
+                tournament.swissPairings(tourn_id, method)):
+            raise ValueError("swissPairings should pair as tournament.py "
+                             "does with the %s method." % method)
+    started = tournament.startRound(tourn_id, "weighted")
+    stored = [(id1, name1, id2, name2)
+              for (pairing_id, id1, name1, id2, name2) in started
+              if id2 is not None]
+    if await swissPairings(tourn_id) != stored:
+        raise ValueError("swissPairings should return a started round.")
+    try:
+        await swissPairings(tourn_id, "unknown")
+    except ValueError:
+        pass
+    else:
+        raise ValueError("An unknown pairing method should be rejected.")
+    tournament.getSession().close()
+    print("14. Pairings match tournament.py and follow started rounds.")
+
+
+async def testStartedRoundReported(tourn_id):
+    """ Results reported for a started round complete it, whether they come
+        by match or by round.
+    """
+    await reset(tourn_id)
+    await registerPlayers(tourn_id, NAMES[:7])
+    tables = [(id1, id2) for (pairing_id, id1, name1, id2, name2)
+              in tournament.startRound(tourn_id) if id2 is not None]
+    (first, second) = tables[0]
+    await reportMatch(tourn_id, second, first, "N")
+    try:
+        await reportRound(tourn_id, [(tables[1][0], tables[2][0], "N")])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A result against the wrong pairing should be "
+                         "rejected.")
+    await reportRound(tourn_id, [(id1, id2, "N") for (id1, id2) in tables[1:]])
+    standings = await playerStandings(tourn_id)
+    if sum(row[5] for row in standings) != 7:
+        raise ValueError("Every result of the round should be recorded.")
+    if [(p[1], p[3]) for p in tournament.roundPairings(tourn_id)
+            if p[3] is not None] != tables:
+        raise ValueError("The results should be recorded against the "
+                         "stored pairings.")
+    if await swissPairings(tourn_id) == [
+            (id1, n1, id2, n2) for (p, id1, n1, id2, n2)
+            in tournament.roundPairings(tourn_id) if id2 is not None]:
+        raise ValueError("A completed round should not be paired again.")
+    tournament.startRound(tourn_id)
+    tournament.getSession().close()
+    print("15. Results reported for a started round complete it.")
+
+
+async def main():
+    tourn_id = await testCreateTournament()
+    await testDeleteMatches(tourn_id)
+    await testDelete(tourn_id)
+    await testCount(tourn_id)
+    await testRegister(tourn_id)
+    await testRegisterCountDelete(tourn_id)
+    await testStandingsBeforeMatches(tourn_id)
+    await testReportMatches(tourn_id)
+    await testPairings(tourn_id)
+    await testPreventRematch(tourn_id)
+    await testUnevenPlayers(tourn_id)
+    await testReportDrawnGame(tourn_id)
+    await testRankOMWSameNumberOfWins(tourn_id)
+    await testConcurrentTournaments()
+    await testPairingsMatchSync(tourn_id)
+    await testStartedRoundReported(tourn_id)
+    await getSession().close()
+    print("Success!  All tests pass!")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,567 @@
+#!/usr/bin/env python
+#
+# Benchmarks for tournament.py, run against a local database loaded with
+# tournament.sql.
+#
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import itertools
+import json
+import math
+import random
+import subprocess
+import sys
+import time
+
+import psycopg2.extensions
+
+import fixtures
+import tournament
+
+from tournament import *
+
+
+def playRounds(tourn_id, rounds):
+    """Play rounds of a tournament with random results, draws included."""
+    for _ in range(rounds):
+        results = []
+        for (pid1, pname1, pid2, pname2) in swissPairings(tourn_id):
+            if random.random() < 0.5:
+                (pid1, pid2) = (pid2, pid1)
+            results.append((pid1, pid2,
+                            "Y" if random.random() < 0.1 else "N"))
+        reportRound(tourn_id, results)
+
+
+def createEvent(name, players, rounds):
+    """Create a tournament with players registered and rounds played."""
+    tourn_id = createTournament(name, datetime.date.today())
+    registerPlayers(tourn_id, ["%s Player %d" % (name, i)
+                               for i in range(players)])
+    playRounds(tourn_id, rounds)
+    return tourn_id
+
+
+def timeCall(func, args, repeat):
+    """Returns the median time in milliseconds of repeat calls to func."""
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        func(*args)
+        timings.append((time.time() - start) * 1000.0)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def viewStandings(tourn_id):
+    """Read the standings through the full v_player_standings view stack."""
+    with getSession().cursor() as cur:
+        cur.execute("""SELECT * FROM v_player_standings WHERE tourn_id = %s""",
+                    (tourn_id,))
+        return cur.fetchall()
+
+
+# The standings view stack as it was before v_player_standings was rewritten
+# as a single pass, created as temporary views so the plans can be compared.
+LEGACY_STANDINGS_VIEWS = """
+    CREATE TEMP VIEW v_legacy_player_wins AS
+    SELECT reg.tourn_id,
+           reg.player_id,
+           SUM(COALESCE(CASE
+                          WHEN match.result_type = 'W' THEN 1
+                          ELSE 0
+                        END, 0)) AS wins
+      FROM t_registrations reg
+         LEFT OUTER JOIN t_matches match
+           ON (match.tourn_id = reg.tourn_id)
+          AND (match.player_id = reg.player_id)
+          AND (match.result_type = 'W')
+     GROUP BY reg.tourn_id,
+              reg.player_id;
+
+    CREATE TEMP VIEW v_legacy_player_losses AS
+    SELECT reg.tourn_id,
+           reg.player_id,
+           SUM(COALESCE(CASE
+                          WHEN match.result_type = 'L' THEN 1
+                          ELSE 0
+                        END, 0)) AS losses
+      FROM t_registrations reg
+         LEFT OUTER JOIN t_matches match
+           ON (match.tourn_id = reg.tourn_id)
+          AND (match.player_id = reg.player_id)
+          AND (match.result_type = 'L')
+     GROUP BY reg.tourn_id,
+              reg.player_id;
+
+    CREATE TEMP VIEW v_legacy_player_draws AS
+    SELECT reg.tourn_id,
+           reg.player_id,
+           SUM(COALESCE(CASE
+                          WHEN match.result_type = 'D' THEN 1
+                          ELSE 0
+                        END, 0)) AS draws
+      FROM t_registrations reg
+         LEFT OUTER JOIN t_matches match
+           ON (match.tourn_id = reg.tourn_id)
+          AND (match.player_id = reg.player_id)
+          AND (match.result_type = 'D')
+     GROUP BY reg.tourn_id,
+              reg.player_id;
+
+    CREATE TEMP VIEW v_legacy_rounds_played AS
+    SELECT match.tourn_id,
+           match.player_id,
+           COUNT(1) AS rounds_played
+      FROM t_matches match
+     GROUP BY match.tourn_id,
+              match.player_id;
+
+    CREATE TEMP VIEW v_legacy_player_byes AS
+    SELECT reg.tourn_id,
+           reg.player_id,
+           ((SELECT COALESCE(MAX(p.rounds_played),0)
+               FROM v_legacy_rounds_played p
+              WHERE p.tourn_id = reg.tourn_id) -
+            (SUM(COALESCE(CASE
+                            WHEN match.result_type IN ('W','L','D') THEN 1
+                            ELSE 0
+                          END, 0)))) AS byes
+      FROM t_registrations reg
+         LEFT OUTER JOIN t_matches match
+           ON (match.player_id = reg.player_id)
+          AND (match.tourn_id = reg.tourn_id)
+          AND (match.result_type IN ('W','L','D'))
+     GROUP BY reg.tourn_id, reg.player_id;
+
+    CREATE TEMP VIEW v_legacy_opponent_match_wins AS
+    SELECT reg.tourn_id,
+           reg.player_id,
+           SUM(COALESCE(CASE
+                          WHEN opp_wins.result_type = 'W' THEN 1
+                          ELSE 0
+                        END, 0)) AS opponent_match_wins
+      FROM t_registrations reg
+          LEFT OUTER JOIN t_matches matches
+            ON (matches.tourn_id = reg.tourn_id)
+           AND (matches.player_id = reg.player_id)
+          LEFT OUTER JOIN t_matches opp_match
+            ON (opp_match.tourn_id = reg.tourn_id)
+           AND (opp_match.match_no = matches.match_no)
+           AND (opp_match.player_id <> matches.player_id)
+          LEFT OUTER JOIN t_matches opp_wins
+            ON (opp_wins.tourn_id = reg.tourn_id)
+           AND (opp_wins.player_id = opp_match.player_id)
+           AND (opp_wins.player_id <> matches.player_id)
+           AND (opp_wins.result_type = 'W')
+     GROUP BY reg.tourn_id,
+              reg.player_id
+     ORDER BY reg.tourn_id,
+              reg.player_id ASC;
+
+    CREATE TEMP VIEW v_legacy_player_standings AS
+    SELECT reg.tourn_id,
+           reg.player_id,
+           p.player_name,
+           (wins.wins + byes.byes) AS wins,
+           loss.losses,
+           draw.draws,
+           byes.byes,
+           opp_wins.opponent_match_wins,
+           sum(wins.wins   * tourn.tourn_win_value  +
+               byes.byes   * tourn.tourn_bye_value  +
+               loss.losses * tourn.tourn_loss_value +
+               draw.draws  * tourn.tourn_draw_value) AS score
+      FROM t_registrations reg
+        INNER JOIN t_tournaments tourn
+           ON (reg.tourn_id = tourn.tourn_id)
+        INNER JOIN t_players p
+           ON (reg.player_id = p.player_id)
+        INNER JOIN v_legacy_player_wins wins
+           ON (wins.tourn_id = reg.tourn_id)
+          AND (wins.player_id = reg.player_id)
+        INNER JOIN v_legacy_player_losses loss
+           ON (loss.tourn_id = reg.tourn_id)
+          AND (loss.player_id = reg.player_id)
+        INNER JOIN v_legacy_player_draws draw
+           ON (draw.tourn_id = reg.tourn_id)
+          AND (draw.player_id = reg.player_id)
+        INNER JOIN v_legacy_player_byes byes
+           ON (byes.tourn_id = reg.tourn_id)
+          AND (byes.player_id = reg.player_id)
+        INNER JOIN v_legacy_opponent_match_wins opp_wins
+           ON (opp_wins.tourn_id = reg.tourn_id)
+          AND (opp_wins.player_id = reg.player_id)
+     GROUP BY reg.tourn_id,
+              reg.player_id,
+              p.player_name,
+              wins,
+              loss.losses,
+              draw.draws,
+              byes.byes,
+              opp_wins.opponent_match_wins
+     ORDER BY reg.tourn_id ASC,
+              score DESC,
+              opp_wins.opponent_match_wins DESC;
+"""
+
+
+def explainCost(cur, query, tourn_id):
+    """Returns the planner's total cost and the execution time in
+       milliseconds of query for a tournament."""
+    cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query, (tourn_id,))
+    plan = cur.fetchone()[0][0]
+    return plan["Plan"]["Total Cost"], plan["Execution Time"]
+
+
+def benchExplain(args):
+    """Compare the plans of the single pass standings view with the view
+    stack it replaced, checking both return the same standings.
+    """
+    target = createEvent("Explain Target", args.players, args.rounds)
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        cur.execute(LEGACY_STANDINGS_VIEWS)
+        queries = [
+            ("legacy", """SELECT player_id, wins, losses, draws, byes,
+                                 opponent_match_wins, score
+                            FROM v_legacy_player_standings
+                           WHERE tourn_id = %s"""),
+            ("single_pass", """SELECT player_id, wins, losses, draws, byes,
+                                      opponent_match_wins, score
+                                 FROM v_player_standings
+                                WHERE tourn_id = %s"""),
+        ]
+        results = []
+        print("%12s %14s %14s" % ("query", "plan_cost", "execution_ms"))
+        for (name, query) in queries:
+            cur.execute(query, (target,))
+            results.append(sorted(cur.fetchall()))
+            (cost, elapsed) = explainCost(cur, query, target)
+            print("%12s %14.2f %14.2f" % (name, cost, elapsed))
+        if results[0] != results[1]:
+            raise ValueError("The single pass standings differ from the "
+                             "view stack.")
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    """A connection that counts the transactions it completes."""
+
+    queries = 0
+    transactions = 0
+
+    def commit(self):
+        CountingConnection.transactions += 1
+        return super(CountingConnection, self).commit()
+
+    def rollback(self):
+        CountingConnection.transactions += 1
+        return super(CountingConnection, self).rollback()
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault("cursor_factory", CountingCursor)
+        return super(CountingConnection, self).cursor(*args, **kwargs)
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """A cursor that counts the statements it sends."""
+
+    def execute(self, query, vars=None):
+        CountingConnection.queries += 1
+        return super(CountingCursor, self).execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        CountingConnection.queries += 1
+        return super(CountingCursor, self).executemany(query, vars_list)
+
+
+def percentile(timings, fraction):
+    """Returns the value at fraction of the way through sorted timings."""
+    if not timings:
+        return None
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def summarise(timings):
+    """Returns the count, total and latency percentiles of a list of call
+       times in milliseconds."""
+    timings = sorted(timings)
+    return {"count": len(timings),
+            "total_ms": sum(timings),
+            "p50_ms": percentile(timings, 0.50),
+            "p90_ms": percentile(timings, 0.90),
+            "p99_ms": percentile(timings, 0.99),
+            "max_ms": timings[-1] if timings else None}
+
+
+def gitCommit():
+    """Returns the commit the benchmark is running against, if known."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            stderr=subprocess.STDOUT).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def simulateEvent(players, rounds, draw_rate):
+    """Run a complete Swiss event through the API one call at a time.
+
+    Returns:
+      A dict mapping each API function name to a list of its call times in
+      milliseconds.
+    """
+    timings = {}
+
+    def timed(func, *args):
+        start = time.time()
+        result = func(*args)
+        timings.setdefault(func.__name__, []).append(
+            (time.time() - start) * 1000.0)
+        return result
+
+    tourn_id = timed(createTournament, "Simulated %d" % players,
+                     datetime.date.today())
+    for i in range(players):
+        timed(registerPlayer, tourn_id, "Player %d" % i)
+    for _ in range(rounds):
+        for (pid1, pname1, pid2, pname2) in timed(swissPairings, tourn_id):
+            if random.random() < 0.5:
+                (pid1, pid2) = (pid2, pid1)
+            timed(reportMatch, tourn_id, pid1, pid2,
+                  "Y" if random.random() < draw_rate else "N")
+        timed(playerStandings, tourn_id)
+    return timings
+
+
+def benchEvents(args):
+    """Simulate complete events of each size and report call latencies,
+    wall time, statements and round trips as one JSON object per event.
+
+    Round trips count every statement plus the BEGIN and COMMIT psycopg2
+    sends for each transaction.
+    """
+    setSession(TournamentSession(getSession().dsn,
+                                 connection_factory=CountingConnection))
+    commit = gitCommit()
+    output = open(args.output, "a") if args.output else sys.stdout
+    try:
+        for players in args.players:
+            if args.odd and players % 2 == 0:
+                players += 1
+            rounds = args.rounds or int(math.ceil(math.log(players, 2)))
+            CountingConnection.queries = 0
+            CountingConnection.transactions = 0
+            start = time.time()
+            timings = simulateEvent(players, rounds, args.draw_rate)
+            wall = time.time() - start
+            result = {
+                "benchmark": "events",
+                "commit": commit,
+                "seed": args.seed,
+                "players": players,
+                "rounds": rounds,
+                "wall_s": wall,
+                "queries": CountingConnection.queries,
+                "transactions": CountingConnection.transactions,
+                "round_trips": (CountingConnection.queries +
+                                2 * CountingConnection.transactions),
+                "calls": dict((name, summarise(t))
+                              for (name, t) in timings.items()),
+            }
+            output.write(json.dumps(result, sort_keys=True) + "\n")
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+def benchHistory(args):
+    """Standings latency for one event as unrelated history is added.
+
+    The latency of both the maintained standings and the view stack should
+    stay flat as the number of other tournaments in the database grows.
+    """
+    target = createEvent("History Target", args.players, args.rounds)
+    history = 0
+    print("%10s %10s %14s %14s" % ("history", "matches", "standings_ms",
+                                   "views_ms"))
+    for step in args.history:
+        while history < step:
+            createEvent("History %d" % history, args.players, args.rounds)
+            history += 1
+        with getSession().cursor() as cur:
+            cur.execute("SELECT COUNT(1) FROM t_matches")
+            matches = cur.fetchone()[0]
+        print("%10d %10d %14.2f %14.2f" % (
+            history, matches,
+            timeCall(playerStandings, (target,), args.repeat),
+            timeCall(viewStandings, (target,), args.repeat)))
+
+
+def explainTimes(cur, query, params, repeat):
+    """Returns the median planning and execution times in milliseconds of
+       repeat runs of a statement under EXPLAIN ANALYZE."""
+    planning = []
+    execution = []
+    for _ in range(repeat):
+        cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query, params)
+        plan = cur.fetchone()[0][0]
+        planning.append(plan["Planning Time"])
+        execution.append(plan["Execution Time"])
+    return (sorted(planning)[len(planning) // 2],
+            sorted(execution)[len(execution) // 2])
+
+
+def benchPrepared(args):
+    """Compare the hot statements sent as text in a transaction, as the API
+    used to, with the prepared statements and f_report_match it uses now.
+
+    Each path reports its median call time and round trips per call, and
+    each statement its median planning time under EXPLAIN ANALYZE once the
+    prepared statement has settled on a plan. Planning time does not include
+    parsing and rewriting the views, which a prepared statement also skips.
+    """
+    # A single connection, so each statement is prepared once.
+    setSession(TournamentSession(getSession().dsn, 1, 1,
+                                 connection_factory=CountingConnection))
+    target = createEvent("Prepared Target", args.players, args.rounds)
+    players = [row[0] for row in playerStandings(target)]
+    results = itertools.cycle([(players[i], players[i + 1], "N")
+                               for i in range(0, len(players) - 1, 2)])
+
+    def text(name):
+        query = tournament._PREPARED[name][1].replace("$1", "%s")
+
+        def call():
+            with getSession().cursor() as cur:
+                cur.execute(query, (target,))
+                return cur.fetchall()
+        return call
+
+    def prepared(name):
+        def call():
+            with getSession().statement() as cur:
+                tournament._executePrepared(cur, name, (target,))
+                return cur.fetchall()
+        return call
+
+    def measure(call):
+        CountingConnection.queries = 0
+        CountingConnection.transactions = 0
+        timings = []
+        for _ in range(args.repeat):
+            start = time.time()
+            call()
+            timings.append((time.time() - start) * 1000.0)
+        return (percentile(sorted(timings), 0.5),
+                float(CountingConnection.queries +
+                      2 * CountingConnection.transactions) / args.repeat)
+
+    names = ["ps_count_players", "ps_standings", "ps_pairing_input",
+             "ps_opponents"]
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        print("%-18s %9s %10s %12s %12s" % ("statement", "path", "median_ms",
+                                            "round_trips", "planning_ms"))
+        for name in names:
+            if text(name)() != prepared(name)():
+                raise ValueError("%s returns different rows when prepared."
+                                 % (name,))
+            (types, query) = tournament._PREPARED[name]
+            cur.execute("PREPARE %s (%s) AS %s" % (name, types, query))
+            plans = (explainTimes(cur, query.replace("$1", "%s"), (target,),
+                                  args.repeat),
+                     explainTimes(cur, "EXECUTE %s (%%s)" % (name,),
+                                  (target,), args.repeat))
+            for (path, call, plan) in (("text", text(name), plans[0]),
+                                       ("prepared", prepared(name),
+                                        plans[1])):
+                (median, round_trips) = measure(call)
+                print("%-18s %9s %10.2f %12.1f %12.3f" % (
+                    name, path, median, round_trips, plan[0]))
+        for (path, call) in (
+                ("text", lambda: reportRound(target, [next(results)])),
+                ("function", lambda: reportMatch(target, *next(results)))):
+            (median, round_trips) = measure(call)
+            print("%-18s %9s %10.2f %12.1f %12s" % (
+                "reportMatch", path, median, round_trips, "-"))
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for the tournament API.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache", action="store_true",
+                        help="serve repeated reads from the standings cache")
+    parser.add_argument("--clone", action="store_true",
+                        help="run against a fresh copy of a template "
+                             "database, dropped afterwards")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    history = subparsers.add_parser(
+        "history", help="standings latency as unrelated history grows")
+    history.add_argument("--players", type=int, default=64)
+    history.add_argument("--rounds", type=int, default=6)
+    history.add_argument("--repeat", type=int, default=20)
+    history.add_argument("--history", type=int, nargs="+",
+                         default=[0, 10, 50, 100])
+    history.set_defaults(func=benchHistory)
+
+    explain = subparsers.add_parser(
+        "explain", help="plan cost of the standings views")
+    explain.add_argument("--players", type=int, default=512)
+    explain.add_argument("--rounds", type=int, default=9)
+    explain.set_defaults(func=benchExplain)
+
+    events = subparsers.add_parser(
+        "events", help="simulate complete events through the API")
+    events.add_argument("--players", type=int, nargs="+",
+                        default=[64, 512, 4096])
+    events.add_argument("--rounds", type=int, default=0,
+                        help="rounds per event, log2(players) by default")
+    events.add_argument("--odd", action="store_true",
+                        help="register an odd number of players")
+    events.add_argument("--draw-rate", type=float, default=0.1)
+    events.add_argument("--output",
+                        help="append the JSON results to this file")
+    events.set_defaults(func=benchEvents)
+
+    prepared = subparsers.add_parser(
+        "prepared", help="prepared statements against statements sent as text")
+    prepared.add_argument("--players", type=int, default=512)
+    prepared.add_argument("--rounds", type=int, default=9)
+    prepared.add_argument("--repeat", type=int, default=50)
+    prepared.set_defaults(func=benchPrepared)
+
+    args = parser.parse_args()
+    random.seed(args.seed)
+    if args.cache:
+        configureCache(256)
+    if not args.clone:
+        args.func(args)
+        return
+    fixtures.createTemplate()
+    configure(fixtures.cloneDatabase("tournament_bench"))
+    try:
+        args.func(args)
+    finally:
+        getSession().close()
+        fixtures.dropDatabase("tournament_bench")
+        fixtures.dropDatabase(fixtures.TEMPLATE)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+-- Partition and archive functions shared by tournament.sql and
+-- migrate_partitions.sql, which both include this file with \ir. Every
+-- statement can be run again over a database that already has them.
+
+
+--    Function   : f_create_tourn_partitions
+--    Description: Creates the t_matches and t_registrations partitions of a
+--                 tournament. Each partition is created as a plain table
+--                 with a CHECK constraint matching its bound and then
+--                 attached, which does not block queries on the other
+--                 tournaments the way CREATE TABLE ... PARTITION OF would.
+--                 The indexes, keys and triggers of the parent are added
+--                 to the partition as it is attached.
+CREATE OR REPLACE FUNCTION f_create_tourn_partitions(p_tourn_id INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    v_table TEXT;
+BEGIN
+    FOREACH v_table IN ARRAY ARRAY['t_matches', 't_registrations'] LOOP
+        IF to_regclass(format('%s_%s', v_table, p_tourn_id)) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS, '
+                           'CHECK (tourn_id = %s))',
+                           v_table || '_' || p_tourn_id, v_table, p_tourn_id);
+            EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I '
+                           'FOR VALUES IN (%s)',
+                           v_table, v_table || '_' || p_tourn_id, p_tourn_id);
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+
+--    Function   : f_tournaments_partitions
+--    Description: Creates the partitions of each new tournament, so the
+--                 API never has to.
+CREATE OR REPLACE FUNCTION f_tournaments_partitions()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM f_create_tourn_partitions(NEW.tourn_id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tr_tournaments_partitions ON t_tournaments;
+CREATE TRIGGER tr_tournaments_partitions
+AFTER INSERT ON t_tournaments
+FOR EACH ROW EXECUTE PROCEDURE f_tournaments_partitions();
+
+
+--    Function   : f_archive_tournament
+--    Description: Detaches a finished tournament's t_matches and
+--                 t_registrations partitions, moving them to the
+--                 tournament_archive schema, or dropping them when p_drop
+--                 is true. No rows are deleted, so none of the match
+--                 triggers fire and the tournament's t_standings rows are
+--                 kept as its final standings. Its t_opponents rows are
+--                 only needed for pairing and are removed. Detaching takes
+--                 a brief exclusive lock on the parent table.
+CREATE SCHEMA IF NOT EXISTS tournament_archive;
+
+CREATE OR REPLACE FUNCTION f_archive_tournament(p_tourn_id INTEGER,
+                                                p_drop BOOLEAN DEFAULT FALSE)
+RETURNS VOID AS $$
+DECLARE
+    v_table TEXT;
+BEGIN
+    FOREACH v_table IN ARRAY ARRAY['t_matches', 't_registrations'] LOOP
+        IF to_regclass(format('%s_%s', v_table, p_tourn_id)) IS NOT NULL THEN
+            EXECUTE format('ALTER TABLE %I DETACH PARTITION %I',
+                           v_table, v_table || '_' || p_tourn_id);
+            IF p_drop THEN
+                EXECUTE format('DROP TABLE %I', v_table || '_' || p_tourn_id);
+            ELSE
+                EXECUTE format('ALTER TABLE %I SET SCHEMA tournament_archive',
+                               v_table || '_' || p_tourn_id);
+            END IF;
+        END IF;
+    END LOOP;
+    DELETE FROM t_opponents WHERE tourn_id = p_tourn_id;
+    UPDATE t_tournaments
+       SET tourn_archived = TRUE
+     WHERE tourn_id = p_tourn_id;
+END;
+$$ LANGUAGE plpgsql;
@@ -3,9 +3,21 @@
 # Test cases for tournament.py
 
 from tournament import *
+import argparse
+import csv
+import fixtures
+import multiprocessing
 import random
+import sys
 import string
+import tempfile
 import datetime
+import threading
+import psycopg2
+import time
+import live
+import pairing
+import tiebreaks
 
 
 def testCreateTournament():
@@ -365,18 +377,656 @@ def testRankOMWSameNumberOfWins(tourn_id):
     print "12. Two players, same number of wins, ranked by OMW."
 
 
+def testSharedSession(tourn_id):
+    """ Connections are borrowed from one pool shared by every API call. """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    session = getSession()
+    if getSession() is not session:
+        raise ValueError("The API should share a single session.")
+    threads = [threading.Thread(target=countPlayers, args=(tourn_id,))
+               for _ in range(session.maxconn * 2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if countPlayers(tourn_id) != 0:
+        raise ValueError("Pooled connections should see committed data.")
+    print "13. API calls share a pooled session across threads."
+
+
+def testRegisterRoster(tourn_id):
+    """ A whole roster can be registered in one call. """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    names = ["Player %d" % i for i in range(200)]
+    ids = registerPlayers(tourn_id, names)
+    if len(ids) != len(names) or len(set(ids)) != len(names):
+        raise ValueError("registerPlayers should return one id per player.")
+    if countPlayers(tourn_id) != len(names):
+        raise ValueError("Every player in the roster should be registered.")
+    registered = dict((row[0], row[1]) for row in playerStandings(tourn_id))
+    for (player_id, name) in zip(ids, names):
+        if registered.get(player_id) != name:
+            raise ValueError("registerPlayers should return ids in the same"
+                             " order as the names given.")
+    print "14. A roster of players can be registered in one transaction."
+
+
+def testReportRound(tourn_id):
+    """ A whole round, including a draw and a bye, reported in one call. """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    [id1, id2, id3, id4, id5] = registerPlayers(
+        tourn_id, ["Twilight Sparkle", "Fluttershy", "Applejack",
+                   "Pinkie Pie", "Rarity"])
+    reportRound(tourn_id, [(id1, id2, "N"), (id3, id4, "Y"), (id5, None, "N")])
+    standings = dict((row[0], row) for row in playerStandings(tourn_id))
+    (i, n, w, l, d, m, o) = standings[id1]
+    if (w, l, d) != (1, 0, 0):
+        raise ValueError("The winner should have one win recorded.")
+    (i, n, w, l, d, m, o) = standings[id2]
+    if (w, l, d) != (0, 1, 0):
+        raise ValueError("The loser should have one loss recorded.")
+    for player_id in (id3, id4):
+        (i, n, w, l, d, m, o) = standings[player_id]
+        if (w, l, d) != (0, 0, 1):
+            raise ValueError("Both players should have a draw recorded.")
+    (i, n, w, l, d, m, o) = standings[id5]
+    if (w, l, d) != (1, 0, 0):
+        raise ValueError("A bye should be recorded as a win.")
+    print "15. A whole round can be reported in one transaction."
+
+
+def testStandingsMaintained(tourn_id):
+    """ The maintained standings agree with a full recalculation. """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    ids = registerPlayers(tourn_id, ["Player %d" % i for i in range(9)])
+    for _ in range(3):
+        for (pid1, pname1, pid2, pname2) in swissPairings(tourn_id):
+            reportMatch(tourn_id, pid1, pid2,
+                        random.choice(["N", "N", "Y"]))
+    if checkStandings(tourn_id):
+        raise ValueError("Maintained standings should match the views.")
+    if playerStandings(tourn_id) != playerStandings(tourn_id, True):
+        raise ValueError("Recalculated standings should match the "
+                         "maintained standings.")
+    deleteMatches(tourn_id)
+    for (i, n, w, l, d, m, o) in playerStandings(tourn_id):
+        if m != 0 or o != 0:
+            raise ValueError("Deleting matches should reset the standings.")
+    if rebuildStandings(tourn_id):
+        raise ValueError("Standings should not need rebuilding.")
+    print "16. Standings are maintained as matches are reported."
+
+
+def testPairingsEveryPlayerOnce(tourn_id):
+    """ Every player is paired exactly once each round, with no rematches,
+        and an odd player out receives the bye.
+    """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    ids = registerPlayers(tourn_id, ["Player %d" % i for i in range(11)])
+    matchups = set()
+    byes = set()
+    for _ in range(5):
+        pairings = swissPairings(tourn_id)
+        paired = set()
+        for (pid1, pname1, pid2, pname2) in pairings:
+            if pid1 in paired or pid2 in paired:
+                raise ValueError("A player has been paired twice.")
+            paired.update([pid1, pid2])
+            if frozenset([pid1, pid2]) in matchups:
+                raise ValueError("Rematch has taken place")
+            matchups.add(frozenset([pid1, pid2]))
+        bye = set(ids) - paired
+        if len(bye) != 1 or bye & byes:
+            raise ValueError("One new player should receive the bye.")
+        byes.update(bye)
+        reportRound(tourn_id, [(pid1, pid2, random.choice(["N", "Y"]))
+                               for (pid1, pname1, pid2, pname2) in pairings] +
+                    [(bye.pop(), None, "N")])
+    print "17. Every player is paired once per round without rematches."
+
+
+def testTiebreaks(tourn_id):
+    """ Players on the same score are ranked by the requested tiebreaks. """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    registerPlayers(tourn_id, ["Player %d" % i for i in range(8)])
+    for _ in range(3):
+        reportRound(tourn_id, [(pid1, pid2, "N") for (pid1, pname1, pid2,
+                                                      pname2)
+                               in swissPairings(tourn_id)])
+    standings = playerStandings(tourn_id, tiebreaks=["buchholz", "omw"])
+    if len(standings[0]) != 8 or len(standings[0][7]) != 2:
+        raise ValueError("Each row should end with its tiebreak values.")
+    previous = None
+    for (i, n, w, l, d, m, o, values) in standings:
+        if previous is not None and previous[0] == w and previous[1] < values:
+            raise ValueError("Players on the same score should be ranked by"
+                             " their tiebreaks.")
+        previous = (w, values)
+    setTiebreaks(tourn_id, ["sonneborn_berger"])
+    if len(playerStandings(tourn_id, tiebreaks=True)[0][7]) != 1:
+        raise ValueError("The configured tiebreaks should be used.")
+    matches = [(1, 1, "W"), (2, 1, "L"), (3, 2, "W"), (4, 2, "L"),
+               (1, 3, "W"), (3, 3, "L"), (2, 4, "D"), (4, 4, "D")]
+    early = tiebreaks.computeTiebreaks([1, 2, 3, 4], matches, (1, 0, 0.5, 1),
+                                       ["median_buchholz", "buchholz"])
+    if any(m != b for (m, b) in early.values()) or early[1] == early[2]:
+        raise ValueError("Median Buchholz should fall back to Buchholz "
+                         "with too few opponents to trim.")
+    later = tiebreaks.computeTiebreaks(
+        [1, 2, 3, 4], matches + [(1, 5, "W"), (4, 5, "L")], (1, 0, 0.5, 1),
+        ["median_buchholz", "buchholz"])
+    if later[1] != (1.5, 4.0):
+        raise ValueError("Median Buchholz should trim the highest and "
+                         "lowest opponents.")
+    print "18. Players on the same score are ranked by tiebreaks."
+
+
+def testStandingsCache(tourn_id):
+    """ Repeated reads are served from the cache until a result is written.
+    """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    [id1, id2] = registerPlayers(tourn_id, ["Twilight Sparkle", "Fluttershy"])
+    if getCache().maxsize != 0:
+        raise ValueError("The cache should be off until it is configured.")
+    cache = configureCache(256)
+    try:
+        playerStandings(tourn_id)
+        hits = cache.stats()["hits"]
+        playerStandings(tourn_id)
+        if cache.stats()["hits"] != hits + 1:
+            raise ValueError("Repeated standings should be read from the "
+                             "cache.")
+        reportMatch(tourn_id, id1, id2, "N")
+        standings = playerStandings(tourn_id)
+        if standings[0][0] != id1 or standings[0][2] != 1:
+            raise ValueError("Reporting a match should invalidate the cache.")
+    finally:
+        configureCache(0)
+    print "19. Standings are cached until a match is reported."
+
+
+def testInstrumentation(tourn_id):
+    """ API calls report their timings to the instrumentation sinks. """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    records = []
+    instrument([records.append], slow_ms=0)
+    try:
+        registerPlayer(tourn_id, "Twilight Sparkle")
+        countPlayers(tourn_id)
+    finally:
+        instrument(None)
+    if [r["function"] for r in records] != ["registerPlayer", "countPlayers"]:
+        raise ValueError("Each API call should produce one record.")
+    count = records[1]
+    if count["rows"] != 1 or len(count["statements"]) != 1:
+        raise ValueError("The record should count statements and rows.")
+    if "Aggregate" not in count["statements"][0]["explain"]:
+        raise ValueError("Slow statements should have their plan captured.")
+    if countPlayers(tourn_id) != 1:
+        raise ValueError("Capturing a plan should not repeat any writes.")
+    print "20. API calls are instrumented when requested."
+
+
+def testPairAllTournaments():
+    """ Many flights can be paired at once, each as swissPairings would. """
+    flights = []
+    for i in range(4):
+        flight = createTournament("Flight %d" % i, datetime.date.today())
+        registerPlayers(flight, ["Flight %d Player %d" % (i, p)
+                                 for p in range(6 + i)])
+        flights.append(flight)
+    results = pairAllTournaments(flights + [-1], processes=2)
+    for flight in flights:
+        if sorted(results[flight]) != sorted(swissPairings(flight)):
+            raise ValueError("Each flight should be paired as swissPairings"
+                             " would pair it.")
+    if results[-1] != []:
+        raise ValueError("An unknown flight should have no pairings.")
+    print "21. Many tournaments can be paired at once."
+
+
+def testTournamentState(tourn_id):
+    """ The compact state holds the same standings and opponents. """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    registerPlayers(tourn_id, ["Player %d" % i for i in range(7)])
+    for _ in range(3):
+        reportRound(tourn_id, [(pid1, pid2, "N") for (pid1, pname1, pid2,
+                                                      pname2)
+                               in swissPairings(tourn_id)])
+    snapshot = loadTournamentState(tourn_id)
+    if snapshot.standings() != playerStandings(tourn_id):
+        raise ValueError("The state should hold the same standings.")
+    for record in snapshot:
+        for opponent in record.opponents:
+            if not snapshot.haveMet(opponent, record.player_id):
+                raise ValueError("Opponent history should be symmetric.")
+    if sum(len(p) for (s, p) in snapshot.scoreGroups()) != len(snapshot):
+        raise ValueError("Every player should be in one score group.")
+    print "22. Tournament state can be loaded into compact columns."
+
+
+def testStreamingExport(tourn_id):
+    """ Standings can be streamed and exported without loading every row. """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    registerPlayers(tourn_id, ["Player %d" % i for i in range(25)])
+    reportRound(tourn_id, [(pid1, pid2, "N") for (pid1, pname1, pid2, pname2)
+                           in swissPairings(tourn_id)])
+    if list(iterStandings(tourn_id, batch_size=4)) != playerStandings(
+            tourn_id):
+        raise ValueError("Streamed standings should match playerStandings.")
+    for (format, lines) in (("csv", 26), ("jsonl", 25)):
+        output = tempfile.TemporaryFile(mode="w+")
+        exportStandings(tourn_id, output, format)
+        output.seek(0)
+        if len(output.readlines()) != lines:
+            raise ValueError("Every player should be exported.")
+        output.close()
+    for stage in ("computed", "started"):
+        expected = swissPairings(tourn_id)
+        output = tempfile.TemporaryFile(mode="w+")
+        exportPairings(tourn_id, output)
+        output.seek(0)
+        rows = list(csv.reader(output))[1:]
+        output.close()
+        if [(int(a), b, int(c), d) for (a, b, c, d) in rows] != expected:
+            raise ValueError("The %s pairings should be exported as "
+                             "swissPairings returns them." % stage)
+        startRound(tourn_id)
+    print "23. Standings can be streamed and exported."
+
+
+def testRoundLifecycle(tourn_id):
+    """ A started round keeps its pairings until every result is in. """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    registerPlayers(tourn_id, ["Player %d" % i for i in range(5)])
+    pairings = startRound(tourn_id)
+    if startRound(tourn_id) != pairings or roundPairings(tourn_id) != pairings:
+        raise ValueError("Reading a started round should return the same "
+                         "pairings.")
+    byes = [p for p in pairings if p[3] is None]
+    if len(pairings) != 3 or len(byes) != 1:
+        raise ValueError("Five players should be paired at two tables and a "
+                         "bye.")
+    tables = [p for p in pairings if p[3] is not None]
+    reportPairing(tables[0][0], tables[0][1], "N")
+    try:
+        reportPairing(tables[0][0], tables[0][1], "N")
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A pairing should only be reported once.")
+    reportPairings([(tables[1][0], tables[1][3], "Y")])
+    for (i, n, w, l, d, m, o) in playerStandings(tourn_id):
+        if m != 1:
+            raise ValueError("Every player should have one match recorded, "
+                             "including the bye.")
+    if startRound(tourn_id) == pairings:
+        raise ValueError("A complete round should let the next one start.")
+    if roundPairings(tourn_id, 1) != pairings:
+        raise ValueError("Earlier rounds should still be readable.")
+    print "24. Rounds are started, stored and reported by pairing."
+
+
+def testArchiveTournament():
+    """ A finished tournament's partitions can be detached and dropped. """
+    tourn_id = createTournament("Archive Test", datetime.date.today())
+    registerPlayers(tourn_id, ["Player %d" % i for i in range(6)])
+    reportRound(tourn_id, [(pid1, pid2, "N") for (pid1, pname1, pid2, pname2)
+                           in swissPairings(tourn_id)])
+    (id1, id2) = (standings[0][0], standings[1][0])
+    archiveTournament(tourn_id, drop=True)
+    if playerStandings(tourn_id) != standings:
+        raise ValueError("An archived tournament should keep its final "
+                         "standings.")
+    for (call, args) in [(registerPlayer, ("Late Entry",)),
+                         (reportMatch, (id1, id2, "N")),
+                         (reportRound, ([(id1, id2, "N")],)),
+                         (swissPairings, ()),
+                         (startRound, ()),
+                         (deleteMatches, ()),
+                         (resetTournament, ())]:
+        try:
+            call(tourn_id, *args)
+        except ValueError:
+            pass
+        else:
+            raise ValueError("%s should refuse an archived tournament."
+                             % call.__name__)
+    if not isinstance(pairAllTournaments([tourn_id], processes=0)[tourn_id],
+                      ValueError):
+        raise ValueError("An archived tournament should not be paired.")
+    if playerStandings(tourn_id) != standings:
+        raise ValueError("Refused calls should leave the standings alone.")
+    print "25. Finished tournaments can be archived."
+
+
+def testWeightedPairings(tourn_id):
+    """ Weighted pairing pairs every player once and explains its costs. """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    ids = registerPlayers(tourn_id, ["Player %d" % i for i in range(11)])
+    for _ in range(4):
+        pairings = swissPairings(tourn_id, method="weighted")
+        paired = [p for (id1, n1, id2, n2) in pairings for p in (id1, id2)]
+        if len(paired) != 10 or len(set(paired)) != 10:
+            raise ValueError("Every player but the bye should be paired once.")
+        audit = auditPairings(tourn_id)
+        if [(a[0], a[2]) for a in audit[:-1]] != [(p[0], p[2])
+                                                 for p in pairings]:
+            raise ValueError("The audit should cost the same pairings.")
+        if audit[-1][2] is not None or audit[-1][0] in paired:
+            raise ValueError("The audit should end with the bye.")
+        if any(a[4]["rematch"] for a in audit):
+            raise ValueError("No rematch should be needed in four rounds.")
+        reportRound(tourn_id, [(id1, id2, "N")
+                               for (id1, n1, id2, n2) in pairings])
+    try:
+        swissPairings(tourn_id, method="unknown")
+    except ValueError:
+        pass
+    else:
+        raise ValueError("An unknown pairing method should be rejected.")
+    field = [(i, 10 - i, 0) for i in range(11)]
+    for block_size in (2, 3):
+        (pairs, bye) = pairing.weightedPairPlayers(field, {},
+                                                   block_size=block_size)
+        paired = [p for pair in pairs for p in pair] + [bye]
+        if sorted(paired) != range(11):
+            raise ValueError("Small blocks should still pair every player.")
+    try:
+        pairing.weightedPairPlayers(field, {}, block_size=1)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A block of one player should be rejected.")
+    print "26. Weighted pairing pairs every player with audited costs."
+
+
+def testLiveStandings(tourn_id):
+    """ A subscriber's copy of the standings follows every write. """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    registerPlayers(tourn_id, ["Player %d" % i for i in range(9)])
+    changed = []
+    subscriber = live.StandingsSubscriber(
+        [tourn_id], callback=lambda t, s: changed.append(t)).open()
+    try:
+        for _ in range(3):
+            reportRound(tourn_id, [(id1, id2, "N") for (id1, n1, id2, n2)
+                                   in swissPairings(tourn_id)])
+        registerPlayer(tourn_id, "Late Entry")
+        deadline = time.time() + 5
+        while (subscriber.standings(tourn_id) != playerStandings(tourn_id)
+               and time.time() < deadline):
+            subscriber.poll(0.5)
+        if subscriber.standings(tourn_id) != playerStandings(tourn_id):
+            raise ValueError("The subscriber should follow reported matches "
+                             "and registrations.")
+        deleteMatches(tourn_id)
+        deadline = time.time() + 5
+        while (subscriber.standings(tourn_id) != playerStandings(tourn_id)
+               and time.time() < deadline):
+            subscriber.poll(0.5)
+        if subscriber.standings(tourn_id) != playerStandings(tourn_id):
+            raise ValueError("The subscriber should follow deleted matches.")
+        if not changed or subscriber.queries > 1 + len(changed):
+            raise ValueError("Each change should cost one query.")
+    finally:
+        subscriber.close()
+    print "27. Live standings follow notifications."
+
+
+def testSimulateTournament(tourn_id):
+    """ A simulation plays rounds in memory without touching the tables. """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    registerPlayers(tourn_id, ["Player %d" % i for i in range(33)])
+    reportRound(tourn_id, [(id1, id2, "N") for (id1, n1, id2, n2)
+                           in swissPairings(tourn_id)])
+    standings = playerStandings(tourn_id)
+    result = simulateTournament(tourn_id, rounds=6, trials=60, draw_rate=0.1,
+                                seed=1)
+    if playerStandings(tourn_id) != standings:
+        raise ValueError("A simulation should not write to the database.")
+    if result.trials != 60 or sum(result.winners.values()) != 60:
+        raise ValueError("Every trial should be played and have a winner.")
+    if any(byes != 6 for byes in result.outcomes["byes"]):
+        raise ValueError("33 players should need a bye every round.")
+    if any(d is not None and not 2 <= d <= 7
+           for d in result.outcomes["decided"]):
+        raise ValueError("A lead should be decided in a simulated round.")
+    if abs(sum(f for (v, f) in result.distribution("leaders")) - 1) > 1e-9:
+        raise ValueError("The distribution should cover every trial.")
+    again = simulateTournament(tourn_id, rounds=6, trials=60, draw_rate=0.1,
+                               seed=1, processes=0)
+    if again.outcomes != result.outcomes or again.winners != result.winners:
+        raise ValueError("A seeded simulation should repeat in any number "
+                         "of processes.")
+    print "28. Tournaments can be simulated over a snapshot."
+
+
+def testPreparedStatements(tourn_id):
+    """ The hot paths give the same results through prepared statements. """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    [id1, id2, id3] = registerPlayers(tourn_id, ["Applejack", "Rarity",
+                                                 "Spike"])
+    for _ in range(3):
+        if countPlayers(tourn_id) != 3:
+            raise ValueError("A prepared count should be reused.")
+    match_no = reportMatch(tourn_id, id1, id2, "N")
+    if reportMatch(tourn_id, id3, None, "N") == match_no:
+        raise ValueError("Each result should have a match number of its "
+                         "own.")
+    try:
+        reportMatch(tourn_id, id1, id1, "N")
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A player should not be reported against "
+                         "themselves.")
+    standings = playerStandings(tourn_id)
+    if standings != playerStandings(tourn_id, recalculate=True):
+        raise ValueError("Both prepared standings should agree.")
+    if [(r[0], r[2], r[3]) for r in standings] != [(id1, 1, 0), (id3, 1, 0),
+                                                   (id2, 0, 1)]:
+        raise ValueError("f_report_match should record both players and "
+                         "byes.")
+    print "29. Hot paths run as prepared statements and functions."
+
+
+def testStartedRoundReportedByMatch(tourn_id):
+    """ A started round completes when its results are reported by match. """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    registerPlayers(tourn_id, ["Player %d" % i for i in range(7)])
+    pairings = startRound(tourn_id)
+    tables = [p for p in pairings if p[3] is not None]
+    stored = [(id1, n1, id2, n2) for (p, id1, n1, id2, n2) in tables]
+    if pairAllTournaments([tourn_id], processes=0)[tourn_id] != stored:
+        raise ValueError("A started round should not be paired again.")
+    try:
+        reportMatch(tourn_id, tables[0][1], tables[1][1], "N")
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A result across started pairings should be "
+                         "refused.")
+    reportMatch(tourn_id, tables[0][3], tables[0][1], "N")
+    reportRound(tourn_id, [(id1, id2, "Y") for (p, id1, n1, id2, n2)
+                           in tables[1:]])
+    for (i, n, w, l, d, m, o) in playerStandings(tourn_id):
+        if m != 1:
+            raise ValueError("The round should be complete, bye included.")
+    if swissPairings(tourn_id) == stored:
+        raise ValueError("A complete round should let the next one pair.")
+    print "30. Started rounds complete when reported by match."
+
+
+def testLongEventPairing():
+    """ Late rounds of a long event pair quickly without rematches. """
+    rng = random.Random(3)
+    scores = dict((p, 0) for p in range(32))
+    opponents = dict((p, set()) for p in range(32))
+    for _ in range(24):
+        players = sorted(((p, scores[p], 0) for p in scores),
+                         key=lambda p: (-p[1], p[0]))
+        start = time.time()
+        (pairs, bye) = pairing.pairPlayers(players, opponents)
+        if time.time() - start > 2:
+            raise ValueError("The pairing search should stay within its "
+                             "budget.")
+        for (id1, id2) in pairs:
+            if id2 in opponents[id1]:
+                raise ValueError("A rematch should not be made while one "
+                                 "can be avoided.")
+            opponents[id1].add(id2)
+            opponents[id2].add(id1)
+            scores[rng.choice((id1, id2))] += 1
+    print "31. Long events are paired within the search budget."
+
+
+def testConcurrentReports(tourn_id):
+    """ Matches reported at once between players who share opponents are
+        all counted, without deadlocking.
+    """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    ids = registerPlayers(tourn_id, ["Player %d" % i for i in range(16)])
+    for _ in range(2):
+        reportRound(tourn_id, [(id1, id2, "N") for (id1, n1, id2, n2)
+                               in swissPairings(tourn_id)])
+    errors = []
+
+    def report(seed):
+        rng = random.Random(seed)
+        try:
+            for _ in range(20):
+                (winner, loser) = rng.sample(ids, 2)
+                reportMatch(tourn_id, winner, loser, "N")
+        except psycopg2.Error as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=report, args=(i,))
+               for i in range(min(getSession().maxconn, 8))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise ValueError("Concurrent reports should not fail: %s"
+                         % errors[0])
+    if checkStandings(tourn_id):
+        raise ValueError("Concurrent reports should all be counted.")
+    print "32. Concurrent reports lock the standings in a fixed order."
+
+
+def testPreparedAfterReset(tourn_id):
+    """ Prepared statements survive the pool being reset and the server
+        deallocating them.
+    """
+    deleteMatches(tourn_id)
+    deletePlayers(tourn_id)
+    registerPlayers(tourn_id, ["Applejack", "Rarity", "Spike"])
+    previous = getSession()
+    session = setSession(TournamentSession(previous.dsn, 1, 1), close=False)
+    try:
+        for _ in range(3):
+            if countPlayers(tourn_id) != 3:
+                raise ValueError("A prepared count should be reused.")
+            session.close()
+        countPlayers(tourn_id)
+        with session.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DEALLOCATE ALL")
+        if countPlayers(tourn_id) != 3:
+            raise ValueError("A deallocated statement should be prepared "
+                             "again.")
+        if len(playerStandings(tourn_id)) != 3:
+            raise ValueError("Every statement should be prepared again.")
+    finally:
+        setSession(previous)
+    print "33. Prepared statements survive a pool reset and DEALLOCATE."
+
+
+# Every test, in order. Each runs against a tournament of its own inside a
+# transaction that is rolled back afterwards, except those in COMMITTED which
+# read their writes back from another connection or write from several.
+TESTS = [testCreateTournament, testDeleteMatches, testDelete, testCount,
+         testRegister, testRegisterCountDelete, testStandingsBeforeMatches,
+         testReportMatches, testPairings, testPreventRematch,
+         testUnevenPlayers, testReportDrawnGame, testRankOMWSameNumberOfWins,
+         testSharedSession, testRegisterRoster, testReportRound,
+         testStandingsMaintained, testPairingsEveryPlayerOnce, testTiebreaks,
+         testStandingsCache, testInstrumentation, testPairAllTournaments,
+         testTournamentState, testStreamingExport, testRoundLifecycle,
+         testArchiveTournament, testWeightedPairings, testLiveStandings,
+         testSimulateTournament, testPreparedStatements,
+         testStartedRoundReportedByMatch, testLongEventPairing,
+         testConcurrentReports, testPreparedAfterReset]
+COMMITTED = [testLiveStandings, testConcurrentReports,
+             testPreparedAfterReset]
+
+
+def runTest(test):
+    """Run one test, giving it a new tournament if it takes one."""
+    if test in COMMITTED:
+        tourn_id = createTournament(test.__name__, datetime.date.today())
+        try:
+            test(tourn_id)
+        finally:
+            resetTournament(tourn_id)
+        return
+    with fixtures.rolledBack():
+        if test.__code__.co_argcount:
+            test(createTournament(test.__name__, datetime.date.today()))
+        else:
+            test()
+
+
+def runWorker(index, names):
+    """Run the named tests against a copy of the template database."""
+    database = "tournament_test_%d" % index
+    configure(fixtures.cloneDatabase(database))
+    try:
+        for name in names:
+            runTest(globals()[name])
+    finally:
+        getSession().close()
+        fixtures.dropDatabase(database)
+
+
 if __name__ == '__main__':
-    tourn_id = testCreateTournament()
-    testDeleteMatches(tourn_id)
-    testDelete(tourn_id)
-    testCount(tourn_id)
-    testRegister(tourn_id)
-    testRegisterCountDelete(tourn_id)
-    testStandingsBeforeMatches(tourn_id)
-    testReportMatches(tourn_id)
-    testPairings(tourn_id)
-    testPreventRematch(tourn_id)
-    testUnevenPlayers(tourn_id)
-    testReportDrawnGame(tourn_id)
-    testRankOMWSameNumberOfWins(tourn_id)
+    parser = argparse.ArgumentParser(description="Tournament API tests.")
+    parser.add_argument("--parallel", type=int, default=0,
+                        help="run the tests in this many processes, each "
+                             "with a database cloned from a template")
+    args = parser.parse_args()
+    if args.parallel:
+        fixtures.createTemplate()
+        workers = [multiprocessing.Process(
+            target=runWorker,
+            args=(i, [t.__name__ for t in TESTS[i::args.parallel]]))
+            for i in range(args.parallel)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        fixtures.dropDatabase(fixtures.TEMPLATE)
+        if any(worker.exitcode for worker in workers):
+            sys.exit("Some tests failed.")
+    else:
+        for test in TESTS:
+            runTest(test)
     print "Success!  All tests pass!"